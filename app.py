@@ -1,60 +1,145 @@
+from startup import StartupTimer
+import logging
 import os
-from flask import Flask
+import threading
+import time
+from flask import Flask, g, request
 from flask_login import LoginManager
-from pymongo import MongoClient
 from routes import register_routes
-from models import User
-from bson.objectid import ObjectId
+from user_cache import get_user
 from dotenv import load_dotenv
+from database import get_database
+from db_setup import bootstrap_database, DATE_FORMAT
+from uploads import UploadRequest, upload_limit, DEFAULT_MAX_UPLOAD_MB
+from metrics import HTTP_REQUEST_SECONDS
+from tracing import configure_logging, start_trace, end_trace, current_trace_id
 
-# We will need the `tika` library to extract text from PDFs and DOCX files.
-from tika import parser
+logger = logging.getLogger(__name__)
 
-# --- Flask App Configuration ---
-app = Flask(__name__)
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_secret_key')
-
-# --- File Upload Configuration ---
 UPLOAD_FOLDER = 'uploads'
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'assignments'), exist_ok=True)
-os.makedirs(os.path.join(UPLOAD_FOLDER, 'submissions'), exist_ok=True)
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'docx', 'doc'}
-
-# --- MongoDB Configuration ---
-MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
-DB_NAME = 'user_auth_db'
-
-try:
-    client = MongoClient(MONGO_URI)
-    db = client[DB_NAME]
-    app.db = db
-    print("Successfully connected to MongoDB.")
-except Exception as e:
-    print(f"Error connecting to MongoDB: {e}")
-    app.db = None
-
-# --- Flask-Login Configuration ---
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = 'login'
-
-@login_manager.user_loader
-def load_user(user_id):
-    if app.db is not None:
-        try:
-            user_doc = app.db.users.find_one({'_id': ObjectId(user_id)})
-            if user_doc:
-                return User(user_doc)
-        except Exception as e:
-            print(f"Error loading user with ID {user_id}: {e}")
-            return None
-    return None
-
-# --- Register Routes ---
-register_routes(app)
+# After a failed connection, requests get app.db = None for this long before the next attempt.
+DB_RETRY_SECONDS = 5
+
+
+class GradingApp(Flask):
+    """
+    Flask app that connects to MongoDB, and bootstraps it, on first use of
+    `app.db` instead of at import, so a web worker boots without waiting on the database.
+    """
+    request_class = UploadRequest
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._db_retry_at = 0.0
+
+    @property
+    def db(self):
+        if self._db is None:
+            self._connect_database()
+        return self._db
+
+    @db.setter
+    def db(self, value):
+        self._db = value
+
+    def _connect_database(self):
+        with self._db_lock:
+            if self._db is not None or time.monotonic() < self._db_retry_at:
+                return
+            start = time.perf_counter()
+            try:
+                db = get_database(self.config.get('MONGO_URI'))
+                if self.config['DB_BOOTSTRAP_ON_STARTUP']:
+                    bootstrap_database(db)
+            except Exception as e:
+                logger.error("Error connecting to MongoDB: %s", e)
+                self._db_retry_at = time.monotonic() + DB_RETRY_SECONDS
+                return
+            self._db = db
+            logger.info("Connected to MongoDB in %.0f ms.", (time.perf_counter() - start) * 1000)
+
+
+def create_app(config=None):
+    """
+    Builds the web app. The OCR and AI client stacks are only imported by the
+    grading paths, and the database is connected on first use.
+    """
+    timer = StartupTimer('Web app')
+    with timer.phase('config'):
+        load_dotenv()
+        configure_logging()
+
+        app = GradingApp(__name__)
+        app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'default_secret_key')
+        app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
+        app.config['ALLOWED_EXTENSIONS'] = {'pdf', 'docx', 'doc'}
+        app.config['MAX_CONTENT_LENGTH'] = upload_limit('MAX_UPLOAD_MB', DEFAULT_MAX_UPLOAD_MB)
+        app.config['MONGO_URI'] = os.environ.get('MONGO_URI')
+        app.config['DB_BOOTSTRAP_ON_STARTUP'] = os.environ.get('DB_BOOTSTRAP_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+        app.config['DUPLICATE_INDEX_ON_UPLOAD'] = os.environ.get('DUPLICATE_INDEX_ON_UPLOAD', 'true').lower() in ('1', 'true', 'yes')
+        app.config.update(config or {})
+        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'assignments'), exist_ok=True)
+        os.makedirs(os.path.join(app.config['UPLOAD_FOLDER'], 'submissions'), exist_ok=True)
+
+    with timer.phase('routes'):
+        register_request_hooks(app)
+        register_login(app)
+        register_routes(app)
+
+    app.config['STARTUP_REPORT'] = timer.log_report()
+    return app
+
+
+def register_request_hooks(app):
+    @app.template_filter('datetime')
+    def format_datetime(value):
+        # Older documents may still hold dates as strings until migrated.
+        return value.strftime(DATE_FORMAT) if hasattr(value, 'strftime') else (value or '')
+
+    # --- Request Tracing and Metrics ---
+    @app.before_request
+    def start_request_trace():
+        g.request_started = time.perf_counter()
+        g.trace_tokens = start_trace(request.headers.get('X-Request-ID'))
+
+    @app.after_request
+    def record_request(response):
+        duration = time.perf_counter() - g.request_started
+        endpoint = request.endpoint or 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(duration, endpoint=endpoint, method=request.method, status=response.status_code)
+        response.headers['X-Request-ID'] = current_trace_id()
+        logger.info('%s %s %s', request.method, request.path, response.status_code, extra={
+            'endpoint': endpoint, 'status': response.status_code, 'duration_ms': round(duration * 1000, 2)
+        })
+        return response
+
+    @app.teardown_request
+    def end_request_trace(error=None):
+        tokens = g.pop('trace_tokens', None)
+        if tokens:
+            end_trace(tokens)
+
+
+def register_login(app):
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.login_view = 'login'
+
+    @login_manager.user_loader
+    def load_user(user_id):
+        if app.db is not None:
+            try:
+                return get_user(app.db, user_id)
+            except Exception as e:
+                logger.warning("Error loading user with ID %s: %s", user_id, e)
+                return None
+        return None
+
+
+# Module-level app for `python app.py` and WSGI servers pointed at app:app.
+app = create_app()
 
 if __name__ == '__main__':
-    from dotenv import load_dotenv
-    load_dotenv()
     app.run(host='0.0.0.0', port=5000, debug=True)
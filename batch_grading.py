@@ -0,0 +1,255 @@
+import contextvars
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime
+from bson.objectid import ObjectId
+from pdf_text import extract_pdf, extraction_settings
+from ocr_cache import file_sha256, get_cached_extraction, store_extraction
+from storage import get_storage, resolve_file
+from grading import (
+    evaluate_submission_text, grade_submission_file, check_reference_ready, GradingError, GRADING_MODE_IMAGES, AI_CALL_LIMITER
+)
+from job_queue import active_jobs_for_assignment
+import metrics
+
+logger = logging.getLogger(__name__)
+
+BATCH_PENDING = 'pending'
+BATCH_RUNNING = 'running'
+BATCH_DONE = 'done'
+BATCH_FAILED = 'failed'
+
+DEFAULT_AI_CONCURRENCY = 4
+DEFAULT_AI_REQUESTS_PER_MINUTE = 60
+
+
+class RateLimiter:
+    """
+    Spaces out calls so that at most `requests_per_minute` start in any minute.
+    Safe to share between threads.
+    """
+
+    def __init__(self, requests_per_minute):
+        self.interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_slot = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            wait = self._next_slot - now
+            self._next_slot = max(now, self._next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+
+def batch_settings():
+    """
+    Reads the batch grading limits from the environment.
+    """
+    return {
+        'ocr_workers': int(os.environ.get('BATCH_OCR_WORKERS', os.cpu_count() or 1)),
+        'ai_concurrency': int(os.environ.get('BATCH_AI_CONCURRENCY', DEFAULT_AI_CONCURRENCY)),
+        'ai_requests_per_minute': float(os.environ.get('BATCH_AI_REQUESTS_PER_MINUTE', DEFAULT_AI_REQUESTS_PER_MINUTE))
+    }
+
+
+def pending_submissions(db, assignment_id):
+    """
+    Returns the ungraded submissions of an assignment that are not already queued on their own.
+    """
+    queued = active_jobs_for_assignment(db, 'grade_submission', assignment_id)
+    submissions = db.submissions.find({'assignment_id': ObjectId(assignment_id), 'ai_score': {'$in': [None, '']}})
+    return [doc for doc in submissions if str(doc['_id']) not in queued]
+
+
+def create_batch(db, assignment_id, teacher_id):
+    """
+    Records a new batch for every pending submission of an assignment and returns its id.
+    """
+    submission_ids = [str(doc['_id']) for doc in pending_submissions(db, assignment_id)]
+    now = datetime.now()
+    batch_id = db.grading_batches.insert_one({
+        'assignment_id': assignment_id,
+        'teacher_id': teacher_id,
+        'status': BATCH_PENDING,
+        'submission_ids': submission_ids,
+        'total': len(submission_ids),
+        'completed': 0,
+        'failed': 0,
+        'results': {},
+        'created_at': now,
+        'updated_at': now
+    }).inserted_id
+    return str(batch_id)
+
+
+def get_batch(db, batch_id):
+    return db.grading_batches.find_one({'_id': ObjectId(batch_id)})
+
+
+def active_batch_for_assignment(db, assignment_id):
+    """
+    Returns the batch currently grading an assignment, or None.
+    """
+    return db.grading_batches.find_one(
+        {'assignment_id': assignment_id, 'status': {'$in': [BATCH_PENDING, BATCH_RUNNING]}},
+        sort=[('created_at', -1)]
+    )
+
+
+def mark_batch_failed(db, batch_id, error):
+    """
+    Closes a batch whose job gave up, so the assignment can be batch graded again.
+    """
+    now = datetime.now()
+    db.grading_batches.update_one(
+        {'_id': ObjectId(batch_id), 'status': {'$in': [BATCH_PENDING, BATCH_RUNNING]}},
+        {'$set': {'status': BATCH_FAILED, 'error': str(error), 'finished_at': now, 'updated_at': now}}
+    )
+
+
+def serialize_batch(batch):
+    """
+    Converts a batch document into a JSON-friendly progress dict.
+    """
+    return {
+        'id': str(batch['_id']),
+        'assignment_id': batch['assignment_id'],
+        'status': batch['status'],
+        'total': batch['total'],
+        'completed': batch['completed'],
+        'failed': batch['failed'],
+        'error': batch.get('error'),
+        'results': batch.get('results', {}),
+        'created_at': batch['created_at'].isoformat(),
+        'finished_at': batch['finished_at'].isoformat() if batch.get('finished_at') else None
+    }
+
+
+def _record_outcome(db, batch_id, submission_id, outcome):
+    counter = 'completed' if outcome['status'] == 'graded' else 'failed'
+    db.grading_batches.update_one(
+        {'_id': ObjectId(batch_id)},
+        {
+            '$set': {f'results.{submission_id}': outcome, 'updated_at': datetime.now()},
+            '$inc': {counter: 1}
+        }
+    )
+
+
+def run_batch(db, batch_id, on_progress=None):
+    """
+    Grades every submission in a batch. Student PDFs are extracted across a process
+    pool and each extracted text is handed to a bounded, rate-limited pool of
+    evaluation threads as soon as it is ready.
+    `on_progress` is called after every finished submission.
+    """
+    batch = get_batch(db, batch_id)
+    if not batch:
+        raise GradingError('Batch not found.')
+
+    assignment_doc = db.assignments.find_one({'_id': ObjectId(batch['assignment_id'])})
+    if not assignment_doc:
+        raise GradingError('Assignment not found for this batch.')
+    check_reference_ready(assignment_doc)
+
+    settings = batch_settings()
+    limiter = RateLimiter(settings['ai_requests_per_minute'])
+    db.grading_batches.update_one(
+        {'_id': batch['_id']},
+        {'$set': {'status': BATCH_RUNNING, 'settings': settings, 'updated_at': datetime.now()}}
+    )
+
+    done = set(batch.get('results', {}))
+    submission_docs = {
+        str(doc['_id']): doc
+        for doc in db.submissions.find({'_id': {'$in': [ObjectId(sid) for sid in batch['submission_ids'] if sid not in done]}})
+    }
+    logger.info("Batch %s: grading %d submissions", batch_id, len(submission_docs))
+
+    def finish(submission_id, outcome):
+        _record_outcome(db, batch_id, submission_id, outcome)
+        if on_progress:
+            on_progress()
+
+    def paced(func, *args):
+        AI_CALL_LIMITER.set(limiter)
+        return func(*args)
+
+    def submit_evaluation(func, *args):
+        # Each evaluation runs in a copy of this context, so its logs and spans
+        # keep the job's trace id and the limiter setting stays with it.
+        ai_pool.submit(contextvars.copy_context().run, paced, func, *args)
+
+    def evaluate(submission_id, extraction):
+        try:
+            result = evaluate_submission_text(db, submission_docs[submission_id], assignment_doc, extraction['text'], extraction)
+            finish(submission_id, {'status': 'graded', 'score': result['score'], 'remarks': result['remarks']})
+        except Exception as e:
+            finish(submission_id, {'status': 'failed', 'stage': 'evaluation', 'error': str(e)})
+
+    def evaluate_file(submission_id, pdf_path):
+        try:
+            result = grade_submission_file(db, submission_docs[submission_id], assignment_doc, pdf_path)
+            finish(submission_id, {'status': 'graded', 'score': result['score'], 'remarks': result['remarks']})
+        except Exception as e:
+            finish(submission_id, {'status': 'failed', 'stage': 'evaluation', 'error': str(e)})
+
+    current_settings = extraction_settings()
+    storage = get_storage(db)
+    # Image-graded assignments skip the OCR pool; pages are rendered on the evaluation threads.
+    image_mode = assignment_doc.get('grading_mode') == GRADING_MODE_IMAGES
+
+    with ProcessPoolExecutor(max_workers=settings['ocr_workers']) as ocr_pool, \
+         ThreadPoolExecutor(max_workers=settings['ai_concurrency']) as ai_pool:
+        ocr_futures = {}
+        for submission_id, doc in submission_docs.items():
+            if image_mode:
+                try:
+                    submit_evaluation(evaluate_file, submission_id, resolve_file(storage, doc.get('sha256'), doc.get('file_path')))
+                except FileNotFoundError as e:
+                    finish(submission_id, {'status': 'failed', 'stage': 'evaluation', 'error': str(e)})
+                continue
+            try:
+                # Uploads record their hash; older submissions are hashed here.
+                sha256 = doc.get('sha256') or file_sha256(doc['file_path'])
+            except OSError as e:
+                finish(submission_id, {'status': 'failed', 'stage': 'ocr', 'error': str(e)})
+                continue
+            cached = get_cached_extraction(db, sha256, current_settings)
+            if cached is not None:
+                submit_evaluation(evaluate, submission_id, cached)
+                continue
+            try:
+                pdf_path = resolve_file(storage, doc.get('sha256'), doc.get('file_path'))
+            except FileNotFoundError as e:
+                finish(submission_id, {'status': 'failed', 'stage': 'ocr', 'error': str(e)})
+                continue
+            # Submissions are already spread across the pool, so each one OCRs its pages serially.
+            future = ocr_pool.submit(metrics.run_collecting, extract_pdf, pdf_path, current_settings, 1)
+            ocr_futures[future] = (submission_id, sha256)
+
+        for future in as_completed(ocr_futures):
+            submission_id, sha256 = ocr_futures[future]
+            try:
+                extraction, ocr_metrics = future.result()
+                metrics.merge(ocr_metrics)
+            except Exception as e:
+                finish(submission_id, {'status': 'failed', 'stage': 'ocr', 'error': str(e)})
+                continue
+            store_extraction(db, sha256, current_settings, extraction)
+            submit_evaluation(evaluate, submission_id, extraction)
+
+    db.grading_batches.update_one(
+        {'_id': batch['_id']},
+        {'$set': {'status': BATCH_DONE, 'finished_at': datetime.now(), 'updated_at': datetime.now()}}
+    )
+    batch = get_batch(db, batch_id)
+    logger.info("Batch %s finished: %d graded, %d failed", batch_id, batch['completed'], batch['failed'])
+    return {'total': batch['total'], 'completed': batch['completed'], 'failed': batch['failed']}
@@ -0,0 +1,415 @@
+"""
+Load test for the grading app: uploads, grading, the submissions list and the dashboard.
+
+Drives the real Flask routes through test clients at a target concurrency, with
+local stand-ins for Gemini, DeepSeek and the n8n webhooks, and reports p50/p95/p99
+latency, throughput and peak RSS per stage.
+
+    python -m benchmarks.run --students 40 --concurrency 8 --ai-latency 0.5 --ai-error-rate 0.05
+    python -m benchmarks.run --save-baseline benchmarks/baseline.json
+    python -m benchmarks.run --baseline benchmarks/baseline.json --tolerance 0.15
+
+MongoDB: mongomock by default (pip install mongomock), or --mongo-uri for a real
+server, in which case a separate database is used and dropped afterwards.
+
+OCR: --ocr real runs poppler and Tesseract on every synthetic scanned page.
+--ocr cached seeds the OCR cache with the rendered text, so only the web, queue
+and AI stages are measured.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.synthetic_pdfs import submission_set
+
+BENCH_DB_NAME = 'grading_benchmark'
+BENCH_CLASS = 'bench'
+BENCH_PASSWORD = 'bench'
+# Lower-is-better and higher-is-better fields compared against a baseline.
+LATENCY_FIELDS = ('p50_ms', 'p95_ms', 'p99_ms', 'peak_rss_mb')
+THROUGHPUT_FIELDS = ('throughput_per_s',)
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        # No procfs (e.g. macOS): fall back to the process-lifetime peak.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class RSSSampler:
+    """
+    Samples resident memory on a background thread and keeps the peak.
+    """
+
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+
+def summarize(latencies, errors, wall_seconds, peak_rss_mb):
+    values = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 2) if value is not None else None
+    return {
+        'count': len(values),
+        'errors': errors,
+        'p50_ms': to_ms(percentile(values, 0.50)),
+        'p95_ms': to_ms(percentile(values, 0.95)),
+        'p99_ms': to_ms(percentile(values, 0.99)),
+        'throughput_per_s': round(len(values) / wall_seconds, 2) if wall_seconds else None,
+        'wall_s': round(wall_seconds, 3),
+        'peak_rss_mb': round(peak_rss_mb, 1)
+    }
+
+
+def run_stage(name, tasks, concurrency):
+    """
+    Runs callables returning True on success at the given concurrency and
+    summarizes their latencies.
+    """
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def timed(task):
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            ok = task()
+        except Exception as e:
+            print(f"  {name}: {type(e).__name__}: {e}", file=sys.stderr)
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            errors += 0 if ok else 1
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(timed, tasks))
+        wall = time.perf_counter() - start
+    result = summarize(latencies, errors, wall, rss.peak_mb)
+    print(f"{name:<18} {format_stage(result)}")
+    return result
+
+
+def format_stage(result):
+    return (f"n={result['count']:<5} err={result['errors']:<3} p50={result['p50_ms']}ms "
+            f"p95={result['p95_ms']}ms p99={result['p99_ms']}ms {result['throughput_per_s']}/s "
+            f"rss={result['peak_rss_mb']}MB")
+
+
+class ClientPool:
+    """
+    One logged-in Flask test client per (user, thread), since test clients keep cookies.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def get(self, email):
+        clients = self._local.__dict__.setdefault('clients', {})
+        if email not in clients:
+            client = self.app.test_client()
+            client.post('/login', data={'email': email, 'password': BENCH_PASSWORD})
+            clients[email] = client
+        return clients[email]
+
+
+def configure_environment(args, workdir, mock):
+    os.environ.update({
+        'GEMINI_API_URL': f"{mock.url}/gemini",
+        'DEEPSEEK_API_URL': f"{mock.url}/deepseek",
+        'GEMINI_API_KEY': 'bench',
+        'DEEPSEEK_API_KEY': 'bench',
+        'NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK': f"{mock.url}/webhook/new_assignment",
+        'NOTIFICATION_EVALUATION_COMPLETE_WEBHOOK': f"{mock.url}/webhook/evaluation_complete",
+        'NOTIFICATION_COALESCE_SECONDS': '0.5',
+        'STORAGE_ROOT': os.path.join(workdir, 'storage'),
+        'LOG_LEVEL': args.log_level,
+    })
+
+
+def connect_database(args):
+    """
+    Points database.get_database at mongomock or at a scratch database, before the app imports it.
+    """
+    import database
+    database.DB_NAME = BENCH_DB_NAME
+    if args.mongo_uri:
+        os.environ['MONGO_URI'] = args.mongo_uri
+        database.get_database(args.mongo_uri).client.drop_database(BENCH_DB_NAME)
+        return
+    try:
+        import mongomock
+    except ImportError:
+        sys.exit('mongomock is not installed; pip install mongomock or pass --mongo-uri.')
+    client = mongomock.MongoClient()
+    database.MongoClient = lambda *args, **kwargs: client
+
+
+def seed(db, students):
+    """
+    Creates a teacher, `students` students and one assignment whose reference is ready.
+    """
+    from werkzeug.security import generate_password_hash
+    # Cheap hashes: logging in is setup, not something being measured.
+    password = generate_password_hash(BENCH_PASSWORD, method='pbkdf2:sha256:1000')
+    teacher_id = db.users.insert_one({
+        'username': 'teacher', 'email': 'teacher@bench', 'password': password,
+        'user_type': 'teacher', 'class_name': BENCH_CLASS, 'subject': 'Biology'
+    }).inserted_id
+    db.users.insert_many([
+        {'username': f"student{i}", 'email': f"student{i}@bench", 'password': password,
+         'user_type': 'student', 'class_name': BENCH_CLASS}
+        for i in range(students)
+    ])
+    assignment_id = db.assignments.insert_one({
+        'title': 'Photosynthesis', 'description': 'Explain photosynthesis.', 'due_date': '2030-01-01',
+        'class_name': BENCH_CLASS, 'subject': 'Biology', 'teacher_id': str(teacher_id),
+        'reference_text': 'Light energy is converted to chemical energy in chloroplasts.',
+        'reference_status': 'ready'
+    }).inserted_id
+    return str(assignment_id)
+
+
+def seed_ocr_cache(db, submissions):
+    from ocr_cache import store_extraction
+    from pdf_text import extraction_settings, METHOD_OCR
+    import hashlib
+    settings = extraction_settings()
+    for pages, pdf_bytes, text in submissions:
+        store_extraction(db, hashlib.sha256(pdf_bytes).hexdigest(), settings,
+                         {'text': text, 'page_methods': [METHOD_OCR] * pages})
+
+
+def run_grading_pipeline(db, workers, timeout):
+    """
+    Drains the job queue with `workers` worker threads and summarizes the
+    queue-to-finish time of every job.
+    """
+    from job_queue import claim_job, ACTIVE_STATUSES, JOB_DONE
+    from worker import process_job, JOB_HANDLERS
+
+    stop = threading.Event()
+
+    def work(worker_id):
+        while not stop.is_set():
+            job = claim_job(db, worker_id, JOB_HANDLERS.keys())
+            if job is None:
+                stop.wait(0.02)
+                continue
+            process_job(db, job)
+
+    with RSSSampler() as rss:
+        start = time.perf_counter()
+        threads = [threading.Thread(target=work, args=(f"bench-{i}",), daemon=True) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        deadline = time.monotonic() + timeout
+        while db.jobs.count_documents({'status': {'$in': ACTIVE_STATUSES}}) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        wall = time.perf_counter() - start
+
+    jobs = list(db.jobs.find({'type': 'grade_submission'}))
+    latencies = [(job['finished_at'] - job['created_at']).total_seconds() for job in jobs if job['status'] == JOB_DONE]
+    result = summarize(latencies, len(jobs) - len(latencies), wall, rss.peak_mb)
+    print(f"{'grade_pipeline':<18} {format_stage(result)}")
+    return result
+
+
+def pipeline_stage_timings():
+    """
+    Mean and count per grading_stage_seconds label, from the app's own metrics.
+    """
+    import metrics
+    stages = {}
+    for (stage,), state in metrics.STAGE_SECONDS._snapshot().items():
+        count, total = state[-1], state[-2]
+        stages[stage] = {'count': count, 'mean_ms': round(total / count * 1000, 2) if count else None}
+    return stages
+
+
+def run_benchmark(args):
+    from mock_services import MockAIServer
+
+    workdir = tempfile.mkdtemp(prefix='grading-bench-')
+    mock = MockAIServer(latency=args.ai_latency, error_rate=args.ai_error_rate).start()
+    try:
+        configure_environment(args, workdir, mock)
+        connect_database(args)
+        from app import app
+        from notification_outbox import start_dispatcher_thread
+        app.config['UPLOAD_FOLDER'] = os.path.join(workdir, 'uploads')
+        db = app.db
+
+        print(f"Generating {args.students} synthetic scanned submissions...")
+        submissions = submission_set(args.students, tuple(args.pages), seed=args.seed)
+        assignment_id = seed(db, args.students)
+        if args.ocr == 'cached':
+            seed_ocr_cache(db, submissions)
+        clients = ClientPool(app)
+        results = {}
+
+        def upload(i):
+            import io
+            pdf_bytes = submissions[i][1]
+            response = clients.get(f"student{i}@bench").post(
+                f"/upload_submission/{assignment_id}",
+                data={'file': (io.BytesIO(pdf_bytes), f"answer{i}.pdf")},
+                content_type='multipart/form-data'
+            )
+            return response.status_code < 400
+
+        results['upload_submission'] = run_stage(
+            'upload_submission', [lambda i=i: upload(i) for i in range(args.students)], args.concurrency)
+
+        submission_ids = [str(doc['_id']) for doc in db.submissions.find({}, {'_id': 1})]
+
+        def grade(submission_id):
+            response = clients.get('teacher@bench').post(
+                f"/grade_submission/{submission_id}", headers={'Accept': 'application/json'})
+            return response.status_code == 202
+
+        results['grade_submission'] = run_stage(
+            'grade_submission', [lambda s=s: grade(s) for s in submission_ids], args.concurrency)
+
+        stop_dispatcher = start_dispatcher_thread(db, poll_interval=0.2)
+        results['grade_pipeline'] = run_grading_pipeline(db, args.workers, args.grade_timeout)
+
+        pages = max(1, -(-args.students // 24))
+
+        def view(i):
+            response = clients.get('teacher@bench').get(
+                f"/submissions/{assignment_id}?page={i % pages + 1}&sort=score")
+            return response.status_code == 200
+
+        results['view_submissions'] = run_stage(
+            'view_submissions', [lambda i=i: view(i) for i in range(args.reads)], args.concurrency)
+
+        def dashboard(i):
+            email = 'teacher@bench' if i % 4 == 0 else f"student{i % args.students}@bench"
+            return clients.get(email).get('/dashboard').status_code == 200
+
+        results['dashboard'] = run_stage(
+            'dashboard', [lambda i=i: dashboard(i) for i in range(args.reads)], args.concurrency)
+
+        time.sleep(1.0)  # let coalesced notifications go out
+        stop_dispatcher.set()
+
+        return {
+            'config': {key: value for key, value in vars(args).items()
+                       if key not in ('baseline', 'save_baseline', 'output', 'mongo_uri')},
+            'stages': results,
+            'pipeline_stages': pipeline_stage_timings(),
+            'ai_requests': len(mock.requests) - len(mock.webhook_requests),
+            'webhook_calls': len(mock.webhook_requests)
+        }
+    finally:
+        mock.stop()
+        if args.mongo_uri:
+            import database
+            database.get_database(args.mongo_uri).client.drop_database(BENCH_DB_NAME)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def compare(results, baseline, tolerance):
+    """
+    Prints the change of every stage metric against a baseline and returns the
+    regressions larger than `tolerance` (a fraction, e.g. 0.1 for 10%).
+    """
+    regressions = []
+    print(f"\nAgainst baseline (tolerance {tolerance:.0%}):")
+    for stage, current in results['stages'].items():
+        previous = baseline.get('stages', {}).get(stage)
+        if not previous:
+            print(f"  {stage}: not in baseline")
+            continue
+        for field in LATENCY_FIELDS + THROUGHPUT_FIELDS:
+            old, new = previous.get(field), current.get(field)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = change > tolerance if field in LATENCY_FIELDS else change < -tolerance
+            flag = '  REGRESSION' if worse else ''
+            print(f"  {stage:<18} {field:<17} {old:>10} -> {new:<10} ({change:+.1%}){flag}")
+            if worse:
+                regressions.append((stage, field, old, new))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the grading app end to end with local AI stand-ins.')
+    parser.add_argument('--students', type=int, default=24, help='Students, and so submissions, to simulate.')
+    parser.add_argument('--pages', type=int, nargs='+', default=[1, 2, 4], help='Page counts cycled through the submissions.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients per HTTP stage.')
+    parser.add_argument('--workers', type=int, default=2, help='Grading worker threads.')
+    parser.add_argument('--reads', type=int, default=200, help='Requests for each read-only stage.')
+    parser.add_argument('--ai-latency', type=float, default=0.2, help='Seconds the mock AI APIs take per call.')
+    parser.add_argument('--ai-error-rate', type=float, default=0.0, help='Fraction of mock AI calls that return 503.')
+    parser.add_argument('--ocr', choices=['real', 'cached'], default='cached')
+    parser.add_argument('--grade-timeout', type=float, default=600)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mongo-uri', help='Use this MongoDB server instead of mongomock.')
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--output', help='Write the results as JSON to this file.')
+    parser.add_argument('--save-baseline', help='Write the results as the new baseline JSON.')
+    parser.add_argument('--baseline', help='Compare against this baseline JSON; exits 1 on regressions.')
+    parser.add_argument('--tolerance', type=float, default=0.10, help='Allowed relative regression (default 0.10).')
+    args = parser.parse_args(argv)
+
+    results = run_benchmark(args)
+    print(f"\nPipeline stages: {json.dumps(results['pipeline_stages'])}")
+    print(f"AI requests: {results['ai_requests']}, webhook calls: {results['webhook_calls']}")
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(results, baseline, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
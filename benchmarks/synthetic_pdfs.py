@@ -0,0 +1,71 @@
+import io
+import random
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+
+PAGE_SIZE = (1275, 1650)  # US Letter at 150 DPI
+LINES_PER_PAGE = 28
+
+WORDS = (
+    'photosynthesis converts light energy into chemical energy stored in glucose '
+    'the chloroplast contains chlorophyll which absorbs red and blue light '
+    'carbon dioxide and water are the inputs while oxygen is released '
+    'the calvin cycle fixes carbon in the stroma using ATP and NADPH '
+    'cellular respiration releases that energy in the mitochondria'
+).split()
+
+
+def answer_text(rng, pages):
+    """
+    Returns the lines of a plausible student answer, one list per page.
+    """
+    return [
+        [' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 11))) for _ in range(LINES_PER_PAGE)]
+        for _ in range(pages)
+    ]
+
+
+def render_page(lines, rng, font):
+    """
+    Draws text like a scanned sheet: grey paper, slight rotation, blur and speckle noise.
+    """
+    page = Image.new('L', PAGE_SIZE, color=rng.randint(232, 250))
+    draw = ImageDraw.Draw(page)
+    y = 90
+    for line in lines:
+        draw.text((100 + rng.randint(-4, 4), y), line, fill=rng.randint(10, 60), font=font)
+        y += 52
+    for _ in range(1500):
+        draw.point((rng.randrange(PAGE_SIZE[0]), rng.randrange(PAGE_SIZE[1])), fill=rng.randint(90, 200))
+    page = page.rotate(rng.uniform(-1.5, 1.5), fillcolor=240, resample=Image.BICUBIC)
+    return page.filter(ImageFilter.GaussianBlur(0.6))
+
+
+def scanned_pdf(pages, seed=0):
+    """
+    Returns (pdf bytes, text) for an image-only PDF of `pages` pages, so
+    extraction has to go through OCR rather than the text layer.
+    """
+    rng = random.Random(seed)
+    font = ImageFont.load_default(size=28)
+    text_pages = answer_text(rng, pages)
+    images = [render_page(lines, rng, font) for lines in text_pages]
+
+    buffer = io.BytesIO()
+    images[0].save(buffer, format='PDF', resolution=150, save_all=True, append_images=images[1:])
+    for image in images:
+        image.close()
+    text = '\f'.join('\n'.join(lines) for lines in text_pages)
+    return buffer.getvalue(), text
+
+
+def submission_set(count, page_counts=(1, 2, 4, 8), seed=0):
+    """
+    Generates `count` distinct submissions cycling through `page_counts`.
+    Returns a list of (pages, pdf bytes, text).
+    """
+    submissions = []
+    for i in range(count):
+        pages = page_counts[i % len(page_counts)]
+        pdf_bytes, text = scanned_pdf(pages, seed=seed + i)
+        submissions.append((pages, pdf_bytes, text))
+    return submissions
@@ -0,0 +1,14 @@
+import os
+from pymongo import MongoClient
+
+DEFAULT_MONGO_URI = 'mongodb://localhost:27017/'
+DB_NAME = 'user_auth_db'
+
+def get_database(mongo_uri=None):
+    """
+    Connects to MongoDB and returns the application database.
+    Shared by the web app and the background grading worker.
+    """
+    mongo_uri = mongo_uri or os.environ.get('MONGO_URI', DEFAULT_MONGO_URI)
+    client = MongoClient(mongo_uri)
+    return client[DB_NAME]
@@ -0,0 +1,228 @@
+import argparse
+import logging
+from datetime import datetime
+from bson.objectid import ObjectId
+from dotenv import load_dotenv
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import OperationFailure
+from job_queue import ensure_job_indexes
+from ocr_cache import ensure_ocr_cache_indexes
+from evaluation_cache import ensure_evaluation_cache_indexes
+from notification_outbox import ensure_outbox_indexes
+from similarity import ensure_similarity_indexes
+from storage import ensure_storage_indexes
+from prompt_builder import parse_score
+
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+logger = logging.getLogger(__name__)
+
+# Indexes backing the hot queries in routes.py and queries.py, per collection.
+INDEXES = {
+    'users': [
+        ([('email', ASCENDING)], {'unique': True, 'name': 'email_unique'}),
+        ([('class_name', ASCENDING), ('user_type', ASCENDING)], {'name': 'class_user_type'}),
+    ],
+    'assignments': [
+        ([('class_name', ASCENDING), ('teacher_id', ASCENDING), ('due_date', ASCENDING)], {'name': 'class_teacher_due'}),
+        ([('class_name', ASCENDING), ('due_date', ASCENDING)], {'name': 'class_due'}),
+    ],
+    'submissions': [
+        ([('assignment_id', ASCENDING), ('student_id', ASCENDING)], {'unique': True, 'name': 'assignment_student_unique'}),
+        ([('student_id', ASCENDING), ('assignment_id', ASCENDING)], {'name': 'student_assignment'}),
+        ([('assignment_id', ASCENDING), ('upload_date', DESCENDING)], {'name': 'assignment_upload_date'}),
+        ([('assignment_id', ASCENDING), ('ai_evaluation_key', ASCENDING)], {'name': 'assignment_evaluation_key'}),
+        ([('assignment_id', ASCENDING), ('ai_graded_date', ASCENDING)], {'name': 'assignment_graded_date'}),
+        ([('assignment_id', ASCENDING), ('near_duplicates.submission_id', ASCENDING)], {'name': 'assignment_near_duplicates'}),
+    ],
+    'grading_batches': [
+        ([('assignment_id', ASCENDING), ('status', ASCENDING), ('created_at', DESCENDING)], {'name': 'assignment_status_created'}),
+    ],
+}
+
+
+def ensure_indexes(db):
+    """
+    Builds every declared index. Returns the names of indexes that could not be
+    built (e.g. a unique index over existing duplicates) with the reason.
+    """
+    failures = {}
+    for collection_name, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                db[collection_name].create_index(keys, **options)
+            except OperationFailure as e:
+                failures[f"{collection_name}.{options['name']}"] = str(e)
+
+    ensure_job_indexes(db)
+    ensure_ocr_cache_indexes(db)
+    ensure_evaluation_cache_indexes(db)
+    ensure_outbox_indexes(db)
+    ensure_similarity_indexes(db)
+    ensure_storage_indexes(db)
+    return failures
+
+
+def report_indexes(db):
+    """
+    Compares declared indexes with the ones in the database and reports which
+    are missing and which have not been used since the server started.
+    """
+    report = {'missing': [], 'unused': []}
+    for collection_name, indexes in INDEXES.items():
+        existing = db[collection_name].index_information()
+        for _, options in indexes:
+            if options['name'] not in existing:
+                report['missing'].append(f"{collection_name}.{options['name']}")
+
+        try:
+            usage = db[collection_name].aggregate([{'$indexStats': {}}])
+            for stat in usage:
+                if stat['name'] != '_id_' and stat['accesses']['ops'] == 0:
+                    report['unused'].append(f"{collection_name}.{stat['name']}")
+        except OperationFailure:
+            # $indexStats needs the clusterMonitor role; report what we can.
+            pass
+    return report
+
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        return None
+
+
+def migrate_submission_types(db, batch_size=500):
+    """
+    Converts string assignment_id/student_id to ObjectId and string
+    upload_date/ai_graded_date to datetime on submissions, so the compound
+    indexes match and dates can be range-queried and sorted correctly.
+    """
+    query = {'$or': [
+        {'assignment_id': {'$type': 'string'}},
+        {'student_id': {'$type': 'string'}},
+        {'upload_date': {'$type': 'string'}},
+        {'ai_graded_date': {'$type': 'string'}},
+    ]}
+    fields = {'assignment_id': 1, 'student_id': 1, 'upload_date': 1, 'ai_graded_date': 1}
+
+    converted = 0
+    operations = []
+    for doc in db.submissions.find(query, fields):
+        update = {}
+        for field in ('assignment_id', 'student_id'):
+            if isinstance(doc.get(field), str) and ObjectId.is_valid(doc[field]):
+                update[field] = ObjectId(doc[field])
+        for field in ('upload_date', 'ai_graded_date'):
+            if isinstance(doc.get(field), str):
+                parsed = _parse_date(doc[field])
+                if parsed:
+                    update[field] = parsed
+        if update:
+            operations.append(UpdateOne({'_id': doc['_id']}, {'$set': update}))
+        if len(operations) >= batch_size:
+            converted += db.submissions.bulk_write(operations, ordered=False).modified_count
+            operations = []
+    if operations:
+        converted += db.submissions.bulk_write(operations, ordered=False).modified_count
+    return converted
+
+
+def migrate_reference_ready_dates(db):
+    """
+    Converts string reference_ready_date values on assignments to datetime.
+    """
+    operations = []
+    for doc in db.assignments.find({'reference_ready_date': {'$type': 'string'}}, {'reference_ready_date': 1}):
+        parsed = _parse_date(doc['reference_ready_date'])
+        if parsed:
+            operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'reference_ready_date': parsed}}))
+    if not operations:
+        return 0
+    return db.assignments.bulk_write(operations, ordered=False).modified_count
+
+
+def migrate_submission_scores(db):
+    """
+    Converts string ai_score values on submissions to numbers. Scores that are
+    not numbers (e.g. 'N/A') are cleared, so the submission is graded again.
+    """
+    operations = []
+    for doc in db.submissions.find({'ai_score': {'$type': 'string'}}, {'ai_score': 1}):
+        operations.append(UpdateOne({'_id': doc['_id']}, {'$set': {'ai_score': parse_score(doc['ai_score'])}}))
+    if not operations:
+        return 0
+    return db.submissions.bulk_write(operations, ordered=False).modified_count
+
+
+def drop_outbox_dedupe_index(db):
+    """
+    Drops the outbox's first dedupe_key index, whose filter did not exclude
+    events without a key; ensure_indexes builds its replacement.
+    """
+    try:
+        db.notification_outbox.drop_index('dedupe_key_1')
+    except OperationFailure:
+        return 0
+    return 1
+
+
+# Applied in order and recorded in the migrations collection so each runs once.
+MIGRATIONS = [
+    ('0001_submission_field_types', migrate_submission_types),
+    ('0002_reference_ready_date', migrate_reference_ready_dates),
+    ('0003_outbox_dedupe_index', drop_outbox_dedupe_index),
+    ('0004_submission_scores', migrate_submission_scores),
+]
+
+
+def migrate(db):
+    """
+    Runs the migrations that have not been applied yet. Returns their names.
+    """
+    applied = {doc['_id'] for doc in db.migrations.find({}, {'_id': 1})}
+    ran = []
+    for name, migration in MIGRATIONS:
+        if name in applied:
+            continue
+        result = migration(db)
+        db.migrations.insert_one({'_id': name, 'applied_at': datetime.now(), 'result': result})
+        logger.info("Applied migration %s: %s", name, result)
+        ran.append(name)
+    return ran
+
+
+def bootstrap_database(db):
+    """
+    Applies pending migrations, then builds indexes. Safe to run on every startup.
+    """
+    migrate(db)
+    failures = ensure_indexes(db)
+    for name, reason in failures.items():
+        logger.warning("Could not build index %s: %s", name, reason)
+    return failures
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    from database import get_database
+    from tracing import configure_logging
+    configure_logging()
+
+    parser = argparse.ArgumentParser(description='Create MongoDB indexes and run data migrations.')
+    parser.add_argument('command', choices=['bootstrap', 'indexes', 'migrate', 'report'], nargs='?', default='bootstrap')
+    args = parser.parse_args()
+
+    db = get_database()
+    if args.command == 'migrate':
+        print(f"Applied: {migrate(db) or 'nothing to do'}")
+    elif args.command == 'indexes':
+        failures = ensure_indexes(db)
+        print(f"Index failures: {failures or 'none'}")
+    elif args.command == 'bootstrap':
+        bootstrap_database(db)
+
+    report = report_indexes(db)
+    print(f"Missing indexes: {', '.join(report['missing']) or 'none'}")
+    print(f"Unused indexes: {', '.join(report['unused']) or 'none'}")
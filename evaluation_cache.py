@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta, timezone
+from pymongo import ASCENDING
+from metrics import EVALUATION_CACHE_LOOKUPS
+
+DEFAULT_TTL_SECONDS = 30 * 24 * 60 * 60
+
+
+def normalize_student_text(text):
+    """
+    Collapses whitespace so re-OCR'd or re-uploaded copies of the same answer share a key.
+    """
+    return ' '.join(text.split())
+
+
+def evaluation_key(reference_text, student_text, model, prompt_version):
+    """
+    Hashes everything that determines the model's evaluation.
+    """
+    material = json.dumps([reference_text, normalize_student_text(student_text), model, prompt_version])
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+
+def ensure_evaluation_cache_indexes(db):
+    """
+    Lets MongoDB expire entries on its own and supports invalidation per assignment.
+    The TTL monitor reads expires_at as UTC, so it is always written in UTC.
+    """
+    db.evaluation_cache.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+    db.evaluation_cache.create_index([('assignment_id', ASCENDING)])
+
+
+def get_cached_evaluation(db, key):
+    """
+    Returns the cached evaluation for a key, or None. Hits and misses are
+    counted in process, by the evaluation_cache_lookups_total metric.
+    """
+    entry = db.evaluation_cache.find_one({'_id': key, 'expires_at': {'$gt': datetime.now(timezone.utc)}})
+    EVALUATION_CACHE_LOOKUPS.inc(result='miss' if entry is None else 'hit')
+    if entry is None:
+        return None
+    return {'score': entry['score'], 'remarks': entry['remarks'], 'truncated': entry.get('truncated', False)}
+
+
+def store_evaluation(db, key, evaluation, assignment_id, ttl_seconds=None):
+    """
+    Caches an evaluation for `ttl_seconds` (EVALUATION_CACHE_TTL_SECONDS by default).
+    """
+    if ttl_seconds is None:
+        ttl_seconds = int(os.environ.get('EVALUATION_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    now = datetime.now(timezone.utc)
+    db.evaluation_cache.update_one(
+        {'_id': key},
+        {'$set': {
+            'score': evaluation['score'],
+            'remarks': evaluation['remarks'],
+            'truncated': evaluation.get('truncated', False),
+            'assignment_id': assignment_id,
+            'created_at': now,
+            'expires_at': now + timedelta(seconds=ttl_seconds)
+        }},
+        upsert=True
+    )
+
+
+def invalidate_evaluation(db, key):
+    db.evaluation_cache.delete_one({'_id': key})
+
+
+def invalidate_assignment_evaluations(db, assignment_id):
+    """
+    Drops every cached evaluation for an assignment, e.g. after its reference changes.
+    """
+    return db.evaluation_cache.delete_many({'assignment_id': assignment_id}).deleted_count
+
+
+def cache_stats():
+    """
+    Returns this process's cache hits and misses.
+    """
+    return {'hits': EVALUATION_CACHE_LOOKUPS.value(result='hit'), 'misses': EVALUATION_CACHE_LOOKUPS.value(result='miss')}
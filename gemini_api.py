@@ -1,44 +1,91 @@
 import base64
 import json
+import logging
 import os
-import requests
 import time
-from retrying import retry
-from PIL import Image
-import io
+import requests
+from http_client import post_json
+from metrics import AI_REQUEST_SECONDS, AI_CHARACTERS, AI_TOKENS
+from tracing import span
+
+logger = logging.getLogger(__name__)
 
 GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent"
 DEEPSEEK_API_URL = "https://api.deepseek.com/chat/completions"
 
-def _prepare_image_data(images):
-    """Encodes PIL images to base64 for API payload."""
-    image_parts = []
-    for img in images:
-        buffered = io.BytesIO()
-        img.save(buffered, format="JPEG")
-        encoded_image = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        image_parts.append({
-            "inlineData": {
-                "mimeType": "image/jpeg",
-                "data": encoded_image
-            }
-        })
-    return image_parts
+# Stands in a request's parts for the page images, which are streamed in separately.
+IMAGE_PARTS_PLACEHOLDER = '__image_parts__'
+BASE64_CHUNK_BYTES = 3 * 64 * 1024  # a multiple of 3, so encoded slices concatenate cleanly
+TRANSCRIPTION_PROMPT = (
+    "Transcribe all handwritten and printed text on these pages in reading order. "
+    "Output only the transcription, with no commentary."
+)
 
+def evaluation_model():
+    """
+    Returns the name of the Gemini model that evaluations are sent to.
+    """
+    api_url = os.environ.get("GEMINI_API_URL", GEMINI_API_URL)
+    if '/models/' in api_url:
+        return api_url.split('/models/', 1)[1].split(':', 1)[0]
+    return api_url
 
-def call_deepseek_api_for_summarization(text_content):
+def record_ai_call(api, sent_chars, received_text, result, outcome, seconds):
     """
-    Calls the DeepSeek API to summarize the reference answer text.
+    Records latency, payload sizes and the token usage the API reports for one call.
     """
-    @retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5)
-    def _call_with_retry():
-        api_key = os.environ.get("DEEPSEEK_API_KEY", "")
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
-        
-        prompt = f"""
+    AI_REQUEST_SECONDS.observe(seconds, api=api, outcome=outcome)
+    AI_CHARACTERS.observe(sent_chars, api=api, direction='sent')
+    if received_text:
+        AI_CHARACTERS.observe(len(received_text), api=api, direction='received')
+    result = result or {}
+    usage = result.get('usageMetadata') or result.get('usage') or {}
+    prompt_tokens = usage.get('promptTokenCount', usage.get('prompt_tokens'))
+    output_tokens = usage.get('candidatesTokenCount', usage.get('completion_tokens'))
+    if prompt_tokens:
+        AI_TOKENS.inc(prompt_tokens, api=api, kind='prompt')
+    if output_tokens:
+        AI_TOKENS.inc(output_tokens, api=api, kind='output')
+
+def _stream_image_parts(pages):
+    """
+    Yields the JSON of one inlineData part per JPEG page, base64-encoding each page
+    in slices so the encoded images never all sit in memory at once.
+    """
+    for index, page in enumerate(pages):
+        yield (b',' if index else b'') + b'{"inlineData":{"mimeType":"image/jpeg","data":"'
+        for start in range(0, len(page), BASE64_CHUNK_BYTES):
+            yield base64.b64encode(page[start:start + BASE64_CHUNK_BYTES])
+        yield b'"}}'
+
+def _streamed_payload(payload, pages):
+    """
+    Returns a function yielding `payload` as JSON, with the page images streamed
+    in where IMAGE_PARTS_PLACEHOLDER stands (see http_client.post_json).
+    """
+    head, tail = json.dumps(payload).encode('utf-8').split(json.dumps(IMAGE_PARTS_PLACEHOLDER).encode('utf-8'))
+
+    def body():
+        yield head
+        yield from _stream_image_parts(pages)
+        yield tail
+    return body
+
+def _images_size(pages):
+    return sum((len(page) + 2) // 3 * 4 for page in pages)
+
+
+def build_summarization_request(text_content):
+    """
+    Returns the URL, headers and payload of a DeepSeek summarization request.
+    """
+    api_key = os.environ.get("DEEPSEEK_API_KEY", "")
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {api_key}'
+    }
+    
+    prompt = f"""
         Summarize the following reference answer text into a concise, well-structured json format that can be used for automated grading.
         The summary should retain all key points and facts.
         
@@ -46,97 +93,184 @@ def call_deepseek_api_for_summarization(text_content):
         {text_content}
         """
 
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "You are a helpful assistant that summarizes reference materials for grading."},
-                {"role": "user", "content": prompt}
-            ],
-            "temperature": 0.5,
-            "response_format": {"type": "json_object"}
-        }
-        
-        print("--- Sending to DeepSeek API for Summarization ---")
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload)
-        
-        print("--- DeepSeek API Response Status Code ---")
-        print(response.status_code)
-        print("--- DeepSeek API Response Body ---")
-        print(response.text)
-        
-        response.raise_for_status()
-        return response.json()
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant that summarizes reference materials for grading."},
+            {"role": "user", "content": prompt}
+        ],
+        "temperature": 0.5,
+        "response_format": {"type": "json_object"}
+    }
+    api_url = os.environ.get("DEEPSEEK_API_URL", DEEPSEEK_API_URL)
+    return api_url, headers, payload
+
+def parse_summarization_response(result):
+    """
+    Extracts the summary from a DeepSeek response, or returns None.
+    """
+    if result and 'choices' in result and result['choices']:
+        return result['choices'][0]['message']['content']
+    
+    logger.warning("DeepSeek response had no choices")
+    return None
+
+def _gemini_payload(parts, response_mime_type='application/json', max_output_tokens=2048):
+    return {
+        'contents': [{'parts': parts}],
+        'generationConfig': {
+            'candidateCount': 1,
+            'maxOutputTokens': max_output_tokens,
+            'responseMimeType': response_mime_type
+        },
+        'safetySettings': [
+            {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
+            {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
+            {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'},
+            {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
+        ]
+    }
+
+def _gemini_endpoint():
+    headers = {'Content-Type': 'application/json'}
+    api_key = os.environ.get("GEMINI_API_KEY", "")
+    params = {'key': api_key}
+    api_url = os.environ.get("GEMINI_API_URL", GEMINI_API_URL)
+    return api_url, headers, params
+
+def build_evaluation_request(prompt_text, text_content):
+    """
+    Returns the URL, headers, query params and payload of a Gemini evaluation request.
+    """
+    parts = [
+        {'text': prompt_text},
+        {'text': text_content}
+    ]
+    api_url, headers, params = _gemini_endpoint()
+    return api_url, headers, params, _gemini_payload(parts)
+
+def build_image_evaluation_request(prompt_text, pages):
+    """
+    Like build_evaluation_request, with the student's answer sent as JPEG page
+    images. The payload is a function streaming the JSON body.
+    """
+    api_url, headers, params = _gemini_endpoint()
+    payload = _gemini_payload([{'text': prompt_text}, IMAGE_PARTS_PLACEHOLDER])
+    return api_url, headers, params, _streamed_payload(payload, pages)
+
+def build_transcription_request(pages):
+    """
+    Returns a Gemini request asking for the plain-text transcription of JPEG page images.
+    """
+    api_url, headers, params = _gemini_endpoint()
+    payload = _gemini_payload([{'text': TRANSCRIPTION_PROMPT}, IMAGE_PARTS_PLACEHOLDER],
+                              response_mime_type='text/plain', max_output_tokens=8192)
+    return api_url, headers, params, _streamed_payload(payload, pages)
+
+def _candidate_text(result):
+    if result and 'candidates' in result and result['candidates'] and \
+       'content' in result['candidates'][0] and 'parts' in result['candidates'][0]['content']:
+        return result['candidates'][0]['content']['parts'][0]['text']
+    return None
+
+def parse_evaluation_response(result):
+    """
+    Extracts and decodes the JSON evaluation from a Gemini response, or returns None.
+    Raises json.JSONDecodeError if the model's text is not valid JSON.
+    """
+    text_response = _candidate_text(result)
+    if text_response is not None:
+        logger.debug("Gemini returned %d characters", len(text_response))
+        return json.loads(text_response)
+    
+    logger.warning("Gemini response had no candidate text", extra={'finish_reason': _finish_reason(result)})
+    return None
 
+def parse_transcription_response(result):
+    """
+    Returns the transcribed text from a Gemini response, or None.
+    """
+    text_response = _candidate_text(result)
+    if text_response is None:
+        logger.warning("Gemini transcription had no candidate text", extra={'finish_reason': _finish_reason(result)})
+    return text_response
+
+def _finish_reason(result):
+    candidates = (result or {}).get('candidates') or [{}]
+    return candidates[0].get('finishReason') or (result or {}).get('promptFeedback', {}).get('blockReason')
+
+def call_deepseek_api_for_summarization(text_content):
+    """
+    Calls the DeepSeek API to summarize the reference answer text.
+    """
+    start = time.perf_counter()
+    result = summary = None
+    outcome = 'error'
     try:
-        result = _call_with_retry()
-        if result and 'choices' in result and result['choices']:
-            return result['choices'][0]['message']['content']
-        
-        print("--- Failed to get a valid response from DeepSeek AI. ---")
-        return None
+        api_url, headers, payload = build_summarization_request(text_content)
+        logger.info("Sending reference text to DeepSeek for summarization", extra={'chars': len(text_content)})
+        with span('deepseek.summarize', stage='summarization'):
+            response = post_json(api_url, payload, headers=headers)
+            result = response.json()
+        summary = parse_summarization_response(result)
+        outcome = 'ok' if summary else 'invalid'
+        return summary
     except requests.exceptions.RequestException as e:
-        print(f"Error calling DeepSeek API: {e}")
+        logger.warning("Error calling DeepSeek API: %s", e)
         return None
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response: {e}")
+        logger.warning("Error decoding DeepSeek response: %s", e)
         return None
+    finally:
+        record_ai_call('deepseek', len(text_content), summary, result, outcome, time.perf_counter() - start)
 
-def call_gemini_api_for_evaluation(prompt_text, text_content):
+def _call_gemini(request, sent_chars, parse_response, description):
     """
-    Calls the Gemini API to evaluate a student's submission using only text.
+    Sends a built Gemini request and returns the parsed response, or None on
+    failure. Records the call's metrics either way.
     """
-    @retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5)
-    def _call_with_retry():
-        headers = {'Content-Type': 'application/json'}
-        
-        parts = [
-            {'text': prompt_text},
-            {'text': text_content}
-        ]
-        
-        payload = {
-            'contents': [{'parts': parts}],
-            'generationConfig': {
-                'candidateCount': 1,
-                'maxOutputTokens': 2048,
-                'responseMimeType': 'application/json'
-            },
-            'safetySettings': [
-                {'category': 'HARM_CATEGORY_HARASSMENT', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_HATE_SPEECH', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_SEXUALLY_EXPLICIT', 'threshold': 'BLOCK_NONE'},
-                {'category': 'HARM_CATEGORY_DANGEROUS_CONTENT', 'threshold': 'BLOCK_NONE'},
-            ]
-        }
-            
-        api_key = os.environ.get("GEMINI_API_KEY", "")
-        params = {'key': api_key}
-        
-        print("--- Sending to Gemini API for Evaluation ---")
-        response = requests.post(GEMINI_API_URL, headers=headers, json=payload, params=params)
-        
-        print("--- Gemini API Response Status Code ---")
-        print(response.status_code)
-        print("--- Gemini API Response Body ---")
-        print(response.text)
-        
-        response.raise_for_status()
-        return response.json()
-
+    start = time.perf_counter()
+    result = parsed = None
+    outcome = 'error'
     try:
-        result = _call_with_retry()
-        if result and 'candidates' in result and result['candidates'] and \
-           'content' in result['candidates'][0] and 'parts' in result['candidates'][0]['content']:
-            text_response = result['candidates'][0]['content']['parts'][0]['text']
-            print("--- Final AI Text Response (before JSON parsing) ---")
-            print(text_response)
-            return json.loads(text_response)
-        
-        print("--- Failed to get a valid response from AI. Check the raw response body above. ---")
-        return None
+        api_url, headers, params, payload = request
+        logger.info("Sending %s to Gemini", description, extra={'chars': sent_chars})
+        with span('gemini.evaluate', stage='evaluation'):
+            response = post_json(api_url, payload, headers=headers, params=params)
+            result = response.json()
+        parsed = parse_response(result)
+        outcome = 'ok' if parsed else 'invalid'
+        return parsed
     except requests.exceptions.RequestException as e:
-        print(f"Error calling Gemini API: {e}")
+        logger.warning("Error calling Gemini API: %s", e)
         return None
     except json.JSONDecodeError as e:
-        print(f"Error decoding JSON response: {e}")
+        outcome = 'invalid'
+        logger.warning("Error decoding Gemini response: %s", e)
         return None
+    finally:
+        received = parsed if isinstance(parsed, str) else json.dumps(parsed) if parsed else None
+        record_ai_call('gemini', sent_chars, received, result, outcome, time.perf_counter() - start)
+
+def call_gemini_api_for_evaluation(prompt_text, text_content):
+    """
+    Calls the Gemini API to evaluate a student's submission using only text.
+    """
+    return _call_gemini(build_evaluation_request(prompt_text, text_content),
+                        len(prompt_text) + len(text_content), parse_evaluation_response, 'submission')
+
+def call_gemini_api_for_image_evaluation(prompt_text, pages):
+    """
+    Calls the Gemini API to evaluate a student's submission from its JPEG page images.
+    """
+    return _call_gemini(build_image_evaluation_request(prompt_text, pages),
+                        len(prompt_text) + _images_size(pages), parse_evaluation_response,
+                        f"{len(pages)} submission page images")
+
+def call_gemini_api_for_transcription(pages):
+    """
+    Asks Gemini to transcribe JPEG page images. Returns the text or None.
+    """
+    return _call_gemini(build_transcription_request(pages),
+                        len(TRANSCRIPTION_PROMPT) + _images_size(pages), parse_transcription_response,
+                        f"{len(pages)} page images for transcription")
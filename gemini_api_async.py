@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import time
+import httpx
+from http_client import async_client, async_post_json
+from gemini_api import (
+    build_summarization_request, parse_summarization_response,
+    build_evaluation_request, parse_evaluation_response, record_ai_call
+)
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 8
+
+
+async def async_call_deepseek_api_for_summarization(text_content, client=None):
+    """
+    Async version of call_deepseek_api_for_summarization. Returns the summary or None.
+    Pass an httpx.AsyncClient to reuse its connection pool across calls.
+    """
+    if client is None:
+        async with async_client() as own_client:
+            return await async_call_deepseek_api_for_summarization(text_content, own_client)
+
+    start = time.perf_counter()
+    result = summary = None
+    outcome = 'error'
+    try:
+        api_url, headers, payload = build_summarization_request(text_content)
+        logger.info("Sending reference text to DeepSeek for summarization", extra={'chars': len(text_content)})
+        with span('deepseek.summarize', stage='summarization'):
+            response = await async_post_json(client, api_url, payload, headers=headers)
+            result = response.json()
+        summary = parse_summarization_response(result)
+        outcome = 'ok' if summary else 'invalid'
+        return summary
+    except httpx.HTTPError as e:
+        logger.warning("Error calling DeepSeek API: %s", e)
+        return None
+    except json.JSONDecodeError as e:
+        logger.warning("Error decoding DeepSeek response: %s", e)
+        return None
+    finally:
+        record_ai_call('deepseek', len(text_content), summary, result, outcome, time.perf_counter() - start)
+
+
+async def async_call_gemini_api_for_evaluation(prompt_text, text_content, client=None):
+    """
+    Async version of call_gemini_api_for_evaluation. Returns the decoded evaluation or None.
+    Pass an httpx.AsyncClient to reuse its connection pool across calls.
+    """
+    if client is None:
+        async with async_client() as own_client:
+            return await async_call_gemini_api_for_evaluation(prompt_text, text_content, own_client)
+
+    start = time.perf_counter()
+    result = evaluation = None
+    outcome = 'error'
+    try:
+        api_url, headers, params, payload = build_evaluation_request(prompt_text, text_content)
+        logger.info("Sending submission to Gemini for evaluation", extra={'chars': len(prompt_text) + len(text_content)})
+        with span('gemini.evaluate', stage='evaluation'):
+            response = await async_post_json(client, api_url, payload, headers=headers, params=params)
+            result = response.json()
+        evaluation = parse_evaluation_response(result)
+        outcome = 'ok' if evaluation else 'invalid'
+        return evaluation
+    except httpx.HTTPError as e:
+        logger.warning("Error calling Gemini API: %s", e)
+        return None
+    except json.JSONDecodeError as e:
+        outcome = 'invalid'
+        logger.warning("Error decoding Gemini response: %s", e)
+        return None
+    finally:
+        record_ai_call('gemini', len(prompt_text) + len(text_content), json.dumps(evaluation) if evaluation else None,
+                       result, outcome, time.perf_counter() - start)
+
+
+async def evaluate_many(requests, concurrency=DEFAULT_CONCURRENCY):
+    """
+    Evaluates many (prompt_text, text_content) pairs from one event loop, with at
+    most `concurrency` requests in flight over a shared connection pool.
+    Returns the evaluations in the same order; failed ones are None.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with async_client(max_connections=concurrency) as client:
+        async def evaluate(prompt_text, text_content):
+            async with semaphore:
+                return await async_call_gemini_api_for_evaluation(prompt_text, text_content, client)
+
+        return await asyncio.gather(*(evaluate(prompt, text) for prompt, text in requests))
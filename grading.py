@@ -0,0 +1,288 @@
+import contextvars
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from bson.objectid import ObjectId
+from ocr_cache import cached_extract_pdf, file_sha256
+from storage import get_storage, resolve_file
+from pdf_text import extraction_summary
+from gemini_api import (
+    call_gemini_api_for_evaluation, call_gemini_api_for_image_evaluation,
+    call_gemini_api_for_transcription, evaluation_model
+)
+from page_images import image_settings, render_page_images, split_requests
+from prompt_builder import (
+    prompt_settings, clean_ocr_text, plan_sections, estimate_tokens,
+    build_evaluation_prompt, build_image_evaluation_prompt, aggregate_evaluations, parse_score
+)
+from evaluation_cache import evaluation_key, get_cached_evaluation, store_evaluation, invalidate_evaluation
+from notification_outbox import queue_notification
+from similarity import index_submission
+from reference import reference_status, ReferenceNotReady, REFERENCE_READY, REFERENCE_FAILED
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever the prompts in prompt_builder change so cached evaluations are not reused.
+PROMPT_VERSION = '2'
+IMAGE_PROMPT_VERSION = '2'
+
+# How an assignment's submissions reach the model: OCR'd text, or the page images themselves.
+GRADING_MODE_OCR = 'ocr'
+GRADING_MODE_IMAGES = 'images'
+GRADING_MODES = (GRADING_MODE_OCR, GRADING_MODE_IMAGES)
+
+
+# Set while grading a batch: every model call a submission makes (each section,
+# each transcription request) waits on the batch's rate limiter, and sections
+# run one after another so a batch never exceeds its own AI concurrency.
+AI_CALL_LIMITER = contextvars.ContextVar('ai_call_limiter', default=None)
+
+
+class GradingError(Exception):
+    """Raised when a submission cannot be graded."""
+
+
+def check_reference_ready(assignment_doc):
+    """
+    Fails fast if the assignment's reference answer could not be processed and
+    raises ReferenceNotReady while it is still being processed.
+    """
+    status = reference_status(assignment_doc)
+    if status == REFERENCE_FAILED:
+        raise GradingError(f"The reference answer could not be processed: {assignment_doc.get('reference_error', 'unknown error')}")
+    if status != REFERENCE_READY:
+        raise ReferenceNotReady(f"Reference answer for assignment {assignment_doc['_id']} is {status}.")
+
+
+def load_grading_documents(db, submission_id):
+    """
+    Fetches the submission and its assignment, raising GradingError if either
+    is missing and ReferenceNotReady if the reference is still being processed.
+    """
+    submission_doc = db.submissions.find_one({'_id': ObjectId(submission_id)})
+    if not submission_doc:
+        raise GradingError('Submission not found.')
+
+    assignment_doc = db.assignments.find_one({'_id': ObjectId(submission_doc['assignment_id'])})
+    if not assignment_doc:
+        raise GradingError('Assignment not found for this submission.')
+
+    check_reference_ready(assignment_doc)
+    return submission_doc, assignment_doc
+
+
+def call_ai(func, *args):
+    limiter = AI_CALL_LIMITER.get()
+    if limiter is not None:
+        limiter.acquire()
+    return func(*args)
+
+
+def evaluate_text(reference_text, student_text):
+    """
+    Evaluates an answer with Gemini, sending it once, after the instructions.
+    Answers over the section budget are evaluated in sections, concurrently,
+    and the section scores are combined. Returns the evaluation or None; it is
+    marked `truncated` when the answer had more sections than were evaluated.
+    """
+    settings = prompt_settings()
+    sections, truncated = plan_sections(student_text, settings)
+    if len(sections) == 1 and not truncated:
+        return call_ai(call_gemini_api_for_evaluation, build_evaluation_prompt(reference_text, settings=settings), student_text)
+
+    dropped_chars = max(0, len(student_text) - sum(len(section) for section in sections))
+    logger.info("Evaluating a long answer in %d sections", len(sections), extra={
+        'tokens': estimate_tokens(student_text), 'dropped_chars': dropped_chars, 'truncated': truncated
+    })
+
+    def evaluate_section(number):
+        prompt = build_evaluation_prompt(reference_text, section=number, sections=len(sections), settings=settings)
+        return call_ai(call_gemini_api_for_evaluation, prompt, sections[number - 1])
+
+    concurrency = 1 if AI_CALL_LIMITER.get() is not None else settings['section_concurrency']
+    with ThreadPoolExecutor(max_workers=min(len(sections), concurrency)) as pool:
+        # Each section runs in a copy of this context so its spans stay in the current trace.
+        futures = [pool.submit(contextvars.copy_context().run, evaluate_section, number)
+                   for number in range(1, len(sections) + 1)]
+        evaluations = [future.result() for future in futures]
+    if any(evaluation is None for evaluation in evaluations):
+        return None
+    evaluation = aggregate_evaluations(evaluations, sections)
+    # Past max_sections the rest of the answer was never seen; the grade says so.
+    evaluation['truncated'] = truncated
+    return evaluation
+
+
+def evaluate_submission_text(db, submission_doc, assignment_doc, student_text, extraction=None, force=False):
+    """
+    Evaluates already-extracted submission text with Gemini, stores the
+    result on the submission and notifies the student. `extraction` records
+    how the text was obtained (see pdf_text.extract_pdf).
+    Identical evaluations are served from the evaluation cache unless `force` is set.
+    Returns a dict with the score and remarks.
+    """
+    student_text = clean_ocr_text(student_text)
+    try:
+        index_submission(db, submission_doc, student_text)
+    except Exception as e:
+        logger.warning("Could not index submission %s for near-duplicates: %s", submission_doc['_id'], e)
+    cache_key = evaluation_key(assignment_doc['reference_text'], student_text, evaluation_model(), PROMPT_VERSION)
+
+    def evaluate():
+        return evaluate_text(assignment_doc['reference_text'], student_text)
+
+    update = {'grading_mode': GRADING_MODE_OCR}
+    if extraction:
+        update['text_extraction'] = extraction_summary(extraction)
+    return record_evaluation(db, submission_doc, assignment_doc, cache_key, evaluate, update, force)
+
+
+def evaluate_submission_images(db, submission_doc, assignment_doc, pdf_path, force=False):
+    """
+    Evaluates a submission from images of its pages instead of OCR'd text.
+    A submission too large for one request is transcribed by the model a few
+    pages per request and the transcription is then evaluated as text.
+    """
+    settings = image_settings()
+    sha256 = submission_doc.get('sha256') or file_sha256(pdf_path)
+    # The images are fully determined by the file and the settings, so they key the cache in place of text.
+    images_id = f"images:{sha256}:{json.dumps(settings, sort_keys=True)}"
+    cache_key = evaluation_key(assignment_doc['reference_text'], images_id, evaluation_model(), IMAGE_PROMPT_VERSION)
+    update = {'grading_mode': GRADING_MODE_IMAGES}
+
+    def evaluate():
+        pages = render_page_images(pdf_path, settings)
+        groups = split_requests(pages, settings['request_max_bytes'])
+        update['image_grading'] = {'pages': len(pages), 'requests': len(groups)}
+        if len(groups) == 1:
+            return call_ai(call_gemini_api_for_image_evaluation, build_image_evaluation_prompt(assignment_doc['reference_text']), pages)
+
+        transcripts = []
+        for group in groups:
+            transcript = call_ai(call_gemini_api_for_transcription, group)
+            if transcript is None:
+                return None
+            transcripts.append(transcript)
+        return evaluate_text(assignment_doc['reference_text'], '\n\n'.join(transcripts))
+
+    return record_evaluation(db, submission_doc, assignment_doc, cache_key, evaluate, update, force)
+
+
+def graded_duplicate(db, submission_doc, cache_key):
+    """
+    Returns another submission of the same assignment already evaluated under
+    `cache_key`, with its score and remarks, or None.
+    """
+    duplicate = db.submissions.find_one(
+        {'assignment_id': submission_doc['assignment_id'], 'ai_evaluation_key': cache_key,
+         '_id': {'$ne': submission_doc['_id']}},
+        {'ai_score': 1, 'ai_remarks': 1, 'ai_truncated': 1}
+    )
+    if not duplicate:
+        return None
+    return {'_id': duplicate['_id'], 'score': duplicate['ai_score'], 'remarks': duplicate['ai_remarks'],
+            'truncated': duplicate.get('ai_truncated', False)}
+
+
+def record_evaluation(db, submission_doc, assignment_doc, cache_key, evaluate, update, force=False):
+    """
+    Returns the cached evaluation for `cache_key`, or calls `evaluate` for a new
+    one, then stores it on the submission along with `update` and notifies the student.
+    An exact duplicate of a submission already graded for the same assignment
+    reuses its evaluation even after the cache entry has expired.
+    """
+    reused_from = None
+    if force:
+        invalidate_evaluation(db, cache_key)
+        cached = None
+    else:
+        cached = get_cached_evaluation(db, cache_key)
+        if not cached:
+            cached = graded_duplicate(db, submission_doc, cache_key)
+            if cached:
+                reused_from = cached['_id']
+                logger.info("Submission %s is an exact duplicate of %s", submission_doc['_id'], reused_from)
+
+    if cached and parse_score(cached['score']) is None:
+        # Stored before scores were required to be numbers; grade it again.
+        cached = reused_from = None
+
+    if cached:
+        logger.info("Evaluation cache hit for submission %s", submission_doc['_id'])
+        score, remarks, truncated = parse_score(cached['score']), cached['remarks'], cached.get('truncated', False)
+    else:
+        gemini_response = evaluate()
+
+        if not gemini_response:
+            raise GradingError('Failed to get a valid response from the AI.')
+
+        # Scores are stored as numbers so they average and sort by value.
+        score = parse_score(gemini_response.get('score'))
+        if score is None:
+            raise GradingError('The AI response did not include a numeric score.')
+        remarks = gemini_response.get('remarks', 'No remarks provided.')
+        truncated = bool(gemini_response.get('truncated'))
+        store_evaluation(db, cache_key, {'score': score, 'remarks': remarks, 'truncated': truncated}, str(assignment_doc['_id']))
+
+    update = {
+        **update,
+        'ai_score': score,
+        'ai_remarks': remarks,
+        'ai_graded_date': datetime.now(),
+        'ai_cache_hit': bool(cached),
+        'ai_truncated': truncated,
+        'ai_evaluation_key': cache_key,
+        'ai_reused_from': reused_from
+    }
+    db.submissions.update_one({'_id': submission_doc['_id']}, {'$set': update})
+    logger.info("Graded submission %s", submission_doc['_id'], extra={'score': score, 'cache_hit': bool(cached)})
+
+    student_doc = db.users.find_one({'_id': ObjectId(submission_doc['student_id'])})
+    if student_doc:
+        notification_data = {
+            'email': student_doc['email'],
+            'username': student_doc['username'],
+            'assignment_title': assignment_doc['title'],
+            'score': score,
+            'remarks': remarks
+        }
+        queue_notification(db, 'evaluation_complete', notification_data,
+                           dedupe_key=f"evaluation_complete:{submission_doc['_id']}")
+
+    return {'score': score, 'remarks': remarks}
+
+
+def grade_submission_file(db, submission_doc, assignment_doc, pdf_path, force=False):
+    """
+    Grades a submission's file the way its assignment asks for. Image grading
+    falls back to the OCR path if the pages cannot be rendered or the model gives no usable answer.
+    """
+    if assignment_doc.get('grading_mode') == GRADING_MODE_IMAGES:
+        try:
+            return evaluate_submission_images(db, submission_doc, assignment_doc, pdf_path, force)
+        except Exception as e:
+            logger.warning("Image grading failed for submission %s, falling back to OCR: %s", submission_doc['_id'], e)
+
+    extraction = cached_extract_pdf(db, pdf_path, sha256=submission_doc.get('sha256'))
+    return evaluate_submission_text(db, submission_doc, assignment_doc, extraction['text'], extraction, force)
+
+
+def grade_submission(db, submission_id, force=False):
+    """
+    Runs the full AI grading pipeline for one submission: extract the student PDF's text
+    (or render its pages, for image-graded assignments), evaluate it with Gemini,
+    store the result and notify the student.
+    Returns a dict with the score and remarks.
+    """
+    submission_doc, assignment_doc = load_grading_documents(db, submission_id)
+
+    try:
+        pdf_path = resolve_file(get_storage(db), submission_doc.get('sha256'), submission_doc.get('file_path'))
+    except FileNotFoundError:
+        raise GradingError('Submission file not found.')
+
+    with span('grade_submission', stage='grade_submission', submission_id=submission_id):
+        return grade_submission_file(db, submission_doc, assignment_doc, pdf_path, force)
@@ -0,0 +1,163 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import HTTP_RETRIES
+
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 60
+DEFAULT_POOL_SIZE = 10
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 10.0
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def default_timeout():
+    """
+    Returns the (connect, read) timeout pair used when a caller does not pass one.
+    """
+    return (
+        float(os.environ.get('HTTP_CONNECT_TIMEOUT', DEFAULT_CONNECT_TIMEOUT)),
+        float(os.environ.get('HTTP_READ_TIMEOUT', DEFAULT_READ_TIMEOUT))
+    )
+
+
+def get_session(url):
+    """
+    Returns the shared keep-alive session for a URL's scheme and host, creating
+    it on first use. Sessions are per process, since pooled sockets cannot be
+    shared across a fork.
+    """
+    parts = urlsplit(url)
+    key = (os.getpid(), parts.scheme, parts.netloc)
+    session = _sessions.get(key)
+    if session is None:
+        with _sessions_lock:
+            session = _sessions.get(key)
+            if session is None:
+                pool_size = int(os.environ.get('HTTP_POOL_SIZE', DEFAULT_POOL_SIZE))
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+                session.mount(f"{parts.scheme}://", adapter)
+                _sessions[key] = session
+    return session
+
+
+def retry_after_seconds(response):
+    """
+    Parses a Retry-After header given either in seconds or as an HTTP date.
+    Returns None when the header is missing or invalid.
+    """
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt, base=DEFAULT_BACKOFF_BASE, maximum=DEFAULT_BACKOFF_MAX):
+    """
+    Exponential backoff with jitter: a random delay between half and all of
+    base * 2^attempt, capped at `maximum`, so retrying clients do not line up.
+    """
+    delay = min(maximum, base * (2 ** attempt))
+    return random.uniform(delay / 2, delay)
+
+
+def post_json(url, payload, headers=None, params=None, timeout=None,
+              max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX):
+    """
+    POSTs a JSON payload over the pooled session for the URL's host.
+    Connection errors, timeouts and retryable statuses (429 and 5xx) are retried
+    with jittered exponential backoff, waiting for Retry-After when the server
+    sends it. Raises requests exceptions like requests.post + raise_for_status.
+
+    `payload` may instead be a function returning an iterable of encoded JSON
+    chunks; the body is then streamed, and the function is called again for each attempt.
+    """
+    session = get_session(url)
+    timeout = timeout or default_timeout()
+
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        body = {'data': payload()} if callable(payload) else {'json': payload}
+        try:
+            response = session.post(url, headers=headers, params=params, timeout=timeout, **body)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if last_attempt:
+                raise
+            HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=type(e).__name__)
+            time.sleep(backoff_delay(attempt, backoff_base, backoff_max))
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_attempt:
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt, backoff_base, backoff_max)
+            response.close()
+            HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=str(response.status_code))
+            time.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response
+
+
+def async_client(max_connections=DEFAULT_POOL_SIZE, timeout=None):
+    """
+    Creates an httpx.AsyncClient with the same keep-alive pool and timeouts as the sync sessions.
+    """
+    import httpx  # only the async batch path needs it; keep it out of the web app's imports
+    connect_timeout, read_timeout = timeout or default_timeout()
+    return httpx.AsyncClient(
+        timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+        limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+    )
+
+
+async def async_post_json(client, url, payload, headers=None, params=None,
+                          max_attempts=DEFAULT_MAX_ATTEMPTS, backoff_base=DEFAULT_BACKOFF_BASE, backoff_max=DEFAULT_BACKOFF_MAX):
+    """
+    Async counterpart of post_json on an httpx.AsyncClient, with the same retry
+    and Retry-After handling. Raises httpx exceptions on failure.
+    """
+    import httpx
+    for attempt in range(max_attempts):
+        last_attempt = attempt == max_attempts - 1
+        try:
+            response = await client.post(url, json=payload, headers=headers, params=params)
+        except httpx.TransportError as e:
+            if last_attempt:
+                raise
+            HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=type(e).__name__)
+            await asyncio.sleep(backoff_delay(attempt, backoff_base, backoff_max))
+            continue
+
+        if response.status_code in RETRY_STATUSES and not last_attempt:
+            delay = retry_after_seconds(response)
+            if delay is None:
+                delay = backoff_delay(attempt, backoff_base, backoff_max)
+            HTTP_RETRIES.inc(host=urlsplit(url).netloc, reason=str(response.status_code))
+            await asyncio.sleep(delay)
+            continue
+
+        response.raise_for_status()
+        return response
@@ -0,0 +1,197 @@
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+ACTIVE_STATUSES = [JOB_PENDING, JOB_RUNNING]
+
+DEFAULT_LEASE_SECONDS = 300
+DEFAULT_MAX_ATTEMPTS = 3
+
+
+def ensure_job_indexes(db):
+    """
+    Creates the indexes used to claim jobs and look them up by payload.
+    """
+    db.jobs.create_index([('status', ASCENDING), ('run_after', ASCENDING), ('created_at', ASCENDING)])
+    db.jobs.create_index([('type', ASCENDING), ('payload.submission_id', ASCENDING), ('status', ASCENDING)])
+    db.jobs.create_index([('type', ASCENDING), ('payload.assignment_id', ASCENDING), ('status', ASCENDING)])
+    db.jobs.create_index([('type', ASCENDING), ('payload.assignment_id', ASCENDING), ('updated_at', ASCENDING)])
+
+
+def enqueue_job(db, job_type, payload, max_attempts=DEFAULT_MAX_ATTEMPTS, dedupe_field=None):
+    """
+    Stores a new pending job and returns its id.
+    If `dedupe_field` is given and an active job of the same type already has
+    the same payload value for it, that job's id is returned instead.
+    """
+    if dedupe_field:
+        existing = db.jobs.find_one({
+            'type': job_type,
+            f'payload.{dedupe_field}': payload[dedupe_field],
+            'status': {'$in': ACTIVE_STATUSES}
+        }, {'_id': 1})
+        if existing:
+            return str(existing['_id'])
+
+    now = datetime.now()
+    job_id = db.jobs.insert_one({
+        'type': job_type,
+        'payload': payload,
+        'status': JOB_PENDING,
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'created_at': now,
+        'run_after': now,
+        'updated_at': now,
+        'result': None,
+        'error': None
+    }).inserted_id
+    return str(job_id)
+
+
+def claim_job(db, worker_id, job_types=None, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Atomically claims the oldest runnable job and marks it as running.
+    Jobs left running by a worker that died are reclaimed once their lease expires.
+    Returns the claimed job document, or None if there is nothing to do.
+    """
+    now = datetime.now()
+    query = {'$or': [
+        {'status': JOB_PENDING, 'run_after': {'$lte': now}},
+        {'status': JOB_RUNNING, 'lease_expires_at': {'$lt': now}}
+    ]}
+    if job_types:
+        query['type'] = {'$in': list(job_types)}
+
+    return db.jobs.find_one_and_update(
+        query,
+        {
+            '$set': {
+                'status': JOB_RUNNING,
+                'worker_id': worker_id,
+                'started_at': now,
+                'lease_expires_at': now + timedelta(seconds=lease_seconds),
+                'updated_at': now
+            },
+            '$inc': {'attempts': 1}
+        },
+        sort=[('run_after', ASCENDING), ('created_at', ASCENDING)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def renew_lease(db, job_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Extends the lease of a running job so long-running handlers are not reclaimed.
+    """
+    now = datetime.now()
+    db.jobs.update_one(
+        {'_id': ObjectId(job_id), 'status': JOB_RUNNING},
+        {'$set': {'lease_expires_at': now + timedelta(seconds=lease_seconds), 'updated_at': now}}
+    )
+
+
+@contextmanager
+def keep_lease(db, job_id, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Renews a job's lease from a background thread, every third of the lease,
+    for as long as the block runs, so a slow handler is never reclaimed.
+    """
+    stopped = threading.Event()
+
+    def renew():
+        while not stopped.wait(lease_seconds / 3):
+            renew_lease(db, job_id, lease_seconds)
+
+    thread = threading.Thread(target=renew, name=f"lease-{job_id}", daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stopped.set()
+        thread.join()
+
+
+def defer_job(db, job, delay):
+    """
+    Puts a running job back in the queue for `delay` seconds without counting
+    the attempt, for jobs waiting on something else to finish first.
+    """
+    now = datetime.now()
+    db.jobs.update_one(
+        {'_id': job['_id']},
+        {'$set': {'status': JOB_PENDING, 'run_after': now + timedelta(seconds=delay), 'updated_at': now},
+         '$inc': {'attempts': -1}}
+    )
+
+
+def complete_job(db, job_id, result=None):
+    """
+    Marks a job as finished and stores its result.
+    """
+    now = datetime.now()
+    db.jobs.update_one(
+        {'_id': ObjectId(job_id)},
+        {'$set': {'status': JOB_DONE, 'result': result, 'error': None, 'finished_at': now, 'updated_at': now}}
+    )
+
+
+def fail_job(db, job, error, retry_delay=None):
+    """
+    Records a failed attempt. The job goes back to pending after `retry_delay`
+    seconds while it has attempts left, otherwise it is marked as failed.
+    Returns True when the failure is final.
+    """
+    now = datetime.now()
+    if retry_delay is not None and job.get('attempts', 0) < job.get('max_attempts', DEFAULT_MAX_ATTEMPTS):
+        update = {
+            'status': JOB_PENDING,
+            'run_after': now + timedelta(seconds=retry_delay),
+            'error': str(error),
+            'updated_at': now
+        }
+    else:
+        update = {'status': JOB_FAILED, 'error': str(error), 'finished_at': now, 'updated_at': now}
+    db.jobs.update_one({'_id': job['_id']}, {'$set': update})
+    return update['status'] == JOB_FAILED
+
+
+def get_job(db, job_id):
+    """
+    Returns a job document by id, or None.
+    """
+    return db.jobs.find_one({'_id': ObjectId(job_id)})
+
+
+def active_jobs_for_assignment(db, job_type, assignment_id):
+    """
+    Returns a mapping of submission id to active job id for an assignment.
+    """
+    jobs = db.jobs.find(
+        {'type': job_type, 'payload.assignment_id': assignment_id, 'status': {'$in': ACTIVE_STATUSES}},
+        {'payload.submission_id': 1}
+    )
+    return {job['payload']['submission_id']: str(job['_id']) for job in jobs}
+
+
+def serialize_job(job):
+    """
+    Converts a job document into a JSON-friendly status dict.
+    """
+    return {
+        'id': str(job['_id']),
+        'type': job['type'],
+        'status': job['status'],
+        'attempts': job.get('attempts', 0),
+        'result': job.get('result'),
+        'error': job.get('error'),
+        'created_at': job['created_at'].isoformat() if job.get('created_at') else None,
+        'finished_at': job['finished_at'].isoformat() if job.get('finished_at') else None
+    }
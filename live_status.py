@@ -0,0 +1,209 @@
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+from job_queue import JOB_FAILED
+from batch_grading import serialize_batch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_SECONDS = 2
+# Writers stamp documents before they commit, so each poll looks back this far
+# and relies on the per-connection de-duplication to drop what was already sent.
+POLL_OVERLAP_SECONDS = 5
+HEARTBEAT_SECONDS = 15
+# Streams end after this long and the browser reconnects on its own, so a
+# request thread is never held indefinitely and deploys drain quickly. Each
+# open status page holds one sync worker thread while its stream lasts, so the
+# server needs a thread per concurrently open page on top of normal traffic.
+DEFAULT_STREAM_SECONDS = 60
+RETRY_MS = 3000
+
+SUBMISSION_STATUS_FIELDS = {
+    'assignment_id': 1, 'ai_score': 1, 'ai_remarks': 1, 'ai_cache_hit': 1, 'ai_reused_from': 1,
+    'ai_truncated': 1, 'ai_graded_date': 1, 'near_duplicates': 1
+}
+WATCHED_COLLECTIONS = ['submissions', 'jobs', 'grading_batches']
+
+
+def live_status_settings():
+    return {
+        'poll_seconds': float(os.environ.get('LIVE_STATUS_POLL_SECONDS', DEFAULT_POLL_SECONDS)),
+        'stream_seconds': float(os.environ.get('LIVE_STATUS_STREAM_SECONDS', DEFAULT_STREAM_SECONDS)),
+        'change_streams': os.environ.get('LIVE_STATUS_CHANGE_STREAMS', 'true').lower() in ('1', 'true', 'yes')
+    }
+
+
+def parse_event_id(value):
+    """
+    Reads the timestamp a client resumes from (Last-Event-ID or ?since=), or None.
+    """
+    try:
+        return datetime.fromisoformat(value) if value else None
+    except ValueError:
+        return None
+
+
+def format_event(event, data, event_id=None):
+    """
+    Encodes one Server-Sent Event.
+    """
+    lines = [f"id: {event_id}"] if event_id else []
+    lines += [f"event: {event}", f"data: {json.dumps(data, default=str)}"]
+    return '\n'.join(lines) + '\n\n'
+
+
+def submission_event(doc):
+    return ('submission', str(doc['_id']), {
+        'id': str(doc['_id']),
+        'status': 'graded' if doc.get('ai_score') not in (None, '') else 'pending',
+        'score': doc.get('ai_score'),
+        'remarks': doc.get('ai_remarks'),
+        'cache_hit': doc.get('ai_cache_hit', False),
+        'reused': bool(doc.get('ai_reused_from')),
+        'truncated': doc.get('ai_truncated', False),
+        'near_duplicates': len(doc.get('near_duplicates') or [])
+    })
+
+
+def job_event(job):
+    submission_id = job['payload']['submission_id']
+    return ('job', submission_id, {
+        'submission_id': submission_id,
+        'status': job['status'],
+        'error': job.get('error') if job['status'] == JOB_FAILED else None
+    })
+
+
+def batch_events(batch):
+    """
+    Yields the batch's progress and a 'job'-style event for each submission it failed.
+    """
+    progress = serialize_batch(batch)
+    progress.pop('results')
+    yield 'batch', progress['id'], progress
+    for submission_id, outcome in batch.get('results', {}).items():
+        if outcome.get('status') != 'graded':
+            yield 'job', submission_id, {'submission_id': submission_id, 'status': JOB_FAILED, 'error': outcome.get('error')}
+
+
+def changed_since(db, assignment_id, since):
+    """
+    Returns the events for an assignment's submissions, grading jobs and
+    batches updated after `since`. Each query is a range scan on an index.
+    """
+    events = []
+    for doc in db.submissions.find(
+            {'assignment_id': ObjectId(assignment_id), 'ai_graded_date': {'$gt': since}}, SUBMISSION_STATUS_FIELDS):
+        events.append(submission_event(doc))
+    for job in db.jobs.find(
+            {'type': 'grade_submission', 'payload.assignment_id': assignment_id, 'updated_at': {'$gt': since}},
+            {'status': 1, 'error': 1, 'payload.submission_id': 1}):
+        events.append(job_event(job))
+    for batch in db.grading_batches.find({'assignment_id': assignment_id, 'updated_at': {'$gt': since}}):
+        events.extend(batch_events(batch))
+    return events
+
+
+def _change_event(change, assignment_id):
+    doc = change.get('fullDocument')
+    if not doc:
+        return []
+    collection = change['ns']['coll']
+    if collection == 'submissions' and str(doc.get('assignment_id')) == assignment_id:
+        return [submission_event(doc)]
+    if collection == 'jobs' and doc.get('type') == 'grade_submission' and doc['payload'].get('assignment_id') == assignment_id:
+        return [job_event(doc)]
+    if collection == 'grading_batches' and doc.get('assignment_id') == assignment_id:
+        return list(batch_events(doc))
+    return []
+
+
+def _watch(db, assignment_id, poll_seconds):
+    """
+    Opens a change stream over the collections that carry grading status.
+    Raises PyMongoError (or NotImplementedError) where change streams are not
+    available, e.g. on a standalone server.
+    """
+    pipeline = [{'$match': {
+        'operationType': {'$in': ['insert', 'update', 'replace']},
+        'ns.coll': {'$in': WATCHED_COLLECTIONS},
+        '$or': [
+            {'fullDocument.assignment_id': {'$in': [ObjectId(assignment_id), assignment_id]}},
+            {'fullDocument.payload.assignment_id': assignment_id}
+        ]
+    }}]
+    return db.watch(pipeline, full_document='updateLookup', max_await_time_ms=int(poll_seconds * 1000))
+
+
+def assignment_status_stream(db, assignment_id, since=None, settings=None):
+    """
+    Yields Server-Sent Events for status changes of an assignment's
+    submissions: grading jobs queued, running or failed, scores landing and
+    batch progress. Follows a MongoDB change stream where the deployment
+    supports one and polls otherwise. Event ids are timestamps; a client
+    reconnecting with Last-Event-ID (`since`) first catches up from there.
+    """
+    settings = settings or live_status_settings()
+    started = time.monotonic()
+    last_sent = {}
+    last_write = started
+
+    def emit(events, event_id):
+        nonlocal last_write
+        for event, key, data in events:
+            if last_sent.get((event, key)) == data:
+                continue
+            last_sent[(event, key)] = data
+            last_write = time.monotonic()
+            yield format_event(event, data, event_id)
+
+    def heartbeat():
+        nonlocal last_write
+        if time.monotonic() - last_write >= HEARTBEAT_SECONDS:
+            last_write = time.monotonic()
+            yield ': keepalive\n\n'
+
+    def expired():
+        return time.monotonic() - started >= settings['stream_seconds']
+
+    yield f"retry: {RETRY_MS}\n\n"
+    stream = None
+    if settings['change_streams']:
+        try:
+            # Opened before catching up, so nothing written in between is missed.
+            stream = _watch(db, assignment_id, settings['poll_seconds'])
+        except (PyMongoError, NotImplementedError) as e:
+            logger.debug("Change streams unavailable, polling instead: %s", e)
+
+    cursor = datetime.now()
+    if since:
+        yield from emit(changed_since(db, assignment_id, since - timedelta(seconds=POLL_OVERLAP_SECONDS)), cursor.isoformat())
+
+    if stream is not None:
+        with stream:
+            while not expired():
+                try:
+                    change = stream.try_next()
+                except PyMongoError as e:
+                    # E.g. a failover the driver could not resume from; polling
+                    # from the last change seen loses nothing.
+                    logger.warning("Change stream for assignment %s failed, polling instead: %s", assignment_id, e)
+                    break
+                if change is not None:
+                    cursor = datetime.now()
+                    yield from emit(_change_event(change, assignment_id), cursor.isoformat())
+                else:
+                    yield from heartbeat()
+            else:
+                return
+
+    while not expired():
+        time.sleep(settings['poll_seconds'])
+        now = datetime.now()
+        yield from emit(changed_since(db, assignment_id, cursor - timedelta(seconds=POLL_OVERLAP_SECONDS)), now.isoformat())
+        cursor = now
+        yield from heartbeat()
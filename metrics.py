@@ -0,0 +1,253 @@
+import ipaddress
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Seconds; spans a fast cache lookup up to a slow multi-page OCR or API call.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+# Characters and tokens per call.
+SIZE_BUCKETS = (100, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000, 250000)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {sorted(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key)) + list(extra or [])
+    if not pairs:
+        return ''
+    escaped = [(name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs]
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+class Counter:
+    type_name = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(self.labelnames, labels), 0)
+
+    def _snapshot(self):
+        return dict(self._values)
+
+    def _merge(self, values):
+        for key, amount in values.items():
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _reset(self):
+        self._values = {}
+
+    def _render(self):
+        for key, value in sorted(self._values.items()):
+            yield f"{self.name}{_format_labels(self.labelnames, key)} {value}"
+
+
+class Histogram:
+    type_name = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [bucket counts..., sum, count]
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with _lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+                    break
+            state[-2] += value
+            state[-1] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def count(self, **labels):
+        state = self._values.get(_label_key(self.labelnames, labels))
+        return state[-1] if state else 0
+
+    def _snapshot(self):
+        return {key: list(state) for key, state in self._values.items()}
+
+    def _merge(self, values):
+        for key, other in values.items():
+            state = self._values.setdefault(key, [0] * len(other))
+            for i, value in enumerate(other):
+                state[i] += value
+
+    def _reset(self):
+        self._values = {}
+
+    def _render(self):
+        for key, state in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', repr(float(bound)))])} {cumulative}"
+            yield f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {state[-1]}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, key)} {state[-2]}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, key)} {state[-1]}"
+
+
+def _register(metric):
+    with _lock:
+        if metric.name in _metrics:
+            raise ValueError(f"Metric {metric.name} is already registered.")
+        _metrics[metric.name] = metric
+    return metric
+
+
+def counter(name, documentation, labelnames=()):
+    return _register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return _register(Histogram(name, documentation, labelnames, buckets))
+
+
+def render():
+    """
+    Returns every metric in the Prometheus text exposition format.
+    """
+    lines = []
+    with _lock:
+        for metric in sorted(_metrics.values(), key=lambda m: m.name):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            lines.extend(metric._render())
+    return '\n'.join(lines) + '\n'
+
+
+def snapshot(reset=False):
+    with _lock:
+        values = {name: metric._snapshot() for name, metric in _metrics.items()}
+        if reset:
+            for metric in _metrics.values():
+                metric._reset()
+    return values
+
+
+def merge(values):
+    """
+    Adds a snapshot taken in another process (see `run_collecting`) into this one.
+    """
+    with _lock:
+        for name, metric_values in values.items():
+            if name in _metrics:
+                _metrics[name]._merge(metric_values)
+
+
+def run_collecting(func, *args, **kwargs):
+    """
+    Runs `func` inside a pool worker process and returns (result, metrics it
+    recorded), so the parent can `merge` what would otherwise die with the worker.
+    """
+    snapshot(reset=True)
+    result = func(*args, **kwargs)
+    return result, snapshot(reset=True)
+
+
+def scrape_allowed(authorization, remote_addr):
+    """
+    Decides whether a scrape may read the metrics: with METRICS_TOKEN set it
+    must present the token as a bearer token. Without a token nothing is served,
+    unless METRICS_ALLOW_LOOPBACK allows requests from this machine. Only set
+    that where scrapers connect directly: behind a reverse proxy on the same
+    host, every request arrives from loopback.
+    """
+    token = os.environ.get('METRICS_TOKEN')
+    if token:
+        return secrets.compare_digest(authorization or '', f"Bearer {token}")
+    if os.environ.get('METRICS_ALLOW_LOOPBACK', 'false').lower() not in ('1', 'true', 'yes'):
+        return False
+    try:
+        return ipaddress.ip_address(remote_addr or '').is_loopback
+    except ValueError:
+        return False
+
+
+def start_metrics_server(port, host='0.0.0.0'):
+    """
+    Serves /metrics on a daemon thread, for processes without a Flask app such as the worker.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_error(404)
+                return
+            if not scrape_allowed(self.headers.get('Authorization'), self.client_address[0]):
+                self.send_error(401)
+                return
+            body = render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    return server
+
+
+# --- Grading pipeline metrics ---
+STAGE_SECONDS = histogram(
+    'grading_stage_seconds', 'Time spent in each grading pipeline stage.', ['stage'])
+PAGES_TOTAL = counter(
+    'pdf_pages_total', 'PDF pages extracted, by how their text was obtained.', ['method'])
+AI_REQUEST_SECONDS = histogram(
+    'ai_request_seconds', 'Latency of calls to the AI APIs, including retries.', ['api', 'outcome'])
+AI_CHARACTERS = histogram(
+    'ai_characters', 'Characters sent to and received from the AI APIs per call.', ['api', 'direction'], SIZE_BUCKETS)
+AI_TOKENS = counter(
+    'ai_tokens_total', 'Tokens reported by the AI APIs.', ['api', 'kind'])
+HTTP_RETRIES = counter(
+    'http_client_retries_total', 'Outbound HTTP retries.', ['host', 'reason'])
+EVALUATION_CACHE_LOOKUPS = counter(
+    'evaluation_cache_lookups_total', 'Evaluation cache lookups.', ['result'])
+OCR_CACHE_LOOKUPS = counter(
+    'ocr_cache_lookups_total', 'OCR cache lookups.', ['result'])
+JOBS_TOTAL = counter(
+    'jobs_total', 'Background jobs processed, by outcome.', ['type', 'outcome'])
+JOB_SECONDS = histogram(
+    'job_seconds', 'Background job run time.', ['type'])
+HTTP_REQUEST_SECONDS = histogram(
+    'http_request_seconds', 'Flask request latency.', ['endpoint', 'method', 'status'])
+NOTIFICATIONS_TOTAL = counter(
+    'notifications_total', 'Notification webhook deliveries.', ['event', 'outcome'])
@@ -0,0 +1,141 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _MockHTTPServer(ThreadingHTTPServer):
+    # Load tests open many connections at once; the default backlog of 5 stalls them.
+    request_queue_size = 128
+
+
+class MockAIServer:
+    """
+    Local stand-in for the Gemini and DeepSeek HTTP APIs and the n8n webhooks.
+    Point GEMINI_API_URL / DEEPSEEK_API_URL and the NOTIFICATION_*_WEBHOOK
+    variables at `url` to grade and notify without a network.
+    Every request body is recorded in `requests` for inspection.
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, score=85, remarks='Good work.', latency=0.0, error_rate=0.0):
+        self.score = score
+        self.remarks = remarks
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = []
+        self._lock = threading.Lock()
+        self._server = _MockHTTPServer((host, port), self._make_handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def webhook_requests(self):
+        with self._lock:
+            return [r for r in self.requests if r['path'].startswith('/webhook')]
+
+    def gemini_response(self):
+        text = json.dumps({'score': self.score, 'remarks': self.remarks})
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+    def transcription_response(self, body):
+        pages = sum(1 for part in body['contents'][0]['parts'] if 'inlineData' in part)
+        text = '\n'.join(f"Transcribed page {number}." for number in range(1, pages + 1))
+        return {'candidates': [{'content': {'parts': [{'text': text}]}}]}
+
+    def deepseek_response(self, body):
+        prompt = body['messages'][-1]['content']
+        summary = json.dumps({'summary': prompt.strip()[:500]})
+        return {'choices': [{'message': {'content': summary}}]}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'  # keep connections alive like the real APIs
+
+            def do_POST(self):
+                body = json.loads(self._read_body() or b'{}')
+                with server._lock:
+                    server.requests.append({'path': self.path, 'body': body})
+
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    self._send_json(503, {'error': 'mock failure'})
+                    return
+
+                if 'contents' in body and body.get('generationConfig', {}).get('responseMimeType') == 'text/plain':
+                    self._send_json(200, server.transcription_response(body))
+                elif 'contents' in body:
+                    self._send_json(200, server.gemini_response())
+                elif 'messages' in body:
+                    self._send_json(200, server.deepseek_response(body))
+                else:
+                    self._send_json(200, {'ok': True})
+
+            def _read_body(self):
+                if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+                    return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                # Streamed request bodies, e.g. page images (see http_client.post_json).
+                chunks = []
+                while True:
+                    size = int(self.rfile.readline().split(b';')[0], 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        return b''.join(chunks)
+                    chunks.append(self.rfile.read(size))
+                    self.rfile.readline()
+
+            def _send_json(self, status, payload):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Run a local stand-in for the Gemini/DeepSeek APIs.')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    args = parser.parse_args()
+
+    mock = MockAIServer(port=args.port, latency=args.latency, error_rate=args.error_rate).start()
+    print(f"Mock AI server listening on {mock.url}")
+    print(f"export GEMINI_API_URL={mock.url}/gemini DEEPSEEK_API_URL={mock.url}/deepseek")
+    print(f"export NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK={mock.url}/webhook/new_assignment "
+          f"NOTIFICATION_EVALUATION_COMPLETE_WEBHOOK={mock.url}/webhook/evaluation_complete")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
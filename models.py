@@ -1,9 +1,13 @@
-from flask_login import UserMixin
 from bson.objectid import ObjectId
 
-class User(UserMixin):
+class User:
+    # Kept for the whole session and cached per process, so instances are slotted
+    # and hold only the fields the routes use; the document itself is not kept.
+    # Flask-Login's UserMixin would bring back a per-instance __dict__, so the
+    # attributes it expects are defined here instead.
+    __slots__ = ('id', 'username', 'email', 'user_type', 'class_name', 'subject')
+
     def __init__(self, user_data):
-        self.user_data = user_data
         self.id = str(user_data['_id'])
         self.username = user_data.get('username')
         self.email = user_data.get('email')
@@ -11,9 +15,29 @@ class User(UserMixin):
         self.class_name = user_data.get('class_name') # Now using class_name
         self.subject = user_data.get('subject') # Teachers have a subject
 
+    @property
+    def is_authenticated(self):
+        return True
+
+    @property
+    def is_active(self):
+        return True
+
+    @property
+    def is_anonymous(self):
+        return False
+
     def get_id(self):
         return self.id
 
+    def __eq__(self, other):
+        if isinstance(other, User):
+            return self.id == other.id
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(self.id)
+
 class Assignment:
     def __init__(self, assignment_data):
         self.assignment_data = assignment_data
@@ -25,8 +49,15 @@ class Assignment:
         self.subject = assignment_data.get('subject') # Assignments are linked to a subject
         self.teacher_id = assignment_data.get('teacher_id')
         self.filename = assignment_data.get('filename')
-        self.file_path = assignment_data.get('file_path')
+        self.file_path = assignment_data.get('file_path') # Only on assignments stored before content-addressed storage
+        self.file_sha256 = assignment_data.get('file_sha256')
         self.reference_text = assignment_data.get('reference_text') # New field for summarized reference text
+        self.reference_file_path = assignment_data.get('reference_file_path')
+        self.reference_filename = assignment_data.get('reference_filename')
+        self.reference_sha256 = assignment_data.get('reference_sha256')
+        self.reference_status = assignment_data.get('reference_status', 'ready') # pending/processing/ready/failed while the worker summarizes it
+        self.reference_ready_date = assignment_data.get('reference_ready_date') # When the answer key finished processing
+        self.grading_mode = assignment_data.get('grading_mode', 'ocr') # 'ocr' grades extracted text, 'images' sends the page images
 
 class Submission:
     def __init__(self, submission_data):
@@ -36,7 +67,12 @@ class Submission:
         self.student_id = submission_data.get('student_id')
         self.class_name = submission_data.get('class_name') # Added class_name to the Submission model
         self.filename = submission_data.get('filename')
-        self.file_path = submission_data.get('file_path')
+        self.file_path = submission_data.get('file_path') # Only on submissions stored before content-addressed storage
+        self.sha256 = submission_data.get('sha256')
         self.upload_date = submission_data.get('upload_date')
         self.ai_score = submission_data.get('ai_score') # New field for AI score
         self.ai_remarks = submission_data.get('ai_remarks') # New field for AI remarks
+        self.ai_cache_hit = submission_data.get('ai_cache_hit', False) # True when the evaluation came from the cache
+        self.ai_truncated = submission_data.get('ai_truncated', False) # True when only the first sections of a long answer were graded
+        self.ai_reused_from = submission_data.get('ai_reused_from') # Exact duplicate whose evaluation was reused
+        self.near_duplicates = submission_data.get('near_duplicates') or [] # [{'submission_id', 'similarity'}] from similarity.py
@@ -0,0 +1,227 @@
+import logging
+import os
+import threading
+import uuid
+from datetime import datetime, timedelta, timezone
+import requests
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+from http_client import backoff_delay
+from notification_system import webhook_url, deliver_webhook
+from metrics import NOTIFICATIONS_TOTAL
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_PENDING = 'pending'
+OUTBOX_SENDING = 'sending'
+OUTBOX_SENT = 'sent'
+OUTBOX_FAILED = 'failed'
+
+# evaluation_complete events wait this long so grades finishing together go out in one webhook call.
+DEFAULT_COALESCE_SECONDS = 5
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_LEASE_SECONDS = 60
+RETRY_BACKOFF_BASE = 5.0
+RETRY_BACKOFF_MAX = 600.0
+SENT_RETENTION_DAYS = 7
+
+BATCHED_EVENTS = {'evaluation_complete'}
+DEDUPE_INDEX = 'pending_dedupe_key_unique'
+
+
+def outbox_settings():
+    return {
+        'coalesce_seconds': float(os.environ.get('NOTIFICATION_COALESCE_SECONDS', DEFAULT_COALESCE_SECONDS)),
+        'batch_size': int(os.environ.get('NOTIFICATION_BATCH_SIZE', DEFAULT_BATCH_SIZE)),
+        'max_attempts': int(os.environ.get('NOTIFICATION_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS))
+    }
+
+
+def ensure_outbox_indexes(db):
+    db.notification_outbox.create_index([('status', ASCENDING), ('run_after', ASCENDING)])
+    # One pending event per key: a newer event replaces the one still waiting to be sent.
+    # Events without a key are left out, or they would all collide on null.
+    db.notification_outbox.create_index(
+        [('dedupe_key', ASCENDING)], unique=True, name=DEDUPE_INDEX,
+        partialFilterExpression={'status': OUTBOX_PENDING, 'dedupe_key': {'$exists': True}}
+    )
+    # Timestamps here are UTC: the TTL monitor reads expires_at as UTC, and run_after
+    # and locked_until are compared against the same clock on every host.
+    db.notification_outbox.create_index([('expires_at', ASCENDING)], expireAfterSeconds=0)
+
+
+def queue_notification(db, event_type, data, dedupe_key=None):
+    """
+    Records a notification in the outbox for the dispatcher to send.
+    Returns immediately; nothing is sent on the caller's thread.
+    """
+    settings = outbox_settings()
+    now = datetime.now(timezone.utc)
+    delay = settings['coalesce_seconds'] if event_type in BATCHED_EVENTS else 0
+    fields = {
+        'event_type': event_type,
+        'data': data,
+        'created_at': now,
+        'run_after': now + timedelta(seconds=delay),
+        'attempts': 0
+    }
+    if dedupe_key is None:
+        db.notification_outbox.insert_one({**fields, 'status': OUTBOX_PENDING})
+        return
+
+    try:
+        db.notification_outbox.update_one(
+            {'dedupe_key': dedupe_key, 'status': OUTBOX_PENDING},
+            {'$set': fields},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # Another process queued the same key at the same moment; its event stands.
+        pass
+
+
+def claim_notifications(db, event_type, limit, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """
+    Claims up to `limit` due notifications of one type, including ones whose
+    sender died mid-delivery, and returns them oldest first.
+    """
+    now = datetime.now(timezone.utc)
+    ready = {'event_type': event_type, '$or': [
+        {'status': OUTBOX_PENDING, 'run_after': {'$lte': now}},
+        {'status': OUTBOX_SENDING, 'locked_until': {'$lte': now}}
+    ]}
+    ids = [doc['_id'] for doc in db.notification_outbox.find(ready, {'_id': 1}).sort('created_at', ASCENDING).limit(limit)]
+    if not ids:
+        return []
+
+    token = uuid.uuid4().hex
+    db.notification_outbox.update_many(
+        {'_id': {'$in': ids}, **ready},
+        {'$set': {'status': OUTBOX_SENDING, 'claim': token, 'locked_until': now + timedelta(seconds=lease_seconds)},
+         '$inc': {'attempts': 1}}
+    )
+    return list(db.notification_outbox.find({'claim': token}).sort('created_at', ASCENDING))
+
+
+def _mark_sent(db, ids):
+    now = datetime.now(timezone.utc)
+    db.notification_outbox.update_many(
+        {'_id': {'$in': ids}},
+        {'$set': {'status': OUTBOX_SENT, 'sent_at': now, 'expires_at': now + timedelta(days=SENT_RETENTION_DAYS)},
+         '$unset': {'claim': '', 'locked_until': ''}}
+    )
+
+
+def _mark_failed(db, notifications, error, max_attempts, retry=True):
+    now = datetime.now(timezone.utc)
+    for notification in notifications:
+        if retry and notification['attempts'] < max_attempts:
+            delay = backoff_delay(notification['attempts'] - 1, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX)
+            update = {'status': OUTBOX_PENDING, 'run_after': now + timedelta(seconds=delay), 'error': str(error)}
+        else:
+            update = {'status': OUTBOX_FAILED, 'error': str(error), 'expires_at': now + timedelta(days=SENT_RETENTION_DAYS)}
+        try:
+            db.notification_outbox.update_one(
+                {'_id': notification['_id']},
+                {'$set': update, '$unset': {'claim': '', 'locked_until': ''}}
+            )
+        except DuplicateKeyError:
+            # A newer event with the same key was queued meanwhile; it supersedes this one.
+            db.notification_outbox.delete_one({'_id': notification['_id']})
+
+
+def build_payload(event_type, notifications):
+    """
+    Batched events are sent as {'event', 'count', 'notifications': [...]};
+    others keep their original single-event payload.
+    """
+    if event_type in BATCHED_EVENTS:
+        return {
+            'event': event_type,
+            'count': len(notifications),
+            'notifications': [notification['data'] for notification in notifications]
+        }
+    return notifications[0]['data']
+
+
+def dispatch_once(db, settings=None):
+    """
+    Sends every due notification, one webhook call per batch. Returns the number sent.
+    """
+    settings = settings or outbox_settings()
+    sent = 0
+    for event_type in ('new_assignment', 'evaluation_complete'):
+        limit = settings['batch_size'] if event_type in BATCHED_EVENTS else 1
+        while True:
+            notifications = claim_notifications(db, event_type, limit)
+            if not notifications:
+                break
+
+            url = webhook_url(event_type)
+            if not url:
+                logger.warning("Webhook URL for %s not found in .env file", event_type)
+                NOTIFICATIONS_TOTAL.inc(len(notifications), event=event_type, outcome='unconfigured')
+                _mark_failed(db, notifications, 'Webhook URL not configured', settings['max_attempts'], retry=False)
+                continue
+
+            try:
+                deliver_webhook(url, build_payload(event_type, notifications))
+            except requests.exceptions.RequestException as e:
+                logger.warning("Error sending %s notifications to webhook: %s", event_type, e)
+                NOTIFICATIONS_TOTAL.inc(len(notifications), event=event_type, outcome='error')
+                _mark_failed(db, notifications, e, settings['max_attempts'])
+                break  # Leave the rest for the next pass instead of hammering a failing webhook.
+
+            _mark_sent(db, [notification['_id'] for notification in notifications])
+            NOTIFICATIONS_TOTAL.inc(len(notifications), event=event_type, outcome='sent')
+            sent += len(notifications)
+    return sent
+
+
+def run_dispatcher(db, poll_interval=1.0, stop_event=None):
+    """
+    Drains the outbox until `stop_event` is set.
+    """
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            dispatch_once(db)
+        except Exception as e:
+            logger.exception("Notification dispatcher error: %s", e)
+        stop_event.wait(poll_interval)
+
+
+def start_dispatcher_thread(db, poll_interval=1.0):
+    """
+    Runs the dispatcher on a daemon thread. Returns the Event that stops it.
+    """
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_dispatcher, args=(db, poll_interval, stop_event),
+                              name='notification-dispatcher', daemon=True)
+    thread.start()
+    return stop_event
+
+
+if __name__ == '__main__':
+    import argparse
+    from dotenv import load_dotenv
+    from database import get_database
+    from tracing import configure_logging
+
+    load_dotenv()
+    configure_logging()
+    parser = argparse.ArgumentParser(description='Send queued notifications.')
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    parser.add_argument('--once', action='store_true', help='Send what is due and exit.')
+    args = parser.parse_args()
+
+    db = get_database()
+    ensure_outbox_indexes(db)
+    if args.once:
+        print(f"Sent {dispatch_once(db)} notifications.")
+    else:
+        try:
+            run_dispatcher(db, args.poll_interval)
+        except KeyboardInterrupt:
+            pass
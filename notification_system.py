@@ -1,35 +1,55 @@
+import logging
 import os
 import requests
-from retrying import retry
+from http_client import post_json, DEFAULT_CONNECT_TIMEOUT
+
+WEBHOOK_READ_TIMEOUT = 10
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_URL_VARIABLES = {
+    'new_assignment': 'NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK',
+    'evaluation_complete': 'NOTIFICATION_EVALUATION_COMPLETE_WEBHOOK'
+}
+
+
+def webhook_url(event_type):
+    """
+    Returns the n8n webhook URL configured for an event type, or None.
+    """
+    variable = WEBHOOK_URL_VARIABLES.get(event_type)
+    return os.environ.get(variable) if variable else None
+
+
+def deliver_webhook(url, payload):
+    """
+    Makes a single POST attempt. Retries are left to the notification outbox.
+    """
+    return post_json(url, payload, timeout=(DEFAULT_CONNECT_TIMEOUT, WEBHOOK_READ_TIMEOUT), max_attempts=1)
+
     
-@retry(wait_exponential_multiplier=1000, wait_exponential_max=10000, stop_max_attempt_number=5)
 def _call_webhook_with_retry(url, payload):
         """
         Sends a POST request to a given webhook URL with exponential backoff.
         """
-        response = requests.post(url, json=payload, timeout=10)
-        response.raise_for_status()
-        return response
+        return post_json(url, payload, timeout=(DEFAULT_CONNECT_TIMEOUT, WEBHOOK_READ_TIMEOUT))
     
 def send_notification(event_type, data):
         """
-        Sends a JSON payload to the appropriate n8n webhook URL.
+        Sends a JSON payload to the appropriate n8n webhook URL right away.
+        Request handlers should use notification_outbox.queue_notification instead.
         """
         try:
-            if event_type == 'new_assignment':
-                webhook_url = os.environ.get('NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK')
-            elif event_type == 'evaluation_complete':
-                webhook_url = os.environ.get('NOTIFICATION_EVALUATION_COMPLETE_WEBHOOK')
-            else:
+            if event_type not in WEBHOOK_URL_VARIABLES:
                 return False, 'Invalid event type'
-    
-            if not webhook_url:
-                print(f"Warning: Webhook URL for {event_type} not found in .env file.")
+
+            url = webhook_url(event_type)
+            if not url:
+                logger.warning("Webhook URL for %s not found in .env file", event_type)
                 return False, 'Webhook URL not configured'
     
-            _call_webhook_with_retry(webhook_url, data)
+            _call_webhook_with_retry(url, data)
             return True, 'Notification sent successfully'
         except requests.exceptions.RequestException as e:
-            print(f"Error sending notification to webhook: {e}")
+            logger.warning("Error sending notification to webhook: %s", e)
             return False, str(e)
-    
\ No newline at end of file
@@ -0,0 +1,232 @@
+import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import metrics
+from tracing import span
+
+# pdf2image and pytesseract are imported inside the functions that use them, so
+# importing this module (as the web app does via the grading code) stays cheap.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OCR_DPI = 200
+DEFAULT_OCR_LANG = 'eng'
+DEFAULT_PAGE_WINDOW = 4
+DEFAULT_MAX_MEMORY_MB = 256
+DEFAULT_PAGE_SIZE_POINTS = (612.0, 792.0)  # US Letter, used when pdfinfo gives no page size
+DEFAULT_PAGE_TIMEOUT_SECONDS = 120
+
+DEFAULT_PREPROCESS_PRESET = 'standard'
+
+# Image preprocessing before Tesseract (see preprocessing.preprocess_page), chosen with OCR_PREPROCESS.
+# 'fast' renders at a lower resolution and tells Tesseract to expect a single block
+# of text, skipping its layout analysis: a little less accurate, several times quicker.
+PREPROCESS_PRESETS = {
+    'off': {'enabled': False, 'dpi': DEFAULT_OCR_DPI, 'psm': None},
+    'standard': {'enabled': True, 'dpi': DEFAULT_OCR_DPI, 'target_dpi': 300, 'skip_blank': True,
+                 'deskew': True, 'threshold': True, 'psm': 3},
+    'fast': {'enabled': True, 'dpi': 150, 'target_dpi': 150, 'skip_blank': True,
+             'deskew': False, 'threshold': True, 'psm': 6},
+}
+
+def ocr_settings():
+    """
+    Returns the rasterization and Tesseract settings that affect OCR output.
+    """
+    preset = os.environ.get('OCR_PREPROCESS', DEFAULT_PREPROCESS_PRESET)
+    if preset not in PREPROCESS_PRESETS:
+        logger.warning("Unknown OCR_PREPROCESS preset %r, using %r", preset, DEFAULT_PREPROCESS_PRESET)
+        preset = DEFAULT_PREPROCESS_PRESET
+    return {
+        'preprocess': preset,
+        'dpi': int(os.environ.get('OCR_DPI', PREPROCESS_PRESETS[preset]['dpi'])),
+        'lang': os.environ.get('OCR_LANG', DEFAULT_OCR_LANG),
+        'grayscale': os.environ.get('OCR_GRAYSCALE', 'true').lower() in ('1', 'true', 'yes'),
+        'page_window': int(os.environ.get('OCR_PAGE_WINDOW', DEFAULT_PAGE_WINDOW)),
+        'max_memory_mb': int(os.environ.get('OCR_MAX_MEMORY_MB', DEFAULT_MAX_MEMORY_MB))
+    }
+
+def ocr_page_workers():
+    """
+    Number of processes used to OCR the pages of one PDF (OCR_PAGE_WORKERS, defaults to the CPU count).
+    """
+    return int(os.environ.get('OCR_PAGE_WORKERS', os.cpu_count() or 1))
+
+def ocr_page_timeout():
+    """
+    Seconds allowed for rasterizing or OCR'ing a single page (OCR_PAGE_TIMEOUT).
+    """
+    return int(os.environ.get('OCR_PAGE_TIMEOUT', DEFAULT_PAGE_TIMEOUT_SECONDS))
+
+def _page_size_points(info):
+    """
+    Parses pdfinfo's "Page size" entry, e.g. "612 x 792 pts (letter)".
+    """
+    try:
+        width, _, height = info['Page size'].split()[:3]
+        return float(width), float(height)
+    except (KeyError, ValueError):
+        return DEFAULT_PAGE_SIZE_POINTS
+
+def plan_rasterization(info, settings):
+    """
+    Picks the DPI and the number of pages rendered at once so that the images
+    in memory stay under `max_memory_mb`, however many pages the PDF has.
+    A single page that would not fit is rendered at a lower DPI.
+    """
+    width_pts, height_pts = _page_size_points(info)
+    channels = 1 if settings['grayscale'] else 3
+    limit = settings['max_memory_mb'] * 1024 * 1024
+    dpi = settings['dpi']
+
+    page_bytes = (width_pts / 72 * dpi) * (height_pts / 72 * dpi) * channels
+    if page_bytes > limit:
+        dpi = max(1, int(dpi * math.sqrt(limit / page_bytes)))
+        return dpi, 1
+
+    window = max(1, min(settings['page_window'], int(limit // page_bytes)))
+    return dpi, window
+
+def _page_runs(page_numbers, window):
+    """
+    Groups sorted page numbers into contiguous runs of at most `window` pages.
+    """
+    runs = []
+    for page in sorted(page_numbers):
+        if runs and page == runs[-1][1] + 1 and page - runs[-1][0] < window:
+            runs[-1][1] = page
+        else:
+            runs.append([page, page])
+    return runs
+
+def iter_page_images(pdf_path, settings=None, page_numbers=None):
+    """
+    Yields (page number, PIL image) for the pages of a PDF, rasterizing a small
+    window of pages at a time and closing each image once the caller moves on.
+    Only `page_numbers` are rendered when given.
+    """
+    from pdf2image import convert_from_path, pdfinfo_from_path
+    settings = settings or ocr_settings()
+    info = pdfinfo_from_path(pdf_path)
+    if page_numbers is None:
+        page_numbers = range(1, info['Pages'] + 1)
+    dpi, window = plan_rasterization(info, settings)
+
+    for first_page, last_page in _page_runs(page_numbers, window):
+        with span('pdf.rasterize', stage='rasterize', first_page=first_page, last_page=last_page, dpi=dpi):
+            images = convert_from_path(
+                pdf_path,
+                dpi=dpi,
+                first_page=first_page,
+                last_page=last_page,
+                grayscale=settings['grayscale']
+            )
+        images.reverse()
+        page_number = first_page
+        while images:
+            image = images.pop()
+            try:
+                yield page_number, image
+            finally:
+                image.close()
+            page_number += 1
+
+def tesseract_config(options, dpi):
+    if not options['enabled']:
+        return ''
+    return f"--psm {options['psm']} --dpi {dpi}"
+
+def _ocr_image(image, page_number, dpi, settings, timeout):
+    """
+    Preprocesses one rasterized page and OCRs it. Blank pages are not sent to Tesseract and read as ''.
+    """
+    import pytesseract
+    from preprocessing import preprocess_page
+    options = PREPROCESS_PRESETS[settings['preprocess']]
+    with span('ocr.preprocess', stage='preprocess', page=page_number, preset=settings['preprocess']):
+        processed = preprocess_page(image, options, dpi)
+    if processed is None:
+        logger.debug("Skipping blank page %s", page_number)
+        return ''
+    page, page_dpi = processed
+    try:
+        with span('ocr.page', stage='ocr_page', page=page_number):
+            return pytesseract.image_to_string(page, lang=settings['lang'], config=tesseract_config(options, page_dpi), timeout=timeout)
+    finally:
+        if page is not image:
+            page.close()
+
+def _ocr_page(pdf_path, page_number, dpi, settings, timeout):
+    """
+    Rasterizes and OCRs a single page. Runs inside an OCR worker process, so
+    only the path and page number cross the process boundary, never the image.
+    """
+    from pdf2image import convert_from_path
+    with span('pdf.rasterize', stage='rasterize', first_page=page_number, last_page=page_number, dpi=dpi):
+        images = convert_from_path(
+            pdf_path,
+            dpi=dpi,
+            first_page=page_number,
+            last_page=page_number,
+            grayscale=settings['grayscale'],
+            timeout=timeout
+        )
+    try:
+        return _ocr_image(images[0], page_number, dpi, settings, timeout)
+    finally:
+        for image in images:
+            image.close()
+
+def _ocr_pages_serial(pdf_path, settings, page_numbers, dpi, timeout):
+    texts = {}
+    for page_number, image in iter_page_images(pdf_path, settings, page_numbers):
+        try:
+            texts[page_number] = _ocr_image(image, page_number, dpi, settings, timeout)
+        except Exception as e:
+            logger.warning("OCR failed for page %s of %s: %s", page_number, pdf_path, e)
+            texts[page_number] = None
+    return texts
+
+def _ocr_pages_parallel(pdf_path, settings, page_numbers, dpi, workers, timeout):
+    texts = {}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(metrics.run_collecting, _ocr_page, pdf_path, page_number, dpi, settings, timeout): page_number
+            for page_number in page_numbers
+        }
+        for future in as_completed(futures):
+            page_number = futures[future]
+            try:
+                texts[page_number], page_metrics = future.result()
+                metrics.merge(page_metrics)
+            except Exception as e:
+                logger.warning("OCR failed for page %s of %s: %s", page_number, pdf_path, e)
+                texts[page_number] = None
+    return texts
+
+def ocr_pdf_pages(pdf_path, settings=None, page_numbers=None, workers=None):
+    """
+    Runs Tesseract OCR on the pages of a PDF and returns a dict of page number
+    to text, in page order. Pages that fail or time out map to None.
+
+    With more than one worker, pages are spread across a process pool; the
+    number of pages in flight is capped by the memory budget, just like the
+    rasterization window of the single-process path.
+    """
+    from pdf2image import pdfinfo_from_path
+    settings = settings or ocr_settings()
+    workers = workers or ocr_page_workers()
+    timeout = ocr_page_timeout()
+    info = pdfinfo_from_path(pdf_path)
+    if page_numbers is None:
+        page_numbers = range(1, info['Pages'] + 1)
+    page_numbers = sorted(page_numbers)
+    dpi, window = plan_rasterization(info, settings)
+    workers = min(workers, window, len(page_numbers))
+
+    if workers > 1:
+        texts = _ocr_pages_parallel(pdf_path, settings, page_numbers, dpi, workers, timeout)
+    else:
+        texts = _ocr_pages_serial(pdf_path, settings, page_numbers, dpi, timeout)
+    return {page_number: texts.get(page_number) for page_number in page_numbers}
@@ -0,0 +1,108 @@
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pymongo import ASCENDING
+from metrics import OCR_CACHE_LOOKUPS
+from pdf_text import extract_pdf, extraction_settings, METHOD_FAILED
+
+DEFAULT_MAX_CACHE_BYTES = 256 * 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_sha256(path):
+    """
+    Hashes a file in chunks so large PDFs are never read into memory at once.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(sha256, settings):
+    """
+    Combines the file hash with the OCR settings that change the output.
+    """
+    return f"{sha256}:{json.dumps(settings, sort_keys=True)}"
+
+
+def ensure_ocr_cache_indexes(db):
+    db.ocr_cache.create_index([('last_used_at', ASCENDING)])
+
+
+def get_cached_extraction(db, sha256, settings):
+    """
+    Returns the cached extraction for a file hash and settings, or None on a miss.
+    """
+    entry = db.ocr_cache.find_one_and_update(
+        {'_id': cache_key(sha256, settings)},
+        {'$set': {'last_used_at': datetime.now(timezone.utc)}, '$inc': {'hits': 1}}
+    )
+    OCR_CACHE_LOOKUPS.inc(result='hit' if entry else 'miss')
+    return {'text': entry['text'], 'page_methods': entry.get('page_methods', [])} if entry else None
+
+
+def store_extraction(db, sha256, settings, extraction):
+    """
+    Saves extracted text for a file hash and settings, then evicts old entries if the cache is too large.
+    Extractions with failed pages are not cached so the next attempt retries them.
+    """
+    if METHOD_FAILED in extraction['page_methods']:
+        return
+    text = extraction['text']
+    now = datetime.now(timezone.utc)
+    db.ocr_cache.update_one(
+        {'_id': cache_key(sha256, settings)},
+        {'$set': {
+            'sha256': sha256,
+            'settings': settings,
+            'text': text,
+            'page_methods': extraction['page_methods'],
+            'size': len(text.encode('utf-8')),
+            'created_at': now,
+            'last_used_at': now
+        }, '$setOnInsert': {'hits': 0}},
+        upsert=True
+    )
+    evict(db)
+
+
+def evict(db, max_bytes=None):
+    """
+    Removes least recently used entries until the cached text fits in `max_bytes`.
+    """
+    if max_bytes is None:
+        max_bytes = int(os.environ.get('OCR_CACHE_MAX_BYTES', DEFAULT_MAX_CACHE_BYTES))
+
+    totals = list(db.ocr_cache.aggregate([{'$group': {'_id': None, 'size': {'$sum': '$size'}}}]))
+    total = totals[0]['size'] if totals else 0
+    if total <= max_bytes:
+        return 0
+
+    evicted = []
+    for entry in db.ocr_cache.find({}, {'size': 1}).sort('last_used_at', ASCENDING):
+        if total <= max_bytes:
+            break
+        evicted.append(entry['_id'])
+        total -= entry['size']
+    db.ocr_cache.delete_many({'_id': {'$in': evicted}})
+    return len(evicted)
+
+
+def cached_extract_pdf(db, pdf_path, sha256=None, settings=None):
+    """
+    Returns the extracted text of a PDF (see pdf_text.extract_pdf), reusing a
+    cached result when the same file has already been processed with the same settings.
+    """
+    settings = settings or extraction_settings()
+    sha256 = sha256 or file_sha256(pdf_path)
+
+    extraction = get_cached_extraction(db, sha256, settings)
+    if extraction is not None:
+        return extraction
+
+    extraction = extract_pdf(pdf_path, settings)
+    store_extraction(db, sha256, settings, extraction)
+    return extraction
@@ -0,0 +1,85 @@
+import io
+import os
+from ocr import ocr_settings, iter_page_images
+from tracing import span
+
+DEFAULT_IMAGE_DPI = 150
+DEFAULT_IMAGE_MAX_DIMENSION = 1600
+DEFAULT_IMAGE_PAGE_MAX_KB = 400
+# Gemini rejects requests over 20 MB of inline data; leave room for the prompt and JSON.
+DEFAULT_IMAGE_REQUEST_MAX_MB = 16
+JPEG_QUALITIES = (85, 70, 55, 40)
+SHRINK_FACTOR = 0.75
+MIN_DIMENSION = 400
+
+
+def image_settings():
+    """
+    Returns the settings that decide what page images the model sees.
+    """
+    return {
+        'dpi': int(os.environ.get('IMAGE_DPI', DEFAULT_IMAGE_DPI)),
+        'max_dimension': int(os.environ.get('IMAGE_MAX_DIMENSION', DEFAULT_IMAGE_MAX_DIMENSION)),
+        'page_max_bytes': int(os.environ.get('IMAGE_PAGE_MAX_KB', DEFAULT_IMAGE_PAGE_MAX_KB)) * 1024,
+        'request_max_bytes': int(float(os.environ.get('IMAGE_REQUEST_MAX_MB', DEFAULT_IMAGE_REQUEST_MAX_MB)) * 1024 * 1024)
+    }
+
+
+def base64_size(size):
+    return (size + 2) // 3 * 4
+
+
+def compress_page(image, max_bytes, max_dimension):
+    """
+    Returns the page as grayscale JPEG bytes of at most `max_bytes`, lowering
+    the quality first and then the resolution until it fits.
+    """
+    image = image.convert('L')
+    try:
+        image.thumbnail((max_dimension, max_dimension))
+        while True:
+            for quality in JPEG_QUALITIES:
+                buffer = io.BytesIO()
+                image.save(buffer, format='JPEG', quality=quality, optimize=True)
+                if buffer.tell() <= max_bytes:
+                    return buffer.getvalue()
+            if min(image.size) * SHRINK_FACTOR < MIN_DIMENSION:
+                # Any smaller and handwriting stops being legible; go slightly over budget instead.
+                return buffer.getvalue()
+            smaller = image.resize((int(image.width * SHRINK_FACTOR), int(image.height * SHRINK_FACTOR)))
+            image.close()
+            image = smaller
+    finally:
+        image.close()
+
+
+def render_page_images(pdf_path, settings=None):
+    """
+    Rasterizes a PDF a few pages at a time and returns each page as compressed
+    JPEG bytes, so only the small encoded pages are held in memory.
+    """
+    settings = settings or image_settings()
+    raster_settings = {**ocr_settings(), 'dpi': settings['dpi'], 'grayscale': True}
+    pages = []
+    for page_number, image in iter_page_images(pdf_path, raster_settings):
+        with span('images.encode', stage='encode_page_image', page=page_number):
+            pages.append(compress_page(image, settings['page_max_bytes'], settings['max_dimension']))
+    return pages
+
+
+def split_requests(pages, max_bytes):
+    """
+    Groups consecutive pages so that the base64-encoded images of each group fit
+    in one request. A page over the limit on its own still gets a group.
+    """
+    groups, group, group_bytes = [], [], 0
+    for page in pages:
+        size = base64_size(len(page))
+        if group and group_bytes + size > max_bytes:
+            groups.append(group)
+            group, group_bytes = [], 0
+        group.append(page)
+        group_bytes += size
+    if group:
+        groups.append(group)
+    return groups
@@ -0,0 +1,120 @@
+import logging
+import os
+import subprocess
+from ocr import ocr_settings, ocr_pdf_pages
+from metrics import PAGES_TOTAL
+from tracing import span
+
+logger = logging.getLogger(__name__)
+
+METHOD_TEXT_LAYER = 'text_layer'
+METHOD_OCR = 'ocr'
+METHOD_FAILED = 'failed'
+
+DEFAULT_MIN_PAGE_CHARS = 20
+MIN_READABLE_RATIO = 0.6
+TEXT_LAYER_TIMEOUT_SECONDS = 60
+
+
+def extraction_settings():
+    """
+    Returns every setting that affects the extracted text, for use in cache keys.
+    """
+    settings = ocr_settings()
+    settings['text_layer'] = os.environ.get('PDF_TEXT_LAYER', 'true').lower() in ('1', 'true', 'yes')
+    settings['min_page_chars'] = int(os.environ.get('PDF_TEXT_MIN_PAGE_CHARS', DEFAULT_MIN_PAGE_CHARS))
+    return settings
+
+
+def extract_text_layer(pdf_path):
+    """
+    Reads the embedded text of every page with poppler's pdftotext, which is
+    installed alongside pdf2image. Returns a list of page texts.
+    """
+    result = subprocess.run(
+        ['pdftotext', '-layout', '-enc', 'UTF-8', pdf_path, '-'],
+        capture_output=True,
+        timeout=TEXT_LAYER_TIMEOUT_SECONDS,
+        check=True
+    )
+    pages = result.stdout.decode('utf-8', errors='replace').split('\f')
+    # pdftotext ends every page with a form feed, leaving an empty trailing entry.
+    if pages and not pages[-1].strip():
+        pages.pop()
+    return pages
+
+
+def is_usable_text(text, min_chars):
+    """
+    True when a page's embedded text is long enough and mostly readable
+    (scanned pages have none, and broken font encodings produce symbol soup).
+    """
+    stripped = ''.join(text.split())
+    if len(stripped) < min_chars:
+        return False
+    readable = sum(1 for c in stripped if c.isalnum() or c in '.,;:!?()-\'"')
+    return readable / len(stripped) >= MIN_READABLE_RATIO
+
+
+def extract_pdf(pdf_path, settings=None, page_workers=None):
+    """
+    Extracts the text of a PDF, using the embedded text layer where a page has
+    usable text and OCR only for the pages that do not.
+    Returns a dict with the text of all pages, separated by form feeds, and the method used for each page.
+    `page_workers` caps the OCR processes (see ocr.ocr_pdf_pages).
+    """
+    settings = settings or extraction_settings()
+    with span('pdf.extract', stage='extract_pdf') as attributes:
+        extraction = _extract_pdf(pdf_path, settings, page_workers)
+        attributes['pages'] = len(extraction['page_methods'])
+    for method in extraction['page_methods']:
+        PAGES_TOTAL.inc(method=method)
+    return extraction
+
+
+def _extract_pdf(pdf_path, settings, page_workers):
+    layer_pages = []
+    if settings['text_layer']:
+        try:
+            with span('pdf.text_layer', stage='text_layer'):
+                layer_pages = extract_text_layer(pdf_path)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning("Could not read text layer of %s, falling back to OCR: %s", pdf_path, e)
+
+    if layer_pages:
+        page_texts = {
+            number: text
+            for number, text in enumerate(layer_pages, start=1)
+            if is_usable_text(text, settings['min_page_chars'])
+        }
+        missing_pages = [number for number in range(1, len(layer_pages) + 1) if number not in page_texts]
+        ocr_texts = ocr_pdf_pages(pdf_path, settings, missing_pages, page_workers) if missing_pages else {}
+    else:
+        page_texts = {}
+        ocr_texts = ocr_pdf_pages(pdf_path, settings, workers=page_workers)
+
+    methods = {number: METHOD_TEXT_LAYER for number in page_texts}
+    for number, text in ocr_texts.items():
+        page_texts[number] = text or ''
+        methods[number] = METHOD_OCR if text is not None else METHOD_FAILED
+
+    page_numbers = sorted(page_texts)
+    return {
+        # Pages are separated by form feeds, as Tesseract ends each page, so
+        # later steps (e.g. header removal) can tell pages apart whatever their source.
+        'text': '\f'.join(page_texts[number].rstrip('\f') for number in page_numbers),
+        'page_methods': [methods[number] for number in page_numbers]
+    }
+
+
+def extraction_summary(extraction):
+    """
+    Summarizes how a document's text was obtained, for storing on the document.
+    """
+    methods = extraction['page_methods']
+    return {
+        'page_methods': methods,
+        'text_layer_pages': methods.count(METHOD_TEXT_LAYER),
+        'ocr_pages': methods.count(METHOD_OCR),
+        'failed_pages': methods.count(METHOD_FAILED)
+    }
@@ -0,0 +1,164 @@
+import time
+import numpy as np
+from PIL import Image
+
+# Fraction of dark pixels below which a page counts as blank; speckle from
+# scanning stays well under it, a single handwritten line does not.
+BLANK_INK_RATIO = 0.002
+DARK_LEVEL = 128
+# Adaptive threshold window, as a fraction of an inch, and how much darker than
+# its neighbourhood a pixel must be to count as ink.
+THRESHOLD_WINDOW_INCHES = 1 / 6
+THRESHOLD_OFFSET = 12
+# Skew search range and step in degrees, measured on a reduced copy of the page.
+DESKEW_MAX_ANGLE = 5.0
+DESKEW_STEP = 0.25
+DESKEW_SAMPLE_WIDTH = 800
+DESKEW_MAX_POINTS = 20000
+DESKEW_MIN_ANGLE = 0.1
+
+
+def _timed(timings, name, func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    if timings is not None:
+        timings[name] = time.perf_counter() - start
+    return result
+
+
+def normalize_dpi(image, source_dpi, target_dpi):
+    """
+    Scales a page rendered above `target_dpi` down to it. Returns (image, dpi).
+    """
+    if not target_dpi or source_dpi <= target_dpi:
+        return image, source_dpi
+    scale = target_dpi / source_dpi
+    return image.resize((max(1, round(image.width * scale)), max(1, round(image.height * scale))), Image.BILINEAR), target_dpi
+
+
+def ink_ratio(pixels):
+    return np.count_nonzero(pixels < DARK_LEVEL) / pixels.size
+
+
+def estimate_skew(pixels):
+    """
+    Returns the angle in degrees, as Image.rotate takes it, that straightens the
+    text lines of a page: the rotation whose horizontal projection has the sharpest rows.
+    """
+    step = max(1, pixels.shape[1] // DESKEW_SAMPLE_WIDTH)
+    ys, xs = np.nonzero(pixels[::step, ::step] < DARK_LEVEL)
+    if len(ys) < 100:
+        return 0.0
+    if len(ys) > DESKEW_MAX_POINTS:
+        keep = np.random.default_rng(0).choice(len(ys), DESKEW_MAX_POINTS, replace=False)
+        ys, xs = ys[keep], xs[keep]
+
+    angles = np.arange(-DESKEW_MAX_ANGLE, DESKEW_MAX_ANGLE + DESKEW_STEP / 2, DESKEW_STEP)
+    radians = np.deg2rad(angles)
+    rows = np.rint(ys[None, :] * np.cos(radians)[:, None] - xs[None, :] * np.sin(radians)[:, None]).astype(np.int64)
+    rows -= rows.min(axis=1, keepdims=True)
+    scores = [np.square(np.bincount(row)).sum() for row in rows]
+    return float(angles[int(np.argmax(scores))])
+
+
+def deskew(image, pixels):
+    angle = estimate_skew(pixels)
+    if abs(angle) < DESKEW_MIN_ANGLE:
+        return image, pixels, angle
+    rotated = image.rotate(angle, resample=Image.BILINEAR, fillcolor=255)
+    return rotated, np.asarray(rotated), angle
+
+
+def adaptive_threshold(pixels, dpi):
+    """
+    Binarizes a grayscale page against the mean of each pixel's neighbourhood,
+    so shadows and uneven paper do not swallow the ink. Uses an integral image,
+    so the cost does not depend on the window size.
+    """
+    height, width = pixels.shape
+    radius = max(1, int(dpi * THRESHOLD_WINDOW_INCHES) // 2)
+    integral = np.zeros((height + 1, width + 1), dtype=np.int64)
+    np.cumsum(np.cumsum(pixels, axis=0, dtype=np.int64), axis=1, out=integral[1:, 1:])
+
+    top = np.clip(np.arange(height) - radius, 0, height)
+    bottom = np.clip(np.arange(height) + radius + 1, 0, height)
+    left = np.clip(np.arange(width) - radius, 0, width)
+    right = np.clip(np.arange(width) + radius + 1, 0, width)
+
+    sums = integral[bottom][:, right]
+    sums -= integral[top][:, right]
+    sums -= integral[bottom][:, left]
+    sums += integral[top][:, left]
+    counts = (bottom - top)[:, None] * (right - left)[None, :]
+    # pixel < mean - offset, without dividing: pixel * count < sum - offset * count
+    ink = pixels.astype(np.int64) * counts < sums - THRESHOLD_OFFSET * counts
+    return np.where(ink, 0, 255).astype(np.uint8)
+
+
+def preprocess_page(image, options, dpi, timings=None):
+    """
+    Prepares a rasterized page for Tesseract according to a preset (see
+    ocr.PREPROCESS_PRESETS). Returns (image, dpi), or None for a blank page
+    when the preset skips them. Step durations go into `timings` when given.
+    """
+    if not options['enabled']:
+        return image, dpi
+
+    page = _timed(timings, 'grayscale', image.convert, 'L')
+    page, dpi = _timed(timings, 'normalize_dpi', normalize_dpi, page, dpi, options['target_dpi'])
+    pixels = np.asarray(page)
+
+    if options['skip_blank'] and _timed(timings, 'blank_check', ink_ratio, pixels) < BLANK_INK_RATIO:
+        return None
+    if options['deskew']:
+        page, pixels, angle = _timed(timings, 'deskew', deskew, page, pixels)
+        if timings is not None:
+            timings['skew_degrees'] = angle
+    if options['threshold']:
+        page = Image.fromarray(_timed(timings, 'threshold', adaptive_threshold, pixels, dpi))
+    return page, dpi
+
+
+if __name__ == '__main__':
+    import argparse
+    import pytesseract
+    from pdf2image import pdfinfo_from_path
+    from ocr import PREPROCESS_PRESETS, ocr_settings, iter_page_images, tesseract_config
+
+    parser = argparse.ArgumentParser(description='Compare OCR preprocessing presets page by page.')
+    parser.add_argument('pdfs', nargs='+')
+    parser.add_argument('--presets', nargs='+', default=list(PREPROCESS_PRESETS), choices=list(PREPROCESS_PRESETS))
+    args = parser.parse_args()
+
+    totals = {preset: {'pages': 0, 'preprocess': 0.0, 'ocr': 0.0, 'chars': 0} for preset in args.presets}
+    print(f"{'file':<30} {'page':>8} {'preset':<9} {'raster ms':>9} {'prep ms':>8} {'ocr ms':>8} {'chars':>6} {'skew':>6}")
+    for pdf_path in args.pdfs:
+        pages = pdfinfo_from_path(pdf_path)['Pages']
+        for preset in args.presets:
+            options = PREPROCESS_PRESETS[preset]
+            settings = {**ocr_settings(), 'preprocess': preset, 'dpi': options['dpi']}
+            raster_start = time.perf_counter()
+            for page_number, image in iter_page_images(pdf_path, settings):
+                raster = time.perf_counter() - raster_start
+                timings = {}
+                start = time.perf_counter()
+                processed = preprocess_page(image, options, settings['dpi'], timings)
+                prep = time.perf_counter() - start
+                start = time.perf_counter()
+                text = '' if processed is None else pytesseract.image_to_string(
+                    processed[0], lang=settings['lang'], config=tesseract_config(options, processed[1]))
+                ocr_seconds = time.perf_counter() - start
+                print(f"{pdf_path[-30:]:<30} {page_number:>4}/{pages:<3} {preset:<9} {raster * 1000:>9.0f} {prep * 1000:>8.0f} "
+                      f"{ocr_seconds * 1000:>8.0f} {len(text.strip()):>6} {timings.get('skew_degrees', 0):>6.2f}")
+                total = totals[preset]
+                total['pages'] += 1
+                total['preprocess'] += prep
+                total['ocr'] += ocr_seconds
+                total['chars'] += len(text.strip())
+                raster_start = time.perf_counter()
+
+    print()
+    for preset, total in totals.items():
+        pages = total['pages'] or 1
+        print(f"{preset:<9} {total['pages']} pages: preprocess {total['preprocess'] / pages * 1000:.0f} ms/page, "
+              f"OCR {total['ocr'] / pages * 1000:.0f} ms/page, {total['chars']} characters")
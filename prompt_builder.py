@@ -0,0 +1,235 @@
+import math
+import os
+import re
+from collections import Counter
+
+# Gemini averages about four characters of English per token. The token counts it
+# reports (ai_tokens_total) are the check on this estimate.
+CHARS_PER_TOKEN = 4
+DEFAULT_SECTION_TOKENS = 6000
+DEFAULT_MAX_SECTIONS = 8
+DEFAULT_REFERENCE_MAX_TOKENS = 4000
+DEFAULT_SECTION_CONCURRENCY = 4
+
+# Longer lines that are mostly symbols rather than letters and digits are taken for scan noise.
+NOISE_MIN_CHARS = 4
+NOISE_MAX_ALNUM_RATIO = 0.4
+# Lines at the top or bottom of this many pages (page numbers aside) are headers
+# and footers; only their first occurrence is kept.
+HEADER_MIN_PAGES = 3
+HEADER_EDGE_LINES = 2
+
+TRUNCATION_MARK = '\n[... truncated ...]'
+
+
+def prompt_settings():
+    return {
+        'section_tokens': int(os.environ.get('EVALUATION_SECTION_TOKENS', DEFAULT_SECTION_TOKENS)),
+        'max_sections': int(os.environ.get('EVALUATION_MAX_SECTIONS', DEFAULT_MAX_SECTIONS)),
+        'reference_max_tokens': int(os.environ.get('REFERENCE_MAX_TOKENS', DEFAULT_REFERENCE_MAX_TOKENS)),
+        'section_concurrency': int(os.environ.get('EVALUATION_SECTION_CONCURRENCY', DEFAULT_SECTION_CONCURRENCY))
+    }
+
+
+def estimate_tokens(text):
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def truncate_to_tokens(text, max_tokens):
+    """
+    Cuts text to about `max_tokens`, at a line break when there is one nearby.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+    cut = text.rfind('\n', max_chars // 2, max_chars)
+    return text[:cut if cut > 0 else max_chars] + TRUNCATION_MARK
+
+
+def _is_noise(line):
+    visible = line.replace(' ', '')
+    alnum = sum(char.isalnum() for char in visible)
+    return alnum == 0 or (len(visible) >= NOISE_MIN_CHARS and alnum / len(visible) < NOISE_MAX_ALNUM_RATIO)
+
+
+def _header_key(line):
+    return re.sub(r'\d+', '#', line)
+
+
+def _page_headers(pages):
+    """
+    Returns the keys of lines found at the edges of at least HEADER_MIN_PAGES pages.
+    """
+    counts = Counter()
+    for page in pages:
+        lines = [line for line in page if line]
+        edges = lines[:HEADER_EDGE_LINES] + lines[-HEADER_EDGE_LINES:]
+        counts.update({_header_key(line) for line in edges})
+    return {key for key, count in counts.items() if count >= HEADER_MIN_PAGES}
+
+
+def clean_ocr_text(text):
+    """
+    Strips what OCR adds besides the answer: symbol-only speckle lines, page
+    headers and footers repeated on every page, doubled lines, form feeds and
+    runs of whitespace. Paragraph breaks are kept so long answers can still be
+    split into sections.
+    """
+    pages = [
+        [re.sub(r'[ \t]+', ' ', line).strip() for line in page.splitlines()]
+        for page in text.split('\f')
+    ]
+    headers = _page_headers(pages)
+
+    cleaned, seen_headers = [], set()
+    for page in pages:
+        for line in page + ['']:
+            if not line:
+                if cleaned and cleaned[-1]:
+                    cleaned.append('')
+                continue
+            if _is_noise(line) or (cleaned and line == cleaned[-1]):
+                continue
+            key = _header_key(line)
+            if key in headers:
+                if key in seen_headers:
+                    continue
+                seen_headers.add(key)
+            cleaned.append(line)
+    return '\n'.join(cleaned).strip()
+
+
+def _split_long(text, max_chars, separator):
+    pieces, current = [], ''
+    for piece in text.split(separator):
+        candidate = f"{current}{separator}{piece}" if current else piece
+        if len(candidate) <= max_chars:
+            current = candidate
+            continue
+        if current:
+            pieces.append(current)
+        current = piece
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_sections(text, max_tokens):
+    """
+    Splits text into sections of at most about `max_tokens`, preferring
+    paragraph breaks, then line breaks, then a hard cut.
+    """
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    sections = []
+    for paragraph_group in _split_long(text, max_chars, '\n\n'):
+        if len(paragraph_group) <= max_chars:
+            sections.append(paragraph_group)
+            continue
+        for line_group in _split_long(paragraph_group, max_chars, '\n'):
+            sections.extend(line_group[start:start + max_chars] for start in range(0, len(line_group), max_chars))
+    return sections
+
+
+def plan_sections(student_text, settings=None):
+    """
+    Returns (sections, truncated): the sections of an answer to evaluate
+    separately, one for an answer within the section budget, otherwise up to
+    `max_sections`. `truncated` is True when sections past that were dropped.
+    """
+    settings = settings or prompt_settings()
+    if estimate_tokens(student_text) <= settings['section_tokens']:
+        return [student_text], False
+    sections = split_sections(student_text, settings['section_tokens'])
+    return sections[:settings['max_sections']], len(sections) > settings['max_sections']
+
+
+def build_evaluation_prompt(reference_text, section=None, sections=1, settings=None):
+    """
+    Builds the grading instructions sent to Gemini ahead of the student's answer,
+    which goes in its own part of the request. For long answers graded in
+    sections, `section` is the 1-based number of the part that follows.
+    """
+    settings = settings or prompt_settings()
+    reference_text = truncate_to_tokens(reference_text, settings['reference_max_tokens'])
+    if section is None or sections == 1:
+        answer_note = "The student's answer (extracted from handwritten text) follows these instructions."
+        task = "give a score from 0 to 100 for the student's work"
+    else:
+        answer_note = (f"The student's answer is long, so it is graded in parts. "
+                       f"Part {section} of {sections} (extracted from handwritten text) follows these instructions.")
+        task = ("give a score from 0 to 100 for how correct and complete this part is for the points "
+                "of the reference it addresses, without penalizing points other parts may cover,")
+    return f"""
+            You are an AI grading assistant. Your task is to evaluate a student's answer against a reference answer.
+
+            Reference Answer (summarized):
+            {reference_text}
+
+            {answer_note}
+
+            Based on the provided texts, {task} and provide constructive feedback of 1-2 sentences.
+
+            Return the output in a JSON format with the following keys:
+            "score": "The score as a number from 0 to 100",
+            "remarks": "The constructive feedback"
+            """
+
+
+def build_image_evaluation_prompt(reference_text, settings=None):
+    """
+    Builds the grading prompt sent along with the images of a submission's pages.
+    """
+    settings = settings or prompt_settings()
+    reference_text = truncate_to_tokens(reference_text, settings['reference_max_tokens'])
+    return f"""
+            You are an AI grading assistant. Your task is to evaluate a student's answer against a reference answer.
+
+            Reference Answer (summarized):
+            {reference_text}
+
+            The student's handwritten answer is in the attached page images, in order.
+
+            Based on the reference and the student's pages, give a score from 0 to 100 for the student's work and provide constructive feedback of 1-2 sentences.
+
+            Return the output in a JSON format with the following keys:
+            "score": "The score as a number from 0 to 100",
+            "remarks": "The constructive feedback"
+            """
+
+
+def parse_score(value):
+    """
+    Reads a model's score, which may come back as a number or as text such as
+    "85", as an int or float. Returns None when it is not a number.
+    """
+    try:
+        score = float(value)
+    except (TypeError, ValueError):
+        return None
+    if not math.isfinite(score):
+        return None
+    return int(score) if score.is_integer() else score
+
+
+def aggregate_evaluations(evaluations, sections):
+    """
+    Combines per-section evaluations into one, weighting each score by the
+    length of its section. Sections whose score is not a number are left out;
+    the score is None if none has one.
+    """
+    weighted, total_weight = 0.0, 0
+    for evaluation, section in zip(evaluations, sections):
+        score = parse_score(evaluation.get('score'))
+        if score is None:
+            continue
+        weighted += score * len(section)
+        total_weight += len(section)
+
+    remarks = ' '.join(
+        f"Part {number}: {evaluation.get('remarks', '').strip()}"
+        for number, evaluation in enumerate(evaluations, start=1) if evaluation.get('remarks')
+    )
+    return {
+        'score': round(weighted / total_weight) if total_weight else None,
+        'remarks': remarks or 'No remarks provided.'
+    }
@@ -0,0 +1,144 @@
+from bson.objectid import ObjectId
+
+SUBMISSIONS_PER_PAGE = 24
+
+# Sort options for the submissions list, as (field, direction) pairs.
+SUBMISSION_SORTS = {
+    'ungraded': [('graded', 1), ('upload_date', -1)],
+    'newest': [('upload_date', -1)],
+    'oldest': [('upload_date', 1)],
+    'score': [('graded', -1), ('ai_score', -1), ('upload_date', -1)],
+}
+DEFAULT_SUBMISSION_SORT = 'ungraded'
+
+SUBMISSION_LIST_FIELDS = {
+    'assignment_id': 1, 'student_id': 1, 'class_name': 1, 'filename': 1, 'file_path': 1, 'sha256': 1,
+    'upload_date': 1, 'ai_score': 1, 'ai_remarks': 1, 'ai_cache_hit': 1, 'ai_reused_from': 1, 'ai_truncated': 1,
+    'near_duplicates': 1
+}
+
+
+def usernames_by_id(db, user_ids):
+    """
+    Fetches the usernames of many users with a single $in query.
+    """
+    object_ids = list({ObjectId(user_id) for user_id in user_ids if user_id})
+    if not object_ids:
+        return {}
+    users = db.users.find({'_id': {'$in': object_ids}}, {'username': 1})
+    return {str(user['_id']): user['username'] for user in users}
+
+
+def submissions_page(db, assignment_id, sort=DEFAULT_SUBMISSION_SORT, page=1, per_page=SUBMISSIONS_PER_PAGE):
+    """
+    Returns one page of an assignment's submissions plus totals for the whole
+    assignment, using one aggregation and one batched username lookup.
+    Each returned document carries a `student_username`.
+    """
+    sort_spec = SUBMISSION_SORTS.get(sort, SUBMISSION_SORTS[DEFAULT_SUBMISSION_SORT])
+    page = max(1, page)
+
+    pipeline = [
+        {'$match': {'assignment_id': ObjectId(assignment_id)}},
+        {'$project': SUBMISSION_LIST_FIELDS},
+        {'$addFields': {'graded': {'$cond': [{'$ifNull': ['$ai_score', False]}, 1, 0]}}},
+        {'$facet': {
+            'stats': [{'$group': {'_id': None, 'total': {'$sum': 1}, 'graded': {'$sum': '$graded'}}}],
+            'page': [
+                {'$sort': dict(sort_spec)},
+                {'$skip': (page - 1) * per_page},
+                {'$limit': per_page}
+            ]
+        }}
+    ]
+    result = next(db.submissions.aggregate(pipeline), {'stats': [], 'page': []})
+
+    stats = result['stats'][0] if result['stats'] else {'total': 0, 'graded': 0}
+    docs = result['page']
+    usernames = usernames_by_id(db, [doc.get('student_id') for doc in docs])
+    for doc in docs:
+        doc['student_username'] = usernames.get(str(doc.get('student_id')), 'Unknown')
+
+    total = stats['total']
+    return {
+        'submissions': docs,
+        'total': total,
+        'graded': stats['graded'],
+        'pending': total - stats['graded'],
+        'page': page,
+        'pages': max(1, -(-total // per_page)),
+        'sort': sort if sort in SUBMISSION_SORTS else DEFAULT_SUBMISSION_SORT
+    }
+
+
+USER_LIST_FIELDS = {'username': 1, 'email': 1, 'user_type': 1, 'class_name': 1, 'subject': 1}
+ASSIGNMENT_LIST_EXCLUDED_FIELDS = {'reference_text': 0, 'reference_extraction': 0}
+
+
+def class_members(db, class_name):
+    """
+    Returns the (teachers, students) user documents of a class from one query.
+    Password hashes are not fetched.
+    """
+    teachers, students = [], []
+    members = db.users.find(
+        {'class_name': class_name, 'user_type': {'$in': ['teacher', 'student']}},
+        USER_LIST_FIELDS
+    )
+    for doc in members:
+        (teachers if doc['user_type'] == 'teacher' else students).append(doc)
+    return teachers, students
+
+
+def class_assignments(db, class_name, teacher_id=None):
+    """
+    Returns a class's assignments sorted by due date, without the large reference fields.
+    """
+    query = {'class_name': class_name}
+    if teacher_id:
+        query['teacher_id'] = teacher_id
+    return list(db.assignments.find(query, ASSIGNMENT_LIST_EXCLUDED_FIELDS).sort('due_date'))
+
+
+def assignment_submission_stats(db, assignment_ids, class_size):
+    """
+    Computes submitted, not-yet-submitted, graded and awaiting-grading counts and
+    the average AI score for many assignments in a single $group aggregation.
+    """
+    stats = {
+        assignment_id: {'submitted': 0, 'pending': class_size, 'graded': 0, 'ungraded': 0, 'average_score': None}
+        for assignment_id in assignment_ids
+    }
+    if not assignment_ids:
+        return stats
+
+    pipeline = [
+        {'$match': {'assignment_id': {'$in': [ObjectId(assignment_id) for assignment_id in assignment_ids]}}},
+        {'$group': {
+            '_id': '$assignment_id',
+            'submitted': {'$sum': 1},
+            'graded': {'$sum': {'$cond': [{'$ifNull': ['$ai_score', False]}, 1, 0]}},
+            'average_score': {'$avg': '$ai_score'}
+        }}
+    ]
+    for row in db.submissions.aggregate(pipeline):
+        assignment_id = str(row['_id'])
+        stats[assignment_id] = {
+            'submitted': row['submitted'],
+            'pending': max(0, class_size - row['submitted']),
+            'graded': row['graded'],
+            'ungraded': row['submitted'] - row['graded'],
+            'average_score': round(row['average_score'], 1) if row['average_score'] is not None else None
+        }
+    return stats
+
+
+def submitted_assignment_ids(db, student_id, assignment_ids):
+    """
+    Returns the ids of the given assignments that a student has submitted, via one projected $in query.
+    """
+    submissions = db.submissions.find(
+        {'student_id': ObjectId(student_id), 'assignment_id': {'$in': [ObjectId(assignment_id) for assignment_id in assignment_ids]}},
+        {'assignment_id': 1, '_id': 0}
+    )
+    return [str(s['assignment_id']) for s in submissions]
@@ -0,0 +1,70 @@
+import logging
+from datetime import datetime
+from bson.objectid import ObjectId
+from gemini_api import call_deepseek_api_for_summarization
+from ocr_cache import cached_extract_pdf
+from storage import get_storage, resolve_file
+from pdf_text import extraction_summary
+from evaluation_cache import invalidate_assignment_evaluations
+
+logger = logging.getLogger(__name__)
+
+REFERENCE_PENDING = 'pending'
+REFERENCE_PROCESSING = 'processing'
+REFERENCE_READY = 'ready'
+REFERENCE_FAILED = 'failed'
+
+
+class ReferenceNotReady(Exception):
+    """Raised when grading needs a reference answer that is still being processed."""
+
+
+def reference_status(assignment_doc):
+    """
+    Returns the reference status of an assignment. Assignments created before
+    references were processed in the background already hold their summary.
+    """
+    return assignment_doc.get('reference_status', REFERENCE_READY)
+
+
+def prepare_reference(db, assignment_id):
+    """
+    Extracts and summarizes the reference answer of an assignment, then marks it ready.
+    Falls back to the raw reference text if summarization fails.
+    """
+    assignment_doc = db.assignments.find_one({'_id': ObjectId(assignment_id)})
+    if not assignment_doc:
+        raise ValueError('Assignment not found.')
+
+    db.assignments.update_one(
+        {'_id': assignment_doc['_id']},
+        {'$set': {'reference_status': REFERENCE_PROCESSING}}
+    )
+
+    reference_sha256 = assignment_doc.get('reference_sha256')
+    reference_path = resolve_file(get_storage(db), reference_sha256, assignment_doc.get('reference_file_path'))
+    reference_extraction = cached_extract_pdf(db, reference_path, sha256=reference_sha256)
+    reference_text = reference_extraction['text']
+
+    deepseek_response = call_deepseek_api_for_summarization(reference_text)
+    summarized_reference = deepseek_response if deepseek_response else reference_text
+
+    db.assignments.update_one(
+        {'_id': assignment_doc['_id']},
+        {'$set': {
+            'reference_text': summarized_reference,
+            'reference_extraction': extraction_summary(reference_extraction),
+            'reference_status': REFERENCE_READY,
+            'reference_ready_date': datetime.now()
+        }, '$unset': {'reference_error': ''}}
+    )
+    invalidate_assignment_evaluations(db, str(assignment_doc['_id']))
+    logger.info("Reference for assignment %s is ready", assignment_id, extra={'summarized': bool(deepseek_response)})
+    return {'reference_status': REFERENCE_READY, 'summarized': bool(deepseek_response)}
+
+
+def mark_reference_failed(db, assignment_id, error):
+    db.assignments.update_one(
+        {'_id': ObjectId(assignment_id)},
+        {'$set': {'reference_status': REFERENCE_FAILED, 'reference_error': str(error)}}
+    )
@@ -1,19 +1,60 @@
 import os
 import json
-import secrets
-from flask import render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify
+from flask import render_template, request, redirect, url_for, flash, session, send_file, jsonify, Response
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 from bson.objectid import ObjectId
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
 from models import User, Assignment, Submission
-from pdf2image import convert_from_path
-import pytesseract
-from gemini_api import call_gemini_api_for_evaluation, call_deepseek_api_for_summarization
-from notification_system import send_notification
+from job_queue import enqueue_job, get_job, serialize_job, active_jobs_for_assignment
+from batch_grading import create_batch, get_batch, serialize_batch, active_batch_for_assignment
+from reference import reference_status, REFERENCE_PENDING, REFERENCE_FAILED
+from grading import GRADING_MODE_OCR, GRADING_MODES
+from similarity import duplicate_groups
+from live_status import assignment_status_stream, parse_event_id
+from queries import (
+    submissions_page, SUBMISSION_SORTS, DEFAULT_SUBMISSION_SORT,
+    class_members, class_assignments, assignment_submission_stats, submitted_assignment_ids, usernames_by_id
+)
+from notification_outbox import queue_notification
+from user_cache import cache_user, invalidate_user
+from uploads import save_upload, upload_limit, DEFAULT_SUBMISSION_MAX_MB, DEFAULT_ASSIGNMENT_MAX_MB
+from storage import get_storage, resolve_file, release_file, delete_legacy_file
+import metrics
+
+def wants_json():
+    """True when the client asked for a JSON response (e.g. a fetch() call)."""
+    return request.accept_mimetypes.best == 'application/json'
+
+def send_stored_file(storage, sha256, legacy_path, download_name):
+    """
+    Sends a stored file with its content hash as the ETag, so repeat downloads
+    get a 304 and partial requests get a 206 via Werkzeug's conditional handling.
+    """
+    path = resolve_file(storage, sha256, legacy_path)
+    response = send_file(path, as_attachment=True, download_name=download_name,
+                         etag=sha256 or True, conditional=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
 
 def register_routes(app):
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not metrics.scrape_allowed(request.headers.get('Authorization'), request.remote_addr):
+            return Response('Unauthorized\n', status=401, mimetype='text/plain')
+        return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+    @app.errorhandler(413)
+    def upload_too_large(error):
+        message = 'The uploaded file is too large.'
+        if wants_json():
+            return jsonify({'error': message}), 413
+        flash(message, 'danger')
+        return redirect(request.referrer or url_for('dashboard'))
+
     @app.route('/')
     @app.route('/home')
     def home():
@@ -71,6 +112,7 @@ def register_routes(app):
 
             if user_doc and check_password_hash(user_doc['password'], password):
                 user = User(user_doc)
+                cache_user(user)
                 login_user(user, remember=remember)
                 flash('Logged in successfully!', 'success')
                 return redirect(url_for('dashboard'))
@@ -90,49 +132,32 @@ def register_routes(app):
         user_type = current_user.user_type
         class_name = current_user.class_name
         
-        teachers_docs = list(app.db.users.find({'user_type': 'teacher', 'class_name': class_name}))
-        students_docs = list(app.db.users.find({'user_type': 'student', 'class_name': class_name}))
+        teachers_docs, students_docs = class_members(app.db, class_name)
         
         teachers = [User(doc) for doc in teachers_docs]
         students = [User(doc) for doc in students_docs]
         
-        assignments_docs = []
         if user_type == 'teacher':
-            assignments_docs = list(app.db.assignments.find({
-                'class_name': class_name,
-                'teacher_id': current_user.get_id()
-            }).sort('due_date'))
+            assignments_docs = class_assignments(app.db, class_name, teacher_id=current_user.get_id())
         else:
-            assignments_docs = list(app.db.assignments.find({
-                'class_name': class_name
-            }).sort('due_date'))
+            assignments_docs = class_assignments(app.db, class_name)
             
         assignments = [Assignment(doc) for doc in assignments_docs]
+        assignment_ids = [assignment.id for assignment in assignments]
 
-        submitted_assignment_ids = []
+        submitted_ids = []
         if user_type == 'student':
-            student_id = current_user.get_id()
-            submitted_assignment_ids = [
-                str(s.get('assignment_id')) for s in app.db.submissions.find({'student_id': student_id}, {'assignment_id': 1})
-            ]
+            submitted_ids = submitted_assignment_ids(app.db, current_user.get_id(), assignment_ids)
         
         assignment_stats = {}
         if user_type == 'teacher':
-            total_students_in_class = len(students)
-            for assignment in assignments:
-                submitted_count = app.db.submissions.count_documents({
-                    'assignment_id': assignment.id
-                })
-                assignment_stats[assignment.id] = {
-                    'submitted': submitted_count,
-                    'pending': total_students_in_class - submitted_count
-                }
+            assignment_stats = assignment_submission_stats(app.db, assignment_ids, len(students))
 
         if user_type == 'teacher':
             return render_template("teacher_dashboard.html", title="Teacher Dashboard", class_name=class_name, students=students, teachers=teachers, assignments=assignments, assignment_stats=assignment_stats)
         
         elif user_type == 'student':
-            return render_template("student_dashboard.html", title="Student Dashboard", class_name=class_name, students=students, teachers=teachers, assignments=assignments, submitted_assignment_ids=submitted_assignment_ids)
+            return render_template("student_dashboard.html", title="Student Dashboard", class_name=class_name, students=students, teachers=teachers, assignments=assignments, submitted_assignment_ids=submitted_ids)
         
         else:
             flash('Unexpected user type.', 'danger')
@@ -149,35 +174,28 @@ def register_routes(app):
             if app.db is None:
                 flash('Database connection error.', 'danger')
                 return redirect(url_for('dashboard'))
-            
+
+            request.max_content_length = upload_limit('ASSIGNMENT_MAX_MB', DEFAULT_ASSIGNMENT_MAX_MB)
             title = request.form.get('title')
             description = request.form.get('description')
             due_date = request.form.get('due_date')
+            grading_mode = request.form.get('grading_mode', GRADING_MODE_OCR)
+            if grading_mode not in GRADING_MODES:
+                grading_mode = GRADING_MODE_OCR
             file = request.files['file']
             reference_file = request.files['reference_file']
 
             if file and file.filename.rsplit('.', 1)[1].lower() == 'pdf' and \
                reference_file and reference_file.filename.rsplit('.', 1)[1].lower() == 'pdf':
                 
-                # We need to save the files first to get a path for pdf2image
-                assignment_path = os.path.join(app.config['UPLOAD_FOLDER'], 'assignments', str(ObjectId()))
-                os.makedirs(assignment_path, exist_ok=True)
-                
-                file_path = os.path.join(assignment_path, secure_filename(file.filename))
-                file.save(file_path)
-                
-                reference_file_path = os.path.join(assignment_path, secure_filename(reference_file.filename))
-                reference_file.save(reference_file_path)
-
-                # Convert reference PDF to images and then to text
-                reference_images = convert_from_path(reference_file_path)
-                reference_text = ""
-                for img in reference_images:
-                    reference_text += pytesseract.image_to_string(img)
-                
-                # Summarize the reference text using DeepSeek
-                deepseek_response = call_deepseek_api_for_summarization(reference_text)
-                summarized_reference = deepseek_response if deepseek_response else reference_text
+                # Store both files now; the reference is extracted and summarized by the worker
+                storage = get_storage(app.db)
+                saved_file = save_upload(file, storage, app.db)
+                try:
+                    saved_reference = save_upload(reference_file, storage, app.db)
+                except Exception:
+                    release_file(app.db, saved_file['sha256'])
+                    raise
 
                 assignment_id = app.db.assignments.insert_one({
                     'title': title,
@@ -187,11 +205,19 @@ def register_routes(app):
                     'subject': current_user.subject,
                     'teacher_id': current_user.get_id(),
                     'filename': secure_filename(file.filename),
-                    'file_path': file_path,
-                    'reference_text': summarized_reference
+                    'file_sha256': saved_file['sha256'],
+                    'file_size': saved_file['size'],
+                    'reference_filename': secure_filename(reference_file.filename),
+                    'reference_sha256': saved_reference['sha256'],
+                    'reference_size': saved_reference['size'],
+                    'reference_text': None,
+                    'reference_status': REFERENCE_PENDING,
+                    'grading_mode': grading_mode
                 }).inserted_id
+
+                enqueue_job(app.db, 'prepare_reference', {'assignment_id': str(assignment_id)})
                 
-                flash('Assignment created successfully!', 'success')
+                flash('Assignment created successfully! The answer key is being processed in the background.', 'success')
                 
                 students_in_class = list(app.db.users.find({'class_name': current_user.class_name, 'user_type': 'student'}))
                 student_emails = [s['email'] for s in students_in_class]
@@ -203,7 +229,7 @@ def register_routes(app):
                     'due_date': due_date,
                     'emails': student_emails
                 }
-                send_notification('new_assignment', notification_data)
+                queue_notification(app.db, 'new_assignment', notification_data, dedupe_key=f"new_assignment:{assignment_id}")
                 
                 return redirect(url_for('dashboard'))
             else:
@@ -227,7 +253,7 @@ def register_routes(app):
 
         assignment = Assignment(assignment_doc)
 
-        submission_doc = app.db.submissions.find_one({'assignment_id': assignment_id, 'student_id': current_user.get_id()})
+        submission_doc = app.db.submissions.find_one({'assignment_id': assignment_doc['_id'], 'student_id': ObjectId(current_user.get_id())})
         submission = Submission(submission_doc) if submission_doc else None
 
         return render_template('assignment_detail.html', title=assignment.title, assignment=assignment, submission=submission, user_type=current_user.user_type)
@@ -241,7 +267,7 @@ def register_routes(app):
             
         assignment_doc = app.db.assignments.find_one({'_id': ObjectId(assignment_id)})
         
-        if not assignment_doc or not assignment_doc.get('file_path'):
+        if not assignment_doc or not (assignment_doc.get('file_sha256') or assignment_doc.get('file_path')):
             flash('File not found.', 'warning')
             return redirect(url_for('dashboard'))
         
@@ -251,10 +277,11 @@ def register_routes(app):
             flash('You do not have permission to download this file.', 'danger')
             return redirect(url_for('dashboard'))
 
-        directory = os.path.dirname(assignment.file_path)
-        filename = os.path.basename(assignment.file_path)
-
-        return send_from_directory(directory, filename, as_attachment=True)
+        try:
+            return send_stored_file(get_storage(app.db), assignment.file_sha256, assignment.file_path, assignment.filename)
+        except FileNotFoundError:
+            flash('File not found.', 'warning')
+            return redirect(url_for('dashboard'))
     
     @app.route('/download/reference/<assignment_id>')
     @login_required
@@ -269,7 +296,7 @@ def register_routes(app):
             
         assignment_doc = app.db.assignments.find_one({'_id': ObjectId(assignment_id)})
         
-        if not assignment_doc or not assignment_doc.get('reference_file_path'):
+        if not assignment_doc or not (assignment_doc.get('reference_sha256') or assignment_doc.get('reference_file_path')):
             flash('Reference file not found.', 'warning')
             return redirect(url_for('dashboard'))
         
@@ -279,10 +306,12 @@ def register_routes(app):
             flash('You do not have permission to download this file.', 'danger')
             return redirect(url_for('dashboard'))
 
-        directory = os.path.dirname(assignment.reference_file_path)
-        filename = os.path.basename(assignment.reference_file_path)
-
-        return send_from_directory(directory, filename, as_attachment=True)
+        download_name = assignment.reference_filename or os.path.basename(assignment.reference_file_path or 'reference.pdf')
+        try:
+            return send_stored_file(get_storage(app.db), assignment.reference_sha256, assignment.reference_file_path, download_name)
+        except FileNotFoundError:
+            flash('Reference file not found.', 'warning')
+            return redirect(url_for('dashboard'))
 
     @app.route('/submissions/<assignment_id>')
     @login_required
@@ -295,107 +324,144 @@ def register_routes(app):
             flash('Database connection error.', 'danger')
             return redirect(url_for('dashboard'))
 
-        assignment = app.db.assignments.find_one({'_id': ObjectId(assignment_id)})
+        assignment = app.db.assignments.find_one({'_id': ObjectId(assignment_id)}, {'title': 1, 'class_name': 1})
         if not assignment or assignment.get('class_name') != current_user.class_name:
             flash('Assignment not found or you do not have access.', 'danger')
             return redirect(url_for('dashboard'))
         
-        submissions_docs = list(app.db.submissions.find({'assignment_id': assignment_id}))
-        submissions = [Submission(doc) for doc in submissions_docs]
+        sort = request.args.get('sort', DEFAULT_SUBMISSION_SORT)
+        page = request.args.get('page', 1, type=int)
+        listing = submissions_page(app.db, assignment_id, sort=sort, page=page)
+
+        submissions = []
+        for doc in listing['submissions']:
+            submission = Submission(doc)
+            submission.student_username = doc['student_username']
+            submissions.append(submission)
 
-        for submission in submissions:
-            student_doc = app.db.users.find_one({'_id': ObjectId(submission.student_id)})
-            submission.student_username = student_doc['username'] if student_doc else 'Unknown'
+        grading_jobs = active_jobs_for_assignment(app.db, 'grade_submission', assignment_id)
+        active_batch = active_batch_for_assignment(app.db, assignment_id)
 
-        return render_template('submissions_list.html', title='Submissions', submissions=submissions, assignment_title=assignment['title'])
+        groups = duplicate_groups(app.db, assignment_id)
+        group_usernames = usernames_by_id(app.db, [member['student_id'] for group in groups for member in group['submissions']])
+        for group in groups:
+            for member in group['submissions']:
+                member['student_username'] = group_usernames.get(member['student_id'], 'Unknown')
+
+        return render_template('submissions_list.html', title='Submissions', submissions=submissions, listing=listing, submission_sorts=SUBMISSION_SORTS, assignment_id=assignment_id, assignment_title=assignment['title'], grading_jobs=grading_jobs, active_batch=active_batch, duplicate_groups=groups, rendered_at=datetime.now().isoformat())
+
+    @app.route('/submissions/<assignment_id>/events')
+    @login_required
+    def submission_events(assignment_id):
+        if current_user.user_type != 'teacher':
+            return jsonify({'error': 'Unauthorized access.'}), 403
+
+        assignment = app.db.assignments.find_one({'_id': ObjectId(assignment_id)}, {'class_name': 1}) if ObjectId.is_valid(assignment_id) else None
+        if not assignment or assignment.get('class_name') != current_user.class_name:
+            return jsonify({'error': 'Assignment not found.'}), 404
+
+        # The page passes the time it was rendered; reconnecting browsers send the last event id instead.
+        since = parse_event_id(request.headers.get('Last-Event-ID') or request.args.get('since'))
+        response = Response(assignment_status_stream(app.db, assignment_id, since), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
 
     @app.route('/grade_submission/<submission_id>', methods=['POST'])
     @login_required
     def grade_submission(submission_id):
         if current_user.user_type != 'teacher':
+            if wants_json():
+                return jsonify({'error': 'Unauthorized access.'}), 403
             flash('Unauthorized access.', 'danger')
             return redirect(url_for('dashboard'))
-            
+
         submission_doc = app.db.submissions.find_one({'_id': ObjectId(submission_id)})
         if not submission_doc:
+            if wants_json():
+                return jsonify({'error': 'Submission not found.'}), 404
             flash('Submission not found.', 'warning')
             return redirect(url_for('dashboard'))
 
-        assignment_doc = app.db.assignments.find_one({'_id': ObjectId(submission_doc['assignment_id'])})
-        if not assignment_doc:
-            flash('Assignment not found for this submission.', 'warning')
+        assignment_doc = app.db.assignments.find_one({'_id': ObjectId(submission_doc['assignment_id'])}, {'reference_status': 1})
+        if assignment_doc and reference_status(assignment_doc) == REFERENCE_FAILED:
+            message = 'The answer key for this assignment could not be processed, so it cannot be graded.'
+            if wants_json():
+                return jsonify({'error': message}), 409
+            flash(message, 'danger')
+            return redirect(url_for('view_submissions', assignment_id=str(submission_doc['assignment_id'])))
+
+        job_id = enqueue_job(app.db, 'grade_submission', {
+            'submission_id': submission_id,
+            'assignment_id': str(submission_doc['assignment_id']),
+            'force': request.form.get('force') == '1'
+        }, dedupe_field='submission_id')
+
+        if wants_json():
+            return jsonify({'job_id': job_id, 'status_url': url_for('grading_job_status', job_id=job_id)}), 202
+
+        flash('Submission queued for AI grading. Results will appear here shortly.', 'info')
+        return redirect(url_for('view_submissions', assignment_id=str(submission_doc['assignment_id'])))
+
+    @app.route('/grading_jobs/<job_id>')
+    @login_required
+    def grading_job_status(job_id):
+        if current_user.user_type != 'teacher':
+            return jsonify({'error': 'Unauthorized access.'}), 403
+
+        job = get_job(app.db, job_id) if ObjectId.is_valid(job_id) else None
+        if not job:
+            return jsonify({'error': 'Job not found.'}), 404
+
+        return jsonify(serialize_job(job))
+
+    @app.route('/grade_all/<assignment_id>', methods=['POST'])
+    @login_required
+    def grade_all_pending(assignment_id):
+        if current_user.user_type != 'teacher':
+            if wants_json():
+                return jsonify({'error': 'Unauthorized access.'}), 403
+            flash('Unauthorized access.', 'danger')
             return redirect(url_for('dashboard'))
-        
-        print("--- Starting AI Grading Process ---")
-        try:
-            print(f"Converting student PDF: {submission_doc['file_path']}")
-            student_images = convert_from_path(submission_doc['file_path'])
-            student_text = ""
-            for img in student_images:
-                student_text += pytesseract.image_to_string(img)
-            print("Student submission text extracted.")
-            
-            print("--- Calling Gemini API for evaluation ---")
-            
-            # Prepare the prompt for Gemini
-            prompt = f"""
-            You are an AI grading assistant. Your task is to evaluate a student's answer against a reference answer.
-            
-            Reference Answer (summarized):
-            {assignment_doc['reference_text']}
-            
-            Student's Answer (extracted from handwritten text):
-            {student_text}
-            
-            Based on the provided texts, give a score from 0 to 100 for the student's work and provide constructive feedback of 1-2 sentences.
 
-            Return the output in a JSON format with the following keys:
-            "score": "The score as a number from 0 to 100",
-            "remarks": "The constructive feedback"
-            """
-            
-            gemini_response = call_gemini_api_for_evaluation(
-                prompt_text=prompt,
-                text_content=student_text  # Now passing the extracted text
-            )
-            
-            if gemini_response:
-                print("--- AI Response Received Successfully ---")
-                score = gemini_response.get('score', 'N/A')
-                remarks = gemini_response.get('remarks', 'No remarks provided.')
-                
-                app.db.submissions.update_one(
-                    {'_id': ObjectId(submission_id)},
-                    {'$set': {
-                        'ai_score': score,
-                        'ai_remarks': remarks,
-                        'ai_graded_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    }}
-                )
-                flash('AI evaluation completed successfully!', 'success')
-                print("--- Database updated with AI evaluation ---")
-
-                student_doc = app.db.users.find_one({'_id': ObjectId(submission_doc['student_id'])})
-                if student_doc:
-                    notification_data = {
-                        'email': student_doc['email'],
-                        'username': student_doc['username'],
-                        'assignment_title': assignment_doc['title'],
-                        'score': score,
-                        'remarks': remarks
-                    }
-                    print("--- Sending notification via n8n ---")
-                    send_notification('evaluation_complete', notification_data)
-                    print("--- Notification sent ---")
+        assignment = app.db.assignments.find_one({'_id': ObjectId(assignment_id)})
+        if not assignment or assignment.get('class_name') != current_user.class_name:
+            if wants_json():
+                return jsonify({'error': 'Assignment not found.'}), 404
+            flash('Assignment not found or you do not have access.', 'danger')
+            return redirect(url_for('dashboard'))
 
-            else:
-                flash('Failed to get a valid response from the AI.', 'danger')
-                print("--- Failed to get a valid AI response ---")
-        except Exception as e:
-            flash(f'An error occurred during AI grading: {e}', 'danger')
-            print(f"--- An unexpected error occurred: {e} ---")
-        
-        return redirect(url_for('view_submissions', assignment_id=submission_doc['assignment_id']))
+        if reference_status(assignment) == REFERENCE_FAILED:
+            message = 'The answer key for this assignment could not be processed, so it cannot be graded.'
+            if wants_json():
+                return jsonify({'error': message}), 409
+            flash(message, 'danger')
+            return redirect(url_for('view_submissions', assignment_id=assignment_id))
+
+        batch = active_batch_for_assignment(app.db, assignment_id)
+        if batch:
+            batch_id = str(batch['_id'])
+        else:
+            batch_id = create_batch(app.db, assignment_id, current_user.get_id())
+            enqueue_job(app.db, 'grade_batch', {'batch_id': batch_id, 'assignment_id': assignment_id})
+
+        if wants_json():
+            return jsonify({'batch_id': batch_id, 'status_url': url_for('grading_batch_status', batch_id=batch_id)}), 202
+
+        flash('All pending submissions have been queued for AI grading.', 'info')
+        return redirect(url_for('view_submissions', assignment_id=assignment_id))
+
+    @app.route('/grading_batches/<batch_id>')
+    @login_required
+    def grading_batch_status(batch_id):
+        if current_user.user_type != 'teacher':
+            return jsonify({'error': 'Unauthorized access.'}), 403
+
+        batch = get_batch(app.db, batch_id) if ObjectId.is_valid(batch_id) else None
+        if not batch:
+            return jsonify({'error': 'Batch not found.'}), 404
+
+        return jsonify(serialize_batch(batch))
 
     @app.route('/download/submission/<submission_id>')
     @login_required
@@ -410,7 +476,7 @@ def register_routes(app):
 
         submission_doc = app.db.submissions.find_one({'_id': ObjectId(submission_id)})
         
-        if not submission_doc or not submission_doc.get('file_path'):
+        if not submission_doc or not (submission_doc.get('sha256') or submission_doc.get('file_path')):
             flash('Submission file not found.', 'warning')
             return redirect(url_for('dashboard'))
 
@@ -420,10 +486,11 @@ def register_routes(app):
             flash('You do not have permission to download this submission.', 'danger')
             return redirect(url_for('dashboard'))
 
-        directory = os.path.dirname(submission.file_path)
-        filename = os.path.basename(submission.file_path)
-        
-        return send_from_directory(directory, filename, as_attachment=True)
+        try:
+            return send_stored_file(get_storage(app.db), submission.sha256, submission.file_path, submission.filename)
+        except FileNotFoundError:
+            flash('Submission file not found.', 'warning')
+            return redirect(url_for('dashboard'))
 
     @app.route('/upload_submission/<assignment_id>', methods=['POST'])
     @login_required
@@ -435,7 +502,8 @@ def register_routes(app):
         if app.db is None:
             flash('Database connection error.', 'danger')
             return redirect(url_for('dashboard'))
-        
+
+        request.max_content_length = upload_limit('SUBMISSION_MAX_MB', DEFAULT_SUBMISSION_MAX_MB)
         if 'file' not in request.files:
             flash('No file part in the request.', 'warning')
             return redirect(url_for('assignment_detail', assignment_id=assignment_id))
@@ -450,30 +518,37 @@ def register_routes(app):
             student_id = current_user.get_id()
             filename = secure_filename(file.filename)
             
-            existing_submission = app.db.submissions.find_one({'assignment_id': assignment_id, 'student_id': student_id})
-            
-            submission_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'submissions', assignment_id)
-            os.makedirs(submission_dir, exist_ok=True)
-            file_path = os.path.join(submission_dir, f"{student_id}_{filename}")
-
-            if existing_submission:
-                app.db.submissions.update_one(
-                    {'assignment_id': assignment_id, 'student_id': student_id},
-                    {'$set': {'filename': filename, 'file_path': file_path, 'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')}}
-                )
+            submission_key = {'assignment_id': ObjectId(assignment_id), 'student_id': ObjectId(student_id)}
+
+            # The file is stored before the record points at it.
+            storage = get_storage(app.db)
+            saved = save_upload(file, storage, app.db)
+            file_fields = {'filename': filename, 'sha256': saved['sha256'], 'size': saved['size'], 'upload_date': datetime.now()}
+
+            # One atomic upsert on the unique (assignment_id, student_id) key, so
+            # two uploads from the same student at once cannot both try to insert.
+            previous = app.db.submissions.find_one_and_update(
+                submission_key,
+                {'$set': file_fields, '$unset': {'file_path': ''}, '$setOnInsert': {'class_name': current_user.class_name}},
+                projection={'sha256': 1, 'file_path': 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+            if previous:
+                if previous.get('sha256') != saved['sha256']:
+                    release_file(app.db, previous.get('sha256'))
+                if previous.get('file_path'):
+                    delete_legacy_file(previous['file_path'])
+                submission_id = previous['_id']
                 flash('Your submission has been updated successfully!', 'success')
             else:
-                app.db.submissions.insert_one({
-                    'assignment_id': assignment_id,
-                    'student_id': student_id,
-                    'class_name': current_user.class_name,
-                    'filename': filename,
-                    'file_path': file_path,
-                    'upload_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                })
+                submission_id = app.db.submissions.find_one(submission_key, {'_id': 1})['_id']
                 flash('Your assignment has been submitted successfully!', 'success')
 
-            file.save(file_path)
+            if app.config['DUPLICATE_INDEX_ON_UPLOAD']:
+                # Extracting the text also warms the OCR cache for grading.
+                enqueue_job(app.db, 'index_submission', {'submission_id': str(submission_id), 'assignment_id': assignment_id})
+
             return redirect(url_for('assignment_detail', assignment_id=assignment_id))
         else:
             flash('Invalid file type. Please upload a PDF file.', 'warning')
@@ -482,6 +557,7 @@ def register_routes(app):
     @app.route('/logout')
     @login_required
     def logout():
+        invalidate_user(current_user.get_id())
         logout_user()
         flash('You have been logged out.', 'info')
         return redirect(url_for('home'))
@@ -0,0 +1,211 @@
+import hashlib
+import logging
+import os
+import re
+import struct
+from datetime import datetime
+from functools import lru_cache
+from bson.objectid import ObjectId
+from pymongo import ASCENDING
+from evaluation_cache import normalize_student_text
+
+logger = logging.getLogger(__name__)
+
+SHINGLE_WORDS = 5
+NUM_PERMUTATIONS = 128
+# 16 bands of 8 rows: pairs above about 70% similarity almost always share a
+# bucket, pairs below about 50% almost never do.
+LSH_BANDS = 16
+LSH_ROWS = NUM_PERMUTATIONS // LSH_BANDS
+DEFAULT_NEAR_DUPLICATE_THRESHOLD = 0.7
+# Smallest prime above 2^32; with 32-bit shingle hashes and coefficients,
+# a * x + b stays within 64 bits.
+HASH_PRIME = 4294967311
+SIGNATURE_SEED = 1
+
+
+def near_duplicate_threshold():
+    return float(os.environ.get('NEAR_DUPLICATE_THRESHOLD', DEFAULT_NEAR_DUPLICATE_THRESHOLD))
+
+
+def ensure_similarity_indexes(db):
+    db.lsh_buckets.create_index([('assignment_id', ASCENDING), ('band', ASCENDING), ('key', ASCENDING)], unique=True)
+    db.lsh_buckets.create_index([('assignment_id', ASCENDING), ('submission_ids', ASCENDING)])
+
+
+def text_fingerprint(text):
+    return hashlib.sha256(normalize_student_text(text).encode('utf-8')).hexdigest()
+
+
+def shingles(text):
+    """
+    Returns the set of overlapping SHINGLE_WORDS-word sequences of a text, ignoring case and punctuation.
+    """
+    words = re.findall(r'\w+', text.lower())
+    if len(words) < SHINGLE_WORDS:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+
+@lru_cache(maxsize=1)
+def _permutations():
+    import numpy as np
+    rng = np.random.default_rng(SIGNATURE_SEED)
+    return (rng.integers(1, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64),
+            rng.integers(0, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64))
+
+
+def minhash_signature(text):
+    """
+    Returns the MinHash signature of a text's shingles as a list of
+    NUM_PERMUTATIONS ints, or None for a text without words. The share of
+    positions where two signatures agree estimates the Jaccard similarity of the texts.
+    """
+    import numpy as np
+    text_shingles = shingles(text)
+    if not text_shingles:
+        return None
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=4).digest(), 'little') for shingle in text_shingles),
+        dtype=np.uint64, count=len(text_shingles)
+    )
+    a, b = _permutations()
+    return ((hashes[:, None] * a[None, :] + b) % HASH_PRIME).min(axis=0).tolist()
+
+
+def estimated_similarity(signature, other):
+    return sum(x == y for x, y in zip(signature, other)) / NUM_PERMUTATIONS
+
+
+def band_keys(signature):
+    """
+    Hashes each band of LSH_ROWS signature values; texts sharing any band key are candidates.
+    """
+    return [
+        hashlib.blake2b(struct.pack(f'<{LSH_ROWS}Q', *signature[band * LSH_ROWS:(band + 1) * LSH_ROWS]), digest_size=8).hexdigest()
+        for band in range(LSH_BANDS)
+    ]
+
+
+def _remove_from_index(db, assignment_id, submission_id):
+    db.lsh_buckets.update_many(
+        {'assignment_id': assignment_id, 'submission_ids': submission_id},
+        {'$pull': {'submission_ids': submission_id}}
+    )
+    db.submissions.update_many(
+        {'assignment_id': assignment_id, 'near_duplicates.submission_id': submission_id},
+        {'$pull': {'near_duplicates': {'submission_id': submission_id}}}
+    )
+
+
+def index_submission(db, submission_doc, text):
+    """
+    Adds a submission's text to its assignment's LSH index and records its
+    near-duplicates, on both sides of each pair. Only submissions sharing a
+    bucket are compared, so the work does not grow with the size of the class.
+    Returns the near-duplicates found.
+    """
+    submission_id = submission_doc['_id']
+    assignment_id = ObjectId(submission_doc['assignment_id'])
+    fingerprint = text_fingerprint(text)
+    if submission_doc.get('text_sha256') == fingerprint and 'minhash' in submission_doc:
+        return submission_doc.get('near_duplicates', [])
+
+    # Drop whatever an earlier upload of this submission left in the index.
+    _remove_from_index(db, assignment_id, submission_id)
+    signature = minhash_signature(text)
+    if signature is None:
+        db.submissions.update_one({'_id': submission_id}, {
+            '$set': {'text_sha256': fingerprint, 'minhash': None, 'near_duplicates': [], 'indexed_at': datetime.now()}
+        })
+        return []
+
+    # Join the buckets before reading them, so of two submissions indexed at
+    # the same moment at least the later one sees the other.
+    for band, key in enumerate(band_keys(signature)):
+        db.lsh_buckets.update_one({'assignment_id': assignment_id, 'band': band, 'key': key},
+                                  {'$addToSet': {'submission_ids': submission_id}}, upsert=True)
+    candidates = set()
+    for bucket in db.lsh_buckets.find({'assignment_id': assignment_id, 'submission_ids': submission_id}, {'submission_ids': 1}):
+        candidates.update(bucket['submission_ids'])
+    candidates.discard(submission_id)
+
+    threshold = near_duplicate_threshold()
+    matches = []
+    for other in db.submissions.find({'_id': {'$in': list(candidates)}, 'minhash': {'$ne': None}}, {'minhash': 1, 'text_sha256': 1}):
+        similarity = 1.0 if other.get('text_sha256') == fingerprint else estimated_similarity(signature, other['minhash'])
+        if similarity >= threshold:
+            matches.append({'submission_id': other['_id'], 'similarity': round(similarity, 3)})
+
+    db.submissions.update_one({'_id': submission_id}, {
+        '$set': {'text_sha256': fingerprint, 'minhash': signature, 'near_duplicates': matches, 'indexed_at': datetime.now()}
+    })
+    for match in matches:
+        db.submissions.update_one(
+            {'_id': match['submission_id']},
+            {'$push': {'near_duplicates': {'submission_id': submission_id, 'similarity': match['similarity']}}}
+        )
+    if matches:
+        logger.info("Submission %s has %d near-duplicates", submission_id, len(matches))
+    return matches
+
+
+def index_submission_file(db, submission_id):
+    """
+    Extracts a submission's text (through the OCR cache, so grading can reuse
+    it) and indexes it. Run by the worker after each upload.
+    """
+    from grading import GradingError
+    from ocr_cache import cached_extract_pdf
+    from prompt_builder import clean_ocr_text
+    from storage import get_storage, resolve_file
+
+    submission_doc = db.submissions.find_one({'_id': ObjectId(submission_id)})
+    if not submission_doc:
+        raise GradingError('Submission not found.')
+    try:
+        pdf_path = resolve_file(get_storage(db), submission_doc.get('sha256'), submission_doc.get('file_path'))
+    except FileNotFoundError:
+        raise GradingError('Submission file not found.')
+    extraction = cached_extract_pdf(db, pdf_path, sha256=submission_doc.get('sha256'))
+    matches = index_submission(db, submission_doc, clean_ocr_text(extraction['text']))
+    return {'near_duplicates': len(matches)}
+
+
+def duplicate_groups(db, assignment_id):
+    """
+    Returns the assignment's groups of near-duplicate submissions, largest
+    first, as {'submissions': [{'id', 'student_id'}, ...], 'similarity': highest
+    pair similarity}. Only submissions that have near-duplicates are read.
+    """
+    docs = db.submissions.find(
+        {'assignment_id': ObjectId(assignment_id), 'near_duplicates.submission_id': {'$exists': True}},
+        {'student_id': 1, 'near_duplicates': 1}
+    )
+    parent, students, best = {}, {}, {}
+
+    def find(node):
+        parent.setdefault(node, node)
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    for doc in docs:
+        submission_id = str(doc['_id'])
+        students[submission_id] = str(doc['student_id'])
+        for match in doc['near_duplicates']:
+            parent[find(str(match['submission_id']))] = find(submission_id)
+            best[submission_id] = max(best.get(submission_id, 0), match['similarity'])
+
+    groups = {}
+    for node in parent:
+        groups.setdefault(find(node), []).append(node)
+    result = [
+        {
+            'submissions': [{'id': member, 'student_id': students.get(member)} for member in sorted(members)],
+            'similarity': max(best.get(member, 0) for member in members)
+        }
+        for members in groups.values() if len(members) > 1
+    ]
+    return sorted(result, key=lambda group: (-len(group['submissions']), -group['similarity']))
@@ -0,0 +1,79 @@
+import importlib
+import logging
+import resource
+import sys
+import time
+from contextlib import contextmanager
+
+# Taken when this module is first imported; entry points import it before anything else
+# so the 'imports' phase covers loading the rest of the application.
+PROCESS_STARTED = time.perf_counter()
+
+# Modules only the grading paths need. Web workers should not load them;
+# grading workers import them up front so the first job does not pay for it.
+GRADING_MODULES = ('pdf2image', 'pytesseract', 'PIL.Image', 'numpy', 'httpx')
+
+logger = logging.getLogger(__name__)
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class StartupTimer:
+    """
+    Records how long each phase of booting a process takes.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = {'imports': time.perf_counter() - PROCESS_STARTED}
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.perf_counter() - start
+
+    def report(self):
+        return {
+            'process': self.name,
+            'total_ms': round((time.perf_counter() - PROCESS_STARTED) * 1000, 1),
+            'phases_ms': {name: round(seconds * 1000, 1) for name, seconds in self.phases.items()},
+            'grading_modules_loaded': [name for name in GRADING_MODULES if name in sys.modules],
+            'peak_rss_mb': round(peak_rss_mb(), 1)
+        }
+
+    def log_report(self):
+        report = self.report()
+        phases = ', '.join(f"{name} {ms} ms" for name, ms in report['phases_ms'].items())
+        logger.info("%s ready in %s ms (%s); grading modules loaded: %s; peak RSS %s MB",
+                    self.name, report['total_ms'], phases,
+                    ', '.join(report['grading_modules_loaded']) or 'none', report['peak_rss_mb'],
+                    extra={'startup': report})
+        return report
+
+
+def preload_grading_modules(timer=None):
+    """
+    Imports the OCR and image stacks ahead of the first job. Also means pool
+    processes forked later start with them already loaded.
+    """
+    for name in GRADING_MODULES:
+        try:
+            if timer:
+                with timer.phase(f"preload {name}"):
+                    importlib.import_module(name)
+            else:
+                importlib.import_module(name)
+        except ImportError as e:
+            logger.warning("Could not preload %s: %s", name, e)
+
+
+if __name__ == '__main__':
+    import json
+    from app import app
+    print(json.dumps(app.config['STARTUP_REPORT'], indent=2))
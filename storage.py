@@ -0,0 +1,224 @@
+import logging
+import os
+import tempfile
+import time
+from datetime import datetime, timedelta
+import gridfs
+from gridfs.errors import FileExists, NoFile
+from pymongo import ASCENDING
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+STORAGE_LOCAL = 'local'
+STORAGE_GRIDFS = 'gridfs'
+DEFAULT_STORAGE_ROOT = 'uploads'
+GRIDFS_BUCKET = 'uploads'
+# Content nothing refers to is deleted by the sweep this long after it was last
+# stored or released, which leaves any upload in flight time to write its record.
+DEFAULT_GC_GRACE_SECONDS = 3600
+# A sweep that died mid-delete stops blocking uploads of that content after this long.
+GC_DELETE_TIMEOUT_SECONDS = 600
+TOUCH_WAIT_SECONDS = 30
+
+
+class LocalStorage:
+    """
+    Content-addressed files on local disk, stored as `<root>/objects/<sha[:2]>/<sha>`.
+    Identical uploads share one file.
+    """
+
+    def __init__(self, root):
+        self.root = root
+
+    def _object_path(self, sha256):
+        return os.path.join(self.root, 'objects', sha256[:2], sha256)
+
+    def put(self, temp_path, sha256):
+        """
+        Moves a fully written temp file into the store. If the content is already
+        stored, the temp file is dropped instead.
+        """
+        dest_path = self._object_path(sha256)
+        if os.path.exists(dest_path):
+            os.remove(temp_path)
+            return
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        os.replace(temp_path, dest_path)
+
+    def exists(self, sha256):
+        return os.path.exists(self._object_path(sha256))
+
+    def local_path(self, sha256):
+        path = self._object_path(sha256)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Stored file {sha256} not found.")
+        return path
+
+    def delete(self, sha256):
+        try:
+            os.remove(self._object_path(sha256))
+        except FileNotFoundError:
+            pass
+
+
+class GridFSStorage:
+    """
+    Files in a GridFS bucket keyed by their sha256, so every app node and worker
+    shares them. Each node keeps a local copy for OCR and for serving downloads.
+    """
+
+    def __init__(self, db, cache_root):
+        self.db = db
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=GRIDFS_BUCKET)
+        self.cache = LocalStorage(cache_root)
+
+    def put(self, temp_path, sha256):
+        if not self.exists(sha256):
+            try:
+                with open(temp_path, 'rb') as f:
+                    self.bucket.upload_from_stream_with_id(sha256, sha256, f)
+            except FileExists:
+                pass  # Another node stored the same content first.
+        self.cache.put(temp_path, sha256)
+
+    def exists(self, sha256):
+        return self.db[f"{GRIDFS_BUCKET}.files"].count_documents({'_id': sha256}, limit=1) > 0
+
+    def local_path(self, sha256):
+        if self.cache.exists(sha256):
+            return self.cache.local_path(sha256)
+
+        cache_dir = os.path.dirname(self.cache._object_path(sha256))
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=cache_dir, suffix='.part')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                self.bucket.download_to_stream(sha256, f)
+        except NoFile:
+            os.remove(temp_path)
+            raise FileNotFoundError(f"Stored file {sha256} not found.")
+        self.cache.put(temp_path, sha256)
+        return self.cache.local_path(sha256)
+
+    def delete(self, sha256):
+        try:
+            self.bucket.delete(sha256)
+        except NoFile:
+            pass
+        self.cache.delete(sha256)
+
+
+def get_storage(db):
+    """
+    Returns the backend named by STORAGE_BACKEND ('local' or 'gridfs').
+    Local files, and the GridFS node cache, live under STORAGE_ROOT.
+    """
+    root = os.environ.get('STORAGE_ROOT', DEFAULT_STORAGE_ROOT)
+    if os.environ.get('STORAGE_BACKEND', STORAGE_LOCAL) == STORAGE_GRIDFS:
+        return GridFSStorage(db, os.path.join(root, 'cache'))
+    return LocalStorage(root)
+
+
+def resolve_file(storage, sha256=None, legacy_path=None):
+    """
+    Returns a local path for a stored file. Documents written before the
+    storage backend existed only carry a `file_path`.
+    """
+    if sha256 and storage.exists(sha256):
+        return storage.local_path(sha256)
+    if legacy_path and os.path.exists(legacy_path):
+        return legacy_path
+    raise FileNotFoundError('File not found in storage.')
+
+
+def is_referenced(db, sha256):
+    """
+    True if any submission or assignment still points at the content.
+    """
+    if db.submissions.count_documents({'sha256': sha256}, limit=1):
+        return True
+    return bool(db.assignments.count_documents(
+        {'$or': [{'file_sha256': sha256}, {'reference_sha256': sha256}]}, limit=1
+    ))
+
+
+def ensure_storage_indexes(db):
+    db.storage_gc.create_index([('touched_at', ASCENDING)])
+
+
+def _not_being_deleted(now):
+    return {'$or': [{'deleting_at': None}, {'deleting_at': {'$lt': now - timedelta(seconds=GC_DELETE_TIMEOUT_SECONDS)}}]}
+
+
+def touch_content(db, sha256):
+    """
+    Records that content was just stored or released, so the garbage-collection
+    sweep looks at it again only after the grace period. Called before storing
+    an upload: if a sweep is deleting the same content at that moment, waits for
+    it to finish so the upload stores the file afresh.
+    """
+    deadline = time.monotonic() + TOUCH_WAIT_SECONDS
+    while True:
+        now = datetime.now()
+        try:
+            db.storage_gc.update_one(
+                {'_id': sha256, **_not_being_deleted(now)},
+                {'$set': {'touched_at': now}, '$unset': {'deleting_at': ''}},
+                upsert=True
+            )
+            return
+        except DuplicateKeyError:
+            # The entry exists but a sweep holds it.
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def release_file(db, sha256):
+    """
+    Marks stored content as possibly unused. It is deleted by collect_garbage
+    once the grace period has passed, if nothing refers to it by then.
+    """
+    if sha256:
+        touch_content(db, sha256)
+
+
+def delete_legacy_file(path):
+    """
+    Deletes a file stored by path, from before content-addressed storage, once
+    its record no longer points at it. The sweep only walks stored objects, so
+    nothing else would ever remove it.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def collect_garbage(db, storage, grace_seconds=None):
+    """
+    Deletes content stored or released more than the grace period ago
+    (STORAGE_GC_GRACE_SECONDS) that no submission or assignment refers to.
+    Each entry is claimed before its references are checked, so uploads of
+    the same content wait for the delete instead of racing it. Returns the
+    number of files deleted.
+    """
+    if grace_seconds is None:
+        grace_seconds = int(os.environ.get('STORAGE_GC_GRACE_SECONDS', DEFAULT_GC_GRACE_SECONDS))
+    deleted = 0
+    while True:
+        now = datetime.now()
+        entry = db.storage_gc.find_one_and_update(
+            {'touched_at': {'$lt': now - timedelta(seconds=grace_seconds)}, **_not_being_deleted(now)},
+            {'$set': {'deleting_at': now}}
+        )
+        if entry is None:
+            break
+        if not is_referenced(db, entry['_id']):
+            storage.delete(entry['_id'])
+            deleted += 1
+        db.storage_gc.delete_one({'_id': entry['_id'], 'deleting_at': now})
+    if deleted:
+        logger.info("Deleted %d unreferenced stored files", deleted)
+    return deleted
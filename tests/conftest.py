@@ -0,0 +1,43 @@
+import mongomock
+import pytest
+from werkzeug.security import generate_password_hash
+import user_cache
+from mock_services import MockAIServer
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+@pytest.fixture
+def mock_ai(monkeypatch, tmp_path):
+    """
+    A running MockAIServer with the AI APIs, webhooks and local storage pointed at it.
+    """
+    with MockAIServer() as mock:
+        monkeypatch.setenv('GEMINI_API_URL', f"{mock.url}/gemini")
+        monkeypatch.setenv('DEEPSEEK_API_URL', f"{mock.url}/deepseek")
+        monkeypatch.setenv('GEMINI_API_KEY', 'test')
+        monkeypatch.setenv('DEEPSEEK_API_KEY', 'test')
+        monkeypatch.setenv('NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK', f"{mock.url}/webhook/new_assignment")
+        monkeypatch.setenv('NOTIFICATION_EVALUATION_COMPLETE_WEBHOOK', f"{mock.url}/webhook/evaluation_complete")
+        monkeypatch.setenv('STORAGE_ROOT', str(tmp_path / 'storage'))
+        yield mock
+
+
+@pytest.fixture
+def client(db, monkeypatch, tmp_path):
+    """
+    A test client for the web app on `db`, with one student (student@test / secret).
+    """
+    from app import create_app
+    monkeypatch.setattr(user_cache, '_cache', user_cache.OrderedDict())
+    monkeypatch.setenv('STORAGE_ROOT', str(tmp_path / 'storage'))
+    app = create_app({'TESTING': True, 'DB_BOOTSTRAP_ON_STARTUP': False, 'UPLOAD_FOLDER': str(tmp_path / 'uploads')})
+    app.db = db
+    db.users.insert_one({
+        'username': 'student', 'email': 'student@test', 'user_type': 'student', 'class_name': 'c',
+        'password': generate_password_hash('secret', method='pbkdf2:sha256:1000')
+    })
+    return app.test_client()
@@ -0,0 +1,63 @@
+import asyncio
+import time
+import httpx
+import pytest
+import http_client
+from http_client import async_client, async_post_json
+from gemini_api_async import evaluate_many
+from metrics import HTTP_RETRIES
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(http_client, 'backoff_delay', lambda *args: 0)
+
+
+async def post(url, payload, **kwargs):
+    async with async_client() as client:
+        return await async_post_json(client, url, payload, **kwargs)
+
+
+def test_async_post_json_returns_response(mock_ai):
+    response = asyncio.run(post(f"{mock_ai.url}/webhook/test", {'hello': 'world'}))
+    assert response.json() == {'ok': True}
+    assert mock_ai.requests == [{'path': '/webhook/test', 'body': {'hello': 'world'}}]
+
+
+def test_async_post_json_retries_then_raises(mock_ai):
+    mock_ai.error_rate = 1.0
+    host = mock_ai.url.split('://', 1)[1]
+    retries = HTTP_RETRIES.value(host=host, reason='503')
+
+    with pytest.raises(httpx.HTTPStatusError):
+        asyncio.run(post(f"{mock_ai.url}/webhook/test", {}, max_attempts=3))
+    assert len(mock_ai.requests) == 3
+    assert HTTP_RETRIES.value(host=host, reason='503') == retries + 2
+
+
+def test_async_post_json_raises_transport_errors(mock_ai):
+    url = f"{mock_ai.url}/webhook/test"
+    mock_ai.stop()
+    with pytest.raises(httpx.TransportError):
+        asyncio.run(post(url, {}, max_attempts=2))
+
+
+def test_evaluate_many_sends_every_request(mock_ai):
+    requests = [(f"Prompt {i}", f"Answer {i}") for i in range(5)]
+    evaluations = asyncio.run(evaluate_many(requests, concurrency=2))
+
+    assert evaluations == [{'score': mock_ai.score, 'remarks': mock_ai.remarks}] * 5
+    sent = sorted([part['text'] for part in request['body']['contents'][0]['parts']] for request in mock_ai.requests)
+    assert sent == [list(request) for request in requests]
+
+
+def test_evaluate_many_limits_concurrency(mock_ai):
+    mock_ai.latency = 0.2
+    start = time.perf_counter()
+    asyncio.run(evaluate_many([('Prompt', f"Answer {i}") for i in range(4)], concurrency=2))
+    assert time.perf_counter() - start >= 0.4
+
+
+def test_evaluate_many_returns_none_for_failures(mock_ai):
+    mock_ai.error_rate = 1.0
+    assert asyncio.run(evaluate_many([('Prompt', 'Answer')] * 2)) == [None, None]
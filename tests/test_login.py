@@ -0,0 +1,19 @@
+from models import User
+
+
+def test_user_is_slotted():
+    user = User({'_id': 'abc', 'username': 'student', 'password': 'hash'})
+    assert not hasattr(user, '__dict__')
+    assert user.is_authenticated and user.is_active and not user.is_anonymous
+    assert user.get_id() == 'abc'
+
+
+def test_login_keeps_session_user(client):
+    response = client.post('/login', data={'email': 'student@test', 'password': 'secret'})
+    assert response.status_code == 302 and response.headers['Location'].endswith('/dashboard')
+    assert client.get('/dashboard').status_code == 200
+
+
+def test_login_required_redirects_anonymous(client):
+    response = client.get('/dashboard')
+    assert response.status_code == 302 and '/login' in response.headers['Location']
@@ -0,0 +1,28 @@
+import pytest
+from metrics import scrape_allowed
+
+
+@pytest.fixture(autouse=True)
+def no_metrics_settings(monkeypatch):
+    monkeypatch.delenv('METRICS_TOKEN', raising=False)
+    monkeypatch.delenv('METRICS_ALLOW_LOOPBACK', raising=False)
+
+
+def test_token_is_required_by_default():
+    assert not scrape_allowed(None, '127.0.0.1')
+    assert not scrape_allowed(None, '203.0.113.7')
+
+
+def test_bearer_token(monkeypatch):
+    monkeypatch.setenv('METRICS_TOKEN', 'secret')
+    assert scrape_allowed('Bearer secret', '203.0.113.7')
+    assert not scrape_allowed('Bearer wrong', '127.0.0.1')
+    assert not scrape_allowed(None, '127.0.0.1')
+
+
+def test_loopback_only_when_allowed(monkeypatch):
+    monkeypatch.setenv('METRICS_ALLOW_LOOPBACK', 'true')
+    assert scrape_allowed(None, '127.0.0.1')
+    assert scrape_allowed(None, '::1')
+    assert not scrape_allowed(None, '203.0.113.7')
+    assert not scrape_allowed(None, None)
@@ -0,0 +1,103 @@
+from datetime import datetime, timezone
+import pytest
+import notification_outbox
+from notification_outbox import (
+    queue_notification, dispatch_once, outbox_settings,
+    OUTBOX_PENDING, OUTBOX_SENT, OUTBOX_FAILED
+)
+
+
+@pytest.fixture
+def outbox(db, mock_ai, monkeypatch):
+    monkeypatch.setenv('NOTIFICATION_COALESCE_SECONDS', '0')
+    notification_outbox.ensure_outbox_indexes(db)
+    return db
+
+
+def make_due(db):
+    db.notification_outbox.update_many({'status': OUTBOX_PENDING}, {'$set': {'run_after': datetime.now(timezone.utc)}})
+
+
+def test_evaluation_complete_events_are_coalesced(outbox, mock_ai):
+    for i in range(3):
+        queue_notification(outbox, 'evaluation_complete', {'submission_id': f"s{i}"})
+    queue_notification(outbox, 'new_assignment', {'assignment_id': 'a1'})
+
+    assert dispatch_once(outbox) == 4
+    requests = {request['path']: request['body'] for request in mock_ai.webhook_requests}
+    assert requests['/webhook/new_assignment'] == {'assignment_id': 'a1'}
+    assert requests['/webhook/evaluation_complete'] == {
+        'event': 'evaluation_complete', 'count': 3,
+        'notifications': [{'submission_id': f"s{i}"} for i in range(3)]
+    }
+    assert outbox.notification_outbox.count_documents({'status': OUTBOX_SENT}) == 4
+    assert dispatch_once(outbox) == 0
+
+
+def test_batches_are_capped_at_batch_size(outbox, mock_ai, monkeypatch):
+    monkeypatch.setenv('NOTIFICATION_BATCH_SIZE', '2')
+    for i in range(5):
+        queue_notification(outbox, 'evaluation_complete', {'submission_id': f"s{i}"})
+
+    assert dispatch_once(outbox) == 5
+    assert [request['body']['count'] for request in mock_ai.webhook_requests] == [2, 2, 1]
+
+
+def test_newer_event_replaces_pending_one_with_same_key(outbox, mock_ai):
+    queue_notification(outbox, 'evaluation_complete', {'submission_id': 's1', 'score': 50}, dedupe_key='s1')
+    queue_notification(outbox, 'evaluation_complete', {'submission_id': 's1', 'score': 90}, dedupe_key='s1')
+
+    assert dispatch_once(outbox) == 1
+    assert mock_ai.webhook_requests[0]['body']['notifications'] == [{'submission_id': 's1', 'score': 90}]
+
+
+def test_coalescing_waits_for_the_window(outbox, mock_ai, monkeypatch):
+    monkeypatch.setenv('NOTIFICATION_COALESCE_SECONDS', '60')
+    queue_notification(outbox, 'evaluation_complete', {'submission_id': 's1'})
+    assert dispatch_once(outbox) == 0
+
+    make_due(outbox)
+    assert dispatch_once(outbox) == 1
+
+
+def test_failed_delivery_is_retried(outbox, mock_ai):
+    queue_notification(outbox, 'evaluation_complete', {'submission_id': 's1'})
+    mock_ai.error_rate = 1.0
+
+    assert dispatch_once(outbox) == 0
+    notification = outbox.notification_outbox.find_one()
+    assert notification['status'] == OUTBOX_PENDING
+    assert notification['attempts'] == 1
+    # Read back as naive UTC, like pymongo without tz_aware.
+    assert notification['run_after'] > datetime.now(timezone.utc).replace(tzinfo=None)
+    assert dispatch_once(outbox) == 0  # backing off
+
+    mock_ai.error_rate = 0.0
+    make_due(outbox)
+    assert dispatch_once(outbox) == 1
+    notification = outbox.notification_outbox.find_one()
+    assert notification['status'] == OUTBOX_SENT
+    assert notification['attempts'] == 2
+    assert len(mock_ai.webhook_requests) == 2
+
+
+def test_delivery_gives_up_after_max_attempts(outbox, mock_ai, monkeypatch):
+    monkeypatch.setenv('NOTIFICATION_MAX_ATTEMPTS', '2')
+    queue_notification(outbox, 'new_assignment', {'assignment_id': 'a1'})
+    mock_ai.error_rate = 1.0
+
+    dispatch_once(outbox)
+    make_due(outbox)
+    dispatch_once(outbox)
+    notification = outbox.notification_outbox.find_one()
+    assert notification['status'] == OUTBOX_FAILED
+    assert notification['attempts'] == outbox_settings()['max_attempts']
+
+
+def test_unconfigured_webhook_fails_without_retry(outbox, mock_ai, monkeypatch):
+    monkeypatch.delenv('NOTIFICATION_NEW_ASSIGNMENT_WEBHOOK')
+    queue_notification(outbox, 'new_assignment', {'assignment_id': 'a1'})
+
+    assert dispatch_once(outbox) == 0
+    assert outbox.notification_outbox.find_one()['status'] == OUTBOX_FAILED
+    assert mock_ai.webhook_requests == []
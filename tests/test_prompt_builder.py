@@ -0,0 +1,75 @@
+from grading import evaluate_text, record_evaluation
+from prompt_builder import (
+    split_sections, plan_sections, aggregate_evaluations, estimate_tokens, CHARS_PER_TOKEN
+)
+
+SETTINGS = {'section_tokens': 10, 'max_sections': 3, 'reference_max_tokens': 100, 'section_concurrency': 2}
+
+
+def paragraphs(count, chars=30):
+    return '\n\n'.join(f"{number}" * chars for number in range(1, count + 1))
+
+
+def test_short_answer_is_one_section():
+    assert plan_sections('A short answer.', SETTINGS) == (['A short answer.'], False)
+
+
+def test_split_prefers_paragraph_breaks_within_the_limit():
+    sections = split_sections(paragraphs(3), SETTINGS['section_tokens'])
+    assert sections == ['1' * 30, '2' * 30, '3' * 30]
+
+
+def test_split_cuts_text_without_breaks():
+    text = 'x' * 100
+    sections = split_sections(text, SETTINGS['section_tokens'])
+    assert all(estimate_tokens(section) <= SETTINGS['section_tokens'] for section in sections)
+    assert ''.join(sections) == text
+    assert len(sections) == -(-len(text) // (SETTINGS['section_tokens'] * CHARS_PER_TOKEN))
+
+
+def test_plan_keeps_sections_up_to_the_limit():
+    sections, truncated = plan_sections(paragraphs(3), SETTINGS)
+    assert len(sections) == 3 and not truncated
+
+
+def test_plan_flags_dropped_sections():
+    sections, truncated = plan_sections(paragraphs(5), SETTINGS)
+    assert sections == ['1' * 30, '2' * 30, '3' * 30]
+    assert truncated
+
+
+def test_aggregate_weights_scores_by_section_length():
+    evaluations = [{'score': 100, 'remarks': 'Good.'}, {'score': '40', 'remarks': 'Weak.'}, {'score': 'N/A'}]
+    result = aggregate_evaluations(evaluations, ['a' * 30, 'b' * 10, 'c' * 50])
+    assert result == {'score': 85, 'remarks': 'Part 1: Good. Part 2: Weak.'}
+
+
+def test_aggregate_without_numeric_scores():
+    assert aggregate_evaluations([{'score': 'N/A'}], ['a'])['score'] is None
+
+
+def test_long_answer_is_graded_in_sections(mock_ai, monkeypatch):
+    monkeypatch.setenv('EVALUATION_SECTION_TOKENS', str(SETTINGS['section_tokens']))
+    monkeypatch.setenv('EVALUATION_MAX_SECTIONS', str(SETTINGS['max_sections']))
+
+    evaluation = evaluate_text('Reference.', paragraphs(5))
+
+    assert evaluation['score'] == mock_ai.score
+    assert evaluation['truncated'] is True
+    answers = sorted(request['body']['contents'][0]['parts'][1]['text'] for request in mock_ai.requests)
+    assert answers == ['1' * 30, '2' * 30, '3' * 30]
+
+
+def test_answer_within_limit_is_not_truncated(mock_ai, monkeypatch):
+    monkeypatch.setenv('EVALUATION_SECTION_TOKENS', str(SETTINGS['section_tokens']))
+    monkeypatch.setenv('EVALUATION_MAX_SECTIONS', str(SETTINGS['max_sections']))
+    assert evaluate_text('Reference.', paragraphs(2))['truncated'] is False
+
+
+def test_truncated_grade_is_flagged_on_the_submission(db):
+    assignment = {'_id': db.assignments.insert_one({'title': 'Essay'}).inserted_id, 'title': 'Essay'}
+    submission = {'_id': db.submissions.insert_one({'assignment_id': assignment['_id']}).inserted_id,
+                  'assignment_id': assignment['_id'], 'student_id': None}
+    record_evaluation(db, submission, assignment, 'key',
+                      lambda: {'score': 70, 'remarks': 'Partial.', 'truncated': True}, {})
+    assert db.submissions.find_one({'_id': submission['_id']})['ai_truncated'] is True
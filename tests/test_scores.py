@@ -0,0 +1,54 @@
+import pytest
+from bson.objectid import ObjectId
+from grading import record_evaluation, GradingError
+from prompt_builder import parse_score
+from queries import assignment_submission_stats, submissions_page
+
+
+@pytest.fixture
+def assignment(db):
+    assignment_id = db.assignments.insert_one({'title': 'Essay', 'class_name': 'c'}).inserted_id
+    return db.assignments.find_one({'_id': assignment_id})
+
+
+def add_submission(db, assignment):
+    submission_id = db.submissions.insert_one({'assignment_id': assignment['_id'], 'student_id': ObjectId()}).inserted_id
+    return db.submissions.find_one({'_id': submission_id})
+
+
+def grade(db, assignment, score):
+    submission = add_submission(db, assignment)
+    record_evaluation(db, submission, assignment, f"key-{submission['_id']}",
+                      lambda: {'score': score, 'remarks': 'Fine.'}, {})
+    return db.submissions.find_one({'_id': submission['_id']})
+
+
+@pytest.mark.parametrize('value, expected', [
+    (85, 85), ('85', 85), (' 72.5 ', 72.5), (90.0, 90), ('N/A', None), (None, None), ('nan', None)
+])
+def test_parse_score(value, expected):
+    assert parse_score(value) == expected
+
+
+def test_string_scores_are_stored_as_numbers(db, assignment):
+    assert grade(db, assignment, '90')['ai_score'] == 90
+
+
+def test_non_numeric_score_is_a_grading_error(db, assignment):
+    with pytest.raises(GradingError):
+        grade(db, assignment, 'N/A')
+    assert db.submissions.find_one({'ai_score': {'$exists': True}}) is None
+    assert db.evaluation_cache.count_documents({}) == 0
+
+
+def test_average_and_sort_use_score_values(db, assignment):
+    for score in ('9', 80, '100'):
+        grade(db, assignment, score)
+    add_submission(db, assignment)
+
+    stats = assignment_submission_stats(db, [str(assignment['_id'])], class_size=5)[str(assignment['_id'])]
+    assert stats['average_score'] == 63.0
+    assert stats['graded'] == 3 and stats['ungraded'] == 1
+
+    docs = submissions_page(db, str(assignment['_id']), sort='score')['submissions']
+    assert [doc.get('ai_score') for doc in docs] == [100, 80, 9, None]
@@ -0,0 +1,73 @@
+import random
+import pytest
+from bson.objectid import ObjectId
+from similarity import (
+    minhash_signature, estimated_similarity, index_submission, duplicate_groups, shingles
+)
+
+WORDS = ('light energy water carbon oxygen glucose plant leaf cell root sugar chlorophyll '
+         'reaction membrane stomata sunlight process produce release absorb').split()
+
+
+def essay(seed, words=200):
+    rng = random.Random(seed)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def edited(text, changes=3):
+    words = text.split()
+    for position in range(0, len(words), len(words) // changes)[:changes]:
+        words[position] = 'edited'
+    return ' '.join(words)
+
+
+@pytest.fixture
+def assignment_id(db):
+    return db.assignments.insert_one({'title': 'Photosynthesis'}).inserted_id
+
+
+def submit(db, assignment_id, text):
+    submission_id = db.submissions.insert_one({'assignment_id': assignment_id, 'student_id': ObjectId()}).inserted_id
+    index_submission(db, db.submissions.find_one({'_id': submission_id}), text)
+    return submission_id
+
+
+def test_signature_is_deterministic():
+    assert minhash_signature(essay(1)) == minhash_signature(essay(1))
+    assert minhash_signature('') is None
+
+
+def test_signature_estimates_similarity():
+    text = essay(1)
+    assert estimated_similarity(minhash_signature(text), minhash_signature(edited(text))) > 0.8
+    assert estimated_similarity(minhash_signature(text), minhash_signature(essay(2))) < 0.3
+
+
+def test_shingles_ignore_case_and_punctuation():
+    assert shingles('One, two THREE four five!') == shingles('one two three four five')
+
+
+def test_near_duplicates_are_grouped(db, assignment_id):
+    original = essay(1)
+    first = submit(db, assignment_id, original)
+    copy = submit(db, assignment_id, edited(original))
+    submit(db, assignment_id, essay(2))
+    submit(db, assignment_id, essay(3))
+
+    groups = duplicate_groups(db, assignment_id)
+    assert len(groups) == 1
+    assert {member['id'] for member in groups[0]['submissions']} == {str(first), str(copy)}
+    assert groups[0]['similarity'] > 0.8
+
+    first_doc = db.submissions.find_one({'_id': first})
+    assert [match['submission_id'] for match in first_doc['near_duplicates']] == [copy]
+
+
+def test_reindexing_replaces_old_matches(db, assignment_id):
+    original = essay(1)
+    first = submit(db, assignment_id, original)
+    copy = submit(db, assignment_id, edited(original))
+
+    index_submission(db, db.submissions.find_one({'_id': copy}), essay(4))
+    assert duplicate_groups(db, assignment_id) == []
+    assert db.submissions.find_one({'_id': first})['near_duplicates'] == []
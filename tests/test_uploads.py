@@ -0,0 +1,40 @@
+import io
+from datetime import datetime
+import pytest
+from storage import get_storage
+
+
+@pytest.fixture
+def student(client, db):
+    client.post('/login', data={'email': 'student@test', 'password': 'secret'})
+    return db.users.find_one({'email': 'student@test'})
+
+
+def upload(client, assignment_id, content):
+    return client.post(f"/upload_submission/{assignment_id}",
+                       data={'file': (io.BytesIO(content), 'answer.pdf')}, content_type='multipart/form-data')
+
+
+def test_reupload_replaces_legacy_file(client, db, student, tmp_path):
+    assignment_id = db.assignments.insert_one({'title': 'Essay', 'class_name': 'c'}).inserted_id
+    legacy_path = tmp_path / 'legacy.pdf'
+    legacy_path.write_bytes(b'%PDF-1.4 old')
+    db.submissions.insert_one({
+        'assignment_id': assignment_id, 'student_id': student['_id'], 'class_name': 'c',
+        'filename': 'legacy.pdf', 'file_path': str(legacy_path), 'upload_date': datetime(2024, 1, 1)
+    })
+
+    assert upload(client, assignment_id, b'%PDF-1.4 new').status_code == 302
+
+    submission = db.submissions.find_one({'assignment_id': assignment_id})
+    assert 'file_path' not in submission
+    assert get_storage(db).exists(submission['sha256'])
+    assert not legacy_path.exists()
+
+
+def test_first_upload_creates_submission(client, db, student):
+    assignment_id = db.assignments.insert_one({'title': 'Essay', 'class_name': 'c'}).inserted_id
+    upload(client, assignment_id, b'%PDF-1.4 answer')
+    submission = db.submissions.find_one({'assignment_id': assignment_id})
+    assert submission['student_id'] == student['_id'] and submission['class_name'] == 'c'
+    assert get_storage(db).exists(submission['sha256'])
@@ -0,0 +1,137 @@
+import hashlib
+from datetime import datetime, timedelta
+from bson.objectid import ObjectId
+import worker
+from grading import GradingError
+from job_queue import (
+    enqueue_job, claim_job, renew_lease, get_job,
+    JOB_PENDING, JOB_RUNNING, JOB_DONE, JOB_FAILED
+)
+from ocr_cache import store_extraction
+from pdf_text import extraction_settings, METHOD_OCR
+
+
+def test_enqueue_dedupes_active_jobs(db):
+    first = enqueue_job(db, 'grade_submission', {'submission_id': 's1'}, dedupe_field='submission_id')
+    assert enqueue_job(db, 'grade_submission', {'submission_id': 's1'}, dedupe_field='submission_id') == first
+    assert enqueue_job(db, 'grade_submission', {'submission_id': 's2'}, dedupe_field='submission_id') != first
+
+    db.jobs.update_one({'_id': ObjectId(first)}, {'$set': {'status': JOB_DONE}})
+    assert enqueue_job(db, 'grade_submission', {'submission_id': 's1'}, dedupe_field='submission_id') != first
+
+
+def test_claim_takes_oldest_runnable_job(db):
+    older = enqueue_job(db, 'grade_submission', {'submission_id': 's1'})
+    enqueue_job(db, 'grade_submission', {'submission_id': 's2'})
+    later = enqueue_job(db, 'grade_submission', {'submission_id': 's3'})
+    db.jobs.update_one({'_id': ObjectId(later)}, {'$set': {'run_after': datetime.now() + timedelta(hours=1)}})
+
+    job = claim_job(db, 'w1', ['grade_submission'])
+    assert str(job['_id']) == older
+    assert job['status'] == JOB_RUNNING and job['worker_id'] == 'w1' and job['attempts'] == 1
+    claim_job(db, 'w1', ['grade_submission'])
+    assert claim_job(db, 'w1', ['grade_submission']) is None
+
+
+def test_claim_filters_by_type(db):
+    enqueue_job(db, 'grade_batch', {'batch_id': 'b1'})
+    assert claim_job(db, 'w1', ['grade_submission']) is None
+    assert claim_job(db, 'w1', ['grade_batch'])['type'] == 'grade_batch'
+
+
+def test_expired_lease_is_reclaimed(db):
+    job_id = enqueue_job(db, 'grade_submission', {'submission_id': 's1'})
+    claim_job(db, 'dead-worker', lease_seconds=60)
+    assert claim_job(db, 'w2') is None
+
+    db.jobs.update_one({'_id': ObjectId(job_id)}, {'$set': {'lease_expires_at': datetime.now() - timedelta(seconds=1)}})
+    job = claim_job(db, 'w2')
+    assert str(job['_id']) == job_id
+    assert job['worker_id'] == 'w2' and job['attempts'] == 2
+
+
+def test_renewed_lease_is_not_reclaimed(db):
+    job_id = enqueue_job(db, 'grade_submission', {'submission_id': 's1'})
+    claim_job(db, 'w1', lease_seconds=0)
+    renew_lease(db, job_id, lease_seconds=60)
+    assert claim_job(db, 'w2') is None
+
+
+def run_one(db):
+    job = claim_job(db, 'test-worker', worker.JOB_HANDLERS.keys())
+    worker.process_job(db, job)
+    return get_job(db, job['_id'])
+
+
+def test_process_job_grades_submission(db, mock_ai, tmp_path):
+    pdf_bytes = b'%PDF-1.4 test submission'
+    pdf_path = tmp_path / 'submission.pdf'
+    pdf_path.write_bytes(pdf_bytes)
+    sha256 = hashlib.sha256(pdf_bytes).hexdigest()
+    store_extraction(db, sha256, extraction_settings(),
+                     {'text': 'Plants turn light into chemical energy.', 'page_methods': [METHOD_OCR]})
+    student_id = db.users.insert_one({'username': 'student', 'email': 'student@test', 'user_type': 'student'}).inserted_id
+    assignment_id = db.assignments.insert_one({
+        'title': 'Photosynthesis', 'teacher_id': 'teacher', 'class_name': 'c',
+        'reference_text': 'Light energy is converted to chemical energy.', 'reference_status': 'ready'
+    }).inserted_id
+    submission_id = db.submissions.insert_one({
+        'assignment_id': assignment_id, 'student_id': student_id, 'class_name': 'c',
+        'filename': 'submission.pdf', 'file_path': str(pdf_path), 'sha256': sha256
+    }).inserted_id
+    enqueue_job(db, 'grade_submission', {'submission_id': str(submission_id), 'assignment_id': str(assignment_id)})
+
+    job = run_one(db)
+
+    assert job['status'] == JOB_DONE
+    submission = db.submissions.find_one({'_id': submission_id})
+    assert str(submission['ai_score']) == str(mock_ai.score)
+    assert submission['ai_remarks'] == mock_ai.remarks
+    assert any(request['path'].startswith('/gemini') for request in mock_ai.requests)
+
+
+def test_process_job_grading_error_is_final(db, monkeypatch):
+    def handler(db, job):
+        raise GradingError('Submission file not found.')
+    monkeypatch.setitem(worker.JOB_HANDLERS, 'grade_submission', handler)
+    enqueue_job(db, 'grade_submission', {'submission_id': 's1'})
+
+    job = run_one(db)
+    assert job['status'] == JOB_FAILED
+    assert job['error'] == 'Submission file not found.'
+
+
+def test_process_job_retries_unexpected_errors(db, monkeypatch):
+    def handler(db, job):
+        raise RuntimeError('connection reset')
+    monkeypatch.setitem(worker.JOB_HANDLERS, 'grade_submission', handler)
+    enqueue_job(db, 'grade_submission', {'submission_id': 's1'}, max_attempts=2)
+
+    job = run_one(db)
+    assert job['status'] == JOB_PENDING
+    assert job['run_after'] > datetime.now()
+
+    db.jobs.update_one({'_id': job['_id']}, {'$set': {'run_after': datetime.now()}})
+    job = run_one(db)
+    assert job['status'] == JOB_FAILED
+    assert job['attempts'] == 2
+
+
+def test_failed_batch_job_fails_its_batch(db, monkeypatch):
+    def handler(db, job):
+        raise GradingError('Assignment not found.')
+    monkeypatch.setitem(worker.JOB_HANDLERS, 'grade_batch', handler)
+    batch_id = db.grading_batches.insert_one({'assignment_id': 'a1', 'status': 'pending'}).inserted_id
+    enqueue_job(db, 'grade_batch', {'batch_id': str(batch_id)})
+
+    run_one(db)
+    batch = db.grading_batches.find_one({'_id': batch_id})
+    assert batch['status'] == 'failed'
+    assert batch['error'] == 'Assignment not found.'
+
+
+def test_unknown_job_type_fails(db):
+    enqueue_job(db, 'no_such_job', {})
+    job = claim_job(db, 'test-worker')
+    worker.process_job(db, job)
+    assert get_job(db, job['_id'])['status'] == JOB_FAILED
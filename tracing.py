@@ -0,0 +1,125 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger('trace')
+
+_trace_id = contextvars.ContextVar('trace_id', default=None)
+_span_id = contextvars.ContextVar('span_id', default=None)
+
+# Attributes every LogRecord has; anything else was passed through `extra`.
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+def current_trace_id():
+    return _trace_id.get()
+
+
+def new_id():
+    return uuid.uuid4().hex[:16]
+
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one request or job; pass the result to `end_trace`.
+    Spans and log lines in between carry its id.
+    """
+    return _trace_id.set(trace_id or new_id()), _span_id.set(None)
+
+
+def end_trace(tokens):
+    trace_token, span_token = tokens
+    _span_id.reset(span_token)
+    _trace_id.reset(trace_token)
+
+
+@contextmanager
+def trace(trace_id=None):
+    tokens = start_trace(trace_id)
+    try:
+        yield _trace_id.get()
+    finally:
+        end_trace(tokens)
+
+
+@contextmanager
+def span(name, stage=None, **attributes):
+    """
+    Times a block of work and logs it at DEBUG with its trace and parent span.
+    With `stage`, the duration is also recorded in the grading_stage_seconds histogram.
+    """
+    span_id = new_id()
+    parent_id = _span_id.get()
+    token = _span_id.set(span_id)
+    start = time.perf_counter()
+    status = 'ok'
+    try:
+        yield attributes
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        _span_id.reset(token)
+        if stage:
+            STAGE_SECONDS.observe(duration, stage=stage)
+        logger.debug('span %s', name, extra={
+            'span': name, 'span_id': span_id, 'parent_span_id': parent_id,
+            'duration_ms': round(duration * 1000, 2), 'status': status, **attributes
+        })
+
+
+class _TraceFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, including any `extra` fields and the current trace id.
+    """
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%dT%H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_FIELDS and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=None, log_format=None):
+    """
+    Sets up root logging from LOG_LEVEL (INFO) and LOG_FORMAT ('text' or 'json').
+    DEBUG includes a line per trace span.
+    """
+    level = (level or os.environ.get('LOG_LEVEL', 'INFO')).upper()
+    log_format = log_format or os.environ.get('LOG_FORMAT', 'text')
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(_TraceFilter())
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s'))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level)
+    # urllib3 logs full request URLs at DEBUG, and the Gemini key travels in the query string.
+    logging.getLogger('urllib3').setLevel(logging.INFO)
+    # Our request log line replaces Werkzeug's access log unless debugging.
+    logging.getLogger('werkzeug').setLevel(logging.DEBUG if root.level <= logging.DEBUG else logging.WARNING)
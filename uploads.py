@@ -0,0 +1,108 @@
+import hashlib
+import os
+import tempfile
+from flask import Request, current_app
+from storage import touch_content
+
+COPY_CHUNK_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+# Per-route request body limits, in MB. MAX_UPLOAD_MB is the global ceiling.
+DEFAULT_MAX_UPLOAD_MB = 50
+DEFAULT_SUBMISSION_MAX_MB = 20
+DEFAULT_ASSIGNMENT_MAX_MB = 50
+
+
+def upload_limit(name, default_mb):
+    """
+    Returns a request size limit in bytes from the `<name>` environment variable (in MB).
+    """
+    return int(float(os.environ.get(name, default_mb)) * MB)
+
+
+def upload_tmp_dir(upload_folder):
+    # Temp files live under the upload folder so the final rename stays on one filesystem.
+    path = os.path.join(upload_folder, 'tmp')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class HashingFile:
+    """
+    A temporary file on disk that hashes and counts bytes as they are written.
+    Closing it deletes the file unless it was moved into place with `commit`.
+    """
+
+    def __init__(self, directory):
+        self._file = tempfile.NamedTemporaryFile(dir=directory, suffix='.part', delete=False)
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.committed = False
+
+    @property
+    def name(self):
+        return self._file.name
+
+    @property
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def commit(self, storage):
+        """
+        Flushes the upload to disk and hands it to a storage backend under its hash.
+        """
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        storage.put(self._file.name, self.sha256)
+        self.committed = True
+
+    def close(self):
+        self._file.close()
+        if not self.committed and os.path.exists(self._file.name):
+            os.remove(self._file.name)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+
+class UploadRequest(Request):
+    """
+    Streams every uploaded file straight to a hashing temp file instead of
+    buffering it in memory, so storing it later is a rename and the hash is free.
+    """
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile(upload_tmp_dir(current_app.config['UPLOAD_FOLDER']))
+
+
+def save_upload(file_storage, storage, db):
+    """
+    Stores an uploaded file under its content hash and returns its sha256 and size.
+    Streams that did not come through UploadRequest are copied and hashed first.
+    The content is registered with the garbage-collection sweep, which deletes
+    it later if no record ends up referring to it.
+    """
+    stream = file_storage.stream
+    if not isinstance(stream, HashingFile):
+        source = stream
+        source.seek(0)
+        stream = HashingFile(upload_tmp_dir(current_app.config['UPLOAD_FOLDER']))
+        try:
+            for chunk in iter(lambda: source.read(COPY_CHUNK_SIZE), b''):
+                stream.write(chunk)
+        except Exception:
+            stream.close()
+            raise
+    try:
+        touch_content(db, stream.sha256)
+    except Exception:
+        stream.close()
+        raise
+    stream.commit(storage)
+    return {'sha256': stream.sha256, 'size': stream.size}
@@ -0,0 +1,75 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from bson.objectid import ObjectId
+from models import User
+
+DEFAULT_MAX_ENTRIES = 1024
+DEFAULT_TTL_SECONDS = 60
+
+# Only the fields User keeps; never the password hash.
+USER_SESSION_FIELDS = {'username': 1, 'email': 1, 'user_type': 1, 'class_name': 1, 'subject': 1}
+
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+def user_cache_settings():
+    """
+    Reads the cache size and entry lifetime. The TTL bounds how long another
+    process can serve a profile that was changed elsewhere.
+    """
+    return {
+        'max_entries': int(os.environ.get('USER_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES)),
+        'ttl_seconds': float(os.environ.get('USER_CACHE_TTL_SECONDS', DEFAULT_TTL_SECONDS))
+    }
+
+
+def cache_user(user, settings=None):
+    settings = settings or user_cache_settings()
+    if settings['max_entries'] <= 0:
+        return
+    with _lock:
+        _cache[user.id] = (time.monotonic() + settings['ttl_seconds'], user)
+        _cache.move_to_end(user.id)
+        while len(_cache) > settings['max_entries']:
+            _cache.popitem(last=False)
+
+
+def get_user(db, user_id):
+    """
+    Returns the User for a session id from the cache, loading it with a
+    projected find_one on a miss or after the entry expired. None if unknown.
+    """
+    now = time.monotonic()
+    with _lock:
+        entry = _cache.get(user_id)
+        if entry is not None:
+            expires_at, user = entry
+            if expires_at > now:
+                _cache.move_to_end(user_id)
+                return user
+            del _cache[user_id]
+
+    if not ObjectId.is_valid(user_id):
+        return None
+    user_doc = db.users.find_one({'_id': ObjectId(user_id)}, USER_SESSION_FIELDS)
+    if user_doc is None:
+        return None
+    user = User(user_doc)
+    cache_user(user)
+    return user
+
+
+def invalidate_user(user_id):
+    """
+    Drops a cached user. Call after changing or deleting a user's profile.
+    """
+    with _lock:
+        _cache.pop(str(user_id), None)
+
+
+def clear_user_cache():
+    with _lock:
+        _cache.clear()
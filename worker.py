@@ -0,0 +1,152 @@
+from startup import StartupTimer, preload_grading_modules
+import logging
+import os
+import socket
+import time
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from database import get_database
+from job_queue import claim_job, complete_job, fail_job, defer_job, keep_lease
+from grading import grade_submission, GradingError
+from batch_grading import run_batch, mark_batch_failed
+from similarity import index_submission_file
+from reference import prepare_reference, mark_reference_failed, ReferenceNotReady
+from db_setup import ensure_indexes
+from storage import get_storage, collect_garbage
+from notification_outbox import start_dispatcher_thread
+from metrics import JOBS_TOTAL, JOB_SECONDS, start_metrics_server
+from tracing import configure_logging, trace
+
+RETRY_DELAY_SECONDS = 30
+REFERENCE_POLL_SECONDS = 10
+REFERENCE_WAIT_SECONDS = int(os.environ.get('REFERENCE_WAIT_SECONDS', 900))
+STORAGE_GC_INTERVAL_SECONDS = int(os.environ.get('STORAGE_GC_INTERVAL_SECONDS', 600))
+
+logger = logging.getLogger(__name__)
+
+
+def handle_grade_submission(db, job):
+    return grade_submission(db, job['payload']['submission_id'], job['payload'].get('force', False))
+
+
+def handle_grade_batch(db, job):
+    return run_batch(db, job['payload']['batch_id'])
+
+
+def handle_index_submission(db, job):
+    return index_submission_file(db, job['payload']['submission_id'])
+
+
+def handle_prepare_reference(db, job):
+    return prepare_reference(db, job['payload']['assignment_id'])
+
+
+JOB_HANDLERS = {
+    'prepare_reference': handle_prepare_reference,
+    'grade_submission': handle_grade_submission,
+    'grade_batch': handle_grade_batch,
+    'index_submission': handle_index_submission,
+}
+
+# Called once a job has failed for good, to close whatever it was working on.
+JOB_FAILURE_HANDLERS = {
+    'prepare_reference': lambda db, job, error: mark_reference_failed(db, job['payload']['assignment_id'], error),
+    'grade_batch': lambda db, job, error: mark_batch_failed(db, job['payload']['batch_id'], error),
+}
+
+
+def record_failure(db, job, error, retry_delay=None):
+    """
+    Records a failed attempt and, if the job will not be retried, runs its failure handler.
+    """
+    if fail_job(db, job, error, retry_delay=retry_delay) and job['type'] in JOB_FAILURE_HANDLERS:
+        JOB_FAILURE_HANDLERS[job['type']](db, job, error)
+
+
+def process_job(db, job):
+    """
+    Runs the handler for a claimed job and records the outcome.
+    Grading errors are final; anything else is retried after a delay.
+    Grading jobs whose reference answer is still being processed wait for it,
+    up to REFERENCE_WAIT_SECONDS after they were queued.
+    """
+    handler = JOB_HANDLERS.get(job['type'])
+    if handler is None:
+        fail_job(db, job, f"Unknown job type: {job['type']}")
+        return
+
+    job_info = {'job_id': str(job['_id']), 'job_type': job['type'], 'attempt': job['attempts']}
+    with trace(str(job['_id'])), JOB_SECONDS.time(type=job['type']):
+        try:
+            with keep_lease(db, job['_id']):
+                result = handler(db, job)
+            complete_job(db, job['_id'], result)
+            outcome = 'done'
+            logger.info("Job %s (%s) completed", job['_id'], job['type'], extra=job_info)
+        except ReferenceNotReady as e:
+            if datetime.now() - job['created_at'] > timedelta(seconds=REFERENCE_WAIT_SECONDS):
+                record_failure(db, job, f"Timed out waiting for the reference answer. {e}")
+                outcome = 'failed'
+                logger.warning("Job %s (%s) failed waiting for reference", job['_id'], job['type'], extra=job_info)
+            else:
+                defer_job(db, job, REFERENCE_POLL_SECONDS)
+                outcome = 'deferred'
+        except GradingError as e:
+            record_failure(db, job, e)
+            outcome = 'failed'
+            logger.warning("Job %s (%s) failed: %s", job['_id'], job['type'], e, extra=job_info)
+        except Exception as e:
+            record_failure(db, job, e, retry_delay=RETRY_DELAY_SECONDS)
+            outcome = 'retry'
+            logger.exception("Job %s (%s) errored, will retry", job['_id'], job['type'], extra=job_info)
+    JOBS_TOTAL.inc(type=job['type'], outcome=outcome)
+
+
+def run_worker(db, worker_id=None, poll_interval=1.0, once=False):
+    """
+    Claims and processes jobs until interrupted.
+    With `once=True`, returns as soon as the queue is empty.
+    """
+    worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}"
+    ensure_indexes(db)
+    logger.info("Grading worker %s started", worker_id)
+    next_gc = time.monotonic()
+
+    while True:
+        job = claim_job(db, worker_id, JOB_HANDLERS.keys())
+        if job is None:
+            if once:
+                return
+            # Sweep unreferenced uploads while idle; concurrent sweeps on other workers are safe.
+            if STORAGE_GC_INTERVAL_SECONDS and time.monotonic() >= next_gc:
+                next_gc = time.monotonic() + STORAGE_GC_INTERVAL_SECONDS
+                try:
+                    collect_garbage(db, get_storage(db))
+                except Exception:
+                    logger.exception("Storage garbage collection failed")
+            time.sleep(poll_interval)
+            continue
+        process_job(db, job)
+
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Background worker for AI grading jobs.')
+    parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds to wait when the queue is empty.')
+    parser.add_argument('--once', action='store_true', help='Exit once the queue is empty.')
+    parser.add_argument('--no-notifications', action='store_true', help='Do not send queued notifications from this worker.')
+    parser.add_argument('--metrics-port', type=int, default=int(os.environ.get('WORKER_METRICS_PORT', 0)),
+                        help='Serve Prometheus metrics on this port (0 disables).')
+    args = parser.parse_args()
+
+    configure_logging()
+    timer = StartupTimer('Grading worker')
+    preload_grading_modules(timer)
+    if args.metrics_port:
+        start_metrics_server(args.metrics_port)
+    db = get_database()
+    if not args.no_notifications:
+        start_dispatcher_thread(db)
+    timer.log_report()
+    run_worker(db, poll_interval=args.poll_interval, once=args.once)